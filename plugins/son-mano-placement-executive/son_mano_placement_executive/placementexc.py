@@ -45,7 +45,6 @@ class PlacementExecutive(ManoBasePlugin):
 
         self.version = 'v0.01'
         self.description = 'Placement Executive Plugin'
-        self.auto_heartbeat_rate = 0
 
         # register smr into the plugin manager
         super(self.__class__, self).__init__(version=self.version, description= self.description)
@@ -61,7 +61,8 @@ setup(
     license='Apache 2.0',
 
     packages=find_packages(),
-    install_requires=['amqpstorm', 'pytest'],
+    package_data={PLUGIN_NAME_CLEAR: ['schemas/*.yml']},
+    install_requires=['amqpstorm', 'pytest', 'requests', 'jsonschema'],
     setup_requires=['pytest-runner'],
 
     # To provide executable scripts, use entry points in preference to the
@@ -0,0 +1,180 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the admission control of service deployments.
+"""
+
+import logging
+import os
+import threading
+
+from collections import deque, OrderedDict
+
+LOG = logging.getLogger("plugin:slm:admission")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the admission control, can be overwritten by ENV variables.
+# Max. number of deployments waiting to be started
+ADMISSION_QUEUE_SIZE = int(os.environ.get("admission_queue_size", 1000))
+# Max. number of deployments running at the same time
+MAX_CONCURRENT_DEPLOYMENTS = int(os.environ.get("max_concurrent_deployments", 50))
+# Max. number of deployments the IA handles at the same time on one vim
+MAX_DEPLOYMENTS_PER_VIM = int(os.environ.get("max_deployments_per_vim", 10))
+
+# Priority classes, in the order they are served
+PRIORITIES = ['high', 'normal', 'low']
+DEFAULT_PRIORITY = 'normal'
+
+# Admission decisions
+ADMITTED = 'ADMITTED'
+QUEUED = 'QUEUED'
+REJECTED = 'REJECTED'
+
+
+def parse_priority(priority):
+    """
+    Returns the priority class named by the priority field of a request,
+    or None if it names none.
+    """
+    priority = str(priority).strip().lower()
+    return priority if priority in PRIORITIES else None
+
+
+class AdmissionController(object):
+    """
+    Limits the number of deployments running at the same time. Requests
+    beyond the limit wait in a bounded queue per priority class, and are
+    rejected once the queue is full. Queued deployments are started in
+    priority order as running ones finish.
+
+    Independently, the number of deployments the IA handles at the same
+    time on one vim is limited. Deployments wait for a slot on their vim
+    before they contact the IA.
+    """
+
+    def __init__(self,
+                 queue_size=ADMISSION_QUEUE_SIZE,
+                 max_active=MAX_CONCURRENT_DEPLOYMENTS,
+                 max_per_vim=MAX_DEPLOYMENTS_PER_VIM):
+        self.queue_size = queue_size
+        self.max_active = max_active
+        self.max_per_vim = max_per_vim
+
+        self._active = set()
+        self._queues = OrderedDict((priority, deque()) for priority in PRIORITIES)
+        self._queued = {}
+        # vim uuid -> deployments holding a slot / waiting for one
+        self._vim_slots = {}
+        self._vim_waiting = {}
+        self._vim_of = {}
+        self._lock = threading.Lock()
+
+    def submit(self, deployment_id, priority=DEFAULT_PRIORITY):
+        """
+        Decides on a new deployment. Returns the decision and, for queued
+        deployments, the number of deployments that will be started
+        before it.
+        """
+        priority = parse_priority(priority) or DEFAULT_PRIORITY
+        with self._lock:
+            if len(self._active) < self.max_active and len(self._queued) == 0:
+                self._active.add(deployment_id)
+                return ADMITTED, 0
+            if len(self._queued) >= self.queue_size:
+                return REJECTED, None
+
+            position = 0
+            for queue_priority, queue in self._queues.items():
+                position += len(queue)
+                if queue_priority == priority:
+                    break
+            self._queues[priority].append(deployment_id)
+            self._queued[deployment_id] = priority
+            return QUEUED, position
+
+    def release(self, deployment_id):
+        """
+        A deployment finished, or a queued one was cancelled. Returns the
+        ids of the queued deployments that can be started now.
+        """
+        started = []
+        with self._lock:
+            if deployment_id in self._queued:
+                self._queues[self._queued.pop(deployment_id)].remove(deployment_id)
+            self._active.discard(deployment_id)
+
+            while len(self._active) < self.max_active and self._queued:
+                for queue in self._queues.values():
+                    if queue:
+                        next_id = queue.popleft()
+                        del self._queued[next_id]
+                        self._active.add(next_id)
+                        started.append(next_id)
+                        break
+        return started
+
+    def acquire_vim(self, deployment_id, vim_uuid):
+        """
+        Returns True if the deployment got a slot on the vim. Otherwise
+        it waits for one, see release_vim().
+        """
+        with self._lock:
+            self._vim_of[deployment_id] = vim_uuid
+            slots = self._vim_slots.setdefault(vim_uuid, set())
+            if len(slots) < self.max_per_vim:
+                slots.add(deployment_id)
+                return True
+            self._vim_waiting.setdefault(vim_uuid, deque()).append(deployment_id)
+            return False
+
+    def release_vim(self, deployment_id):
+        """
+        Frees the vim slot of a deployment, or stops it waiting for one.
+        Returns the id of the deployment that got the slot, if any.
+        """
+        with self._lock:
+            vim_uuid = self._vim_of.pop(deployment_id, None)
+            if vim_uuid is None:
+                return None
+            waiting = self._vim_waiting.get(vim_uuid, deque())
+            if deployment_id in waiting:
+                waiting.remove(deployment_id)
+                return None
+
+            slots = self._vim_slots[vim_uuid]
+            slots.discard(deployment_id)
+            next_id = None
+            if waiting:
+                next_id = waiting.popleft()
+                slots.add(next_id)
+            if not slots:
+                del self._vim_slots[vim_uuid]
+            if not waiting:
+                self._vim_waiting.pop(vim_uuid, None)
+            return next_id
+
+    def status(self):
+        with self._lock:
+            return {'active': len(self._active),
+                    'queued': dict((priority, len(queue)) for priority, queue in self._queues.items()),
+                    'vims': dict((vim, len(slots)) for vim, slots in self._vim_slots.items())}
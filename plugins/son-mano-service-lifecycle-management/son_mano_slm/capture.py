@@ -0,0 +1,156 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the capture of the requests the SLM sends to other
+components, for debugging.
+"""
+
+import logging
+import os
+import threading
+import time
+import yaml
+
+from collections import deque
+
+LOG = logging.getLogger("plugin:slm:capture")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the request capture, can be overwritten by ENV variables.
+# Number of requests kept in memory, capturing is disabled if 0
+REQUEST_CAPTURE_SIZE = int(os.environ.get("request_capture_size", 0))
+# File the captured requests are written to, only kept in memory if empty
+REQUEST_CAPTURE_PATH = os.environ.get("request_capture_path", "")
+# Size (in bytes) after which the file is rotated
+REQUEST_CAPTURE_MAX_BYTES = int(os.environ.get("request_capture_max_bytes", 10 * 1024 * 1024))
+# Number of rotated files that are kept
+REQUEST_CAPTURE_BACKUPS = int(os.environ.get("request_capture_backups", 3))
+
+
+class RequestCapture(object):
+    """
+    Keeps the last captured requests in a ring buffer. They can be dumped
+    on demand, and are written to a rotating file by a background thread
+    if a path is given.
+
+    capture() does not copy or serialize the request, the caller must not
+    modify it afterwards. Requests are only serialized when they are
+    dumped or written. When capturing is disabled, capture() returns
+    right away. If the writer falls behind, requests are not written to
+    the file, but they are kept in the ring buffer.
+    """
+
+    def __init__(self, size=REQUEST_CAPTURE_SIZE,
+                 path=REQUEST_CAPTURE_PATH,
+                 max_bytes=REQUEST_CAPTURE_MAX_BYTES,
+                 backups=REQUEST_CAPTURE_BACKUPS):
+        self.size = size
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._ring = deque(maxlen=max(size, 1))
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._cond = threading.Condition(self._lock)
+        self._dropped = 0
+        self._stopped = False
+        self._writer = None
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def start(self):
+        if not self.enabled or not self.path or self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def capture(self, kind, correlation_id, request):
+        """
+        Captures a request of this kind (e.g. the topic it is sent on).
+        """
+        if not self.enabled:
+            return
+        entry = {'kind': kind, 'correlation_id': correlation_id, 'time': time.time(), 'request': request}
+        with self._lock:
+            self._ring.append(entry)
+            if self._writer is not None:
+                if len(self._queue) < self.size:
+                    self._queue.append(entry)
+                    self._cond.notify()
+                else:
+                    self._dropped += 1
+
+    def dump(self, clear=False):
+        """
+        Returns the captured requests, oldest first.
+        """
+        with self._lock:
+            entries = list(self._ring)
+            if clear:
+                self._ring.clear()
+        return entries
+
+    def close(self):
+        with self._lock:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+            self._writer = None
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                self._cond.wait_for(lambda: self._queue or self._stopped)
+                if not self._queue:
+                    return
+                batch = list(self._queue)
+                self._queue.clear()
+                dropped, self._dropped = self._dropped, 0
+
+            if dropped:
+                LOG.info(str(dropped) + " captured requests not written, writer fell behind.")
+            try:
+                self._write(yaml.dump_all(batch, explicit_start=True, default_flow_style=False))
+            except Exception as e:
+                LOG.info("Writing captured requests failed: " + str(e))
+
+    def _write(self, data):
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(data)
+
+    def _rotate(self):
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            name = self.path + '.' + str(i)
+            if os.path.exists(name):
+                os.replace(name, self.path + '.' + str(i + 1))
+        os.replace(self.path, self.path + '.1')
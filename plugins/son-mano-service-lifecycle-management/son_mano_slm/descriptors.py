@@ -0,0 +1,193 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the validation of the descriptors in the service requests
+the SLM receives.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import yaml
+
+from collections import OrderedDict
+
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
+
+LOG = logging.getLogger("plugin:slm:descriptors")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the validation, can be overwritten by ENV variables.
+# Service requests are validated against the descriptor schemas, unless
+# this is set to false
+DESCRIPTOR_VALIDATION = os.environ.get("descriptor_validation", "true").lower() != "false"
+
+# Max. number of descriptors whose validation result is cached, 0 disables
+# the cache
+DESCRIPTOR_CACHE_SIZE = int(os.environ.get("descriptor_cache_size", 1000))
+
+# The schemas are stored as <kind>-<descriptor_version>.yml
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas')
+
+# Schema versions used for descriptors with an unknown descriptor_version
+DEFAULT_VERSIONS = {'nsd': '1.0', 'vnfd': 'vnfd-schema-01'}
+
+
+def fingerprint(descriptor):
+    """
+    Returns the uuid and a hash of the content of a descriptor.
+    """
+    content = json.dumps(descriptor, sort_keys=True, separators=(',', ':'), default=str)
+    return descriptor.get('uuid'), hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class DescriptorCache(object):
+    """
+    LRU cache of the validation results of descriptors, keyed by their kind,
+    uuid and content hash. A descriptor that is sent again unchanged with
+    the next request for the same service is not validated again.
+
+    Only the result (None or the error) is kept, not the descriptor, so an
+    entry takes about the same memory whatever the size of the descriptor.
+    """
+
+    def __init__(self, size=DESCRIPTOR_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns whether the key is cached, and the cached result.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+
+    def put(self, key, result):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DescriptorValidator(object):
+    """
+    Validates NSDs and VNFDs against the schema of their descriptor_version.
+    The schemas in the schema directory are loaded once, descriptors with a
+    version without schema are validated against the default version of
+    their kind. With a DescriptorCache, unchanged descriptors are only
+    validated once.
+    """
+
+    def __init__(self, schema_dir=SCHEMA_DIR, default_versions=DEFAULT_VERSIONS, cache=None):
+        self.default_versions = default_versions
+        self.cache = cache
+        self._validators = {}
+
+        for name in sorted(os.listdir(schema_dir)):
+            kind, sep, version = name[:-len('.yml')].partition('-')
+            if not name.endswith('.yml') or not sep or kind not in default_versions:
+                continue
+            with open(os.path.join(schema_dir, name), 'r') as f:
+                schema = yaml.safe_load(f)
+            Draft4Validator.check_schema(schema)
+            self._validators[(kind, version)] = Draft4Validator(schema)
+
+        for kind, version in default_versions.items():
+            if (kind, version) not in self._validators:
+                raise ValueError("No " + kind + " schema for default version " + version + " in " + schema_dir)
+
+    def validator(self, kind, version):
+        """
+        Returns the validator for descriptors of this kind ('nsd' or 'vnfd')
+        and version. Falls back to the default version of the kind.
+        """
+        validator = self._validators.get((kind, version))
+        if validator is None:
+            LOG.debug("No " + kind + " schema for version " + str(version) + ", using " + self.default_versions[kind] + ".")
+            validator = self._validators[(kind, self.default_versions[kind])]
+        return validator
+
+    def validate(self, kind, descriptor):
+        """
+        Validates a descriptor. Returns None if it is valid, and a description
+        of the most relevant error if not.
+        """
+        if not isinstance(descriptor, dict):
+            return kind.upper() + ' is not a dictionary'
+
+        if self.cache is None:
+            return self._validate(kind, descriptor)
+
+        key = (kind,) + fingerprint(descriptor)
+        cached, error = self.cache.get(key)
+        if not cached:
+            error = self._validate(kind, descriptor)
+            self.cache.put(key, error)
+        return error
+
+    def _validate(self, kind, descriptor):
+        version = descriptor.get('descriptor_version')
+        if isinstance(version, (str, int, float)):
+            version = str(version)
+        else:
+            # the schema reports the invalid version
+            version = None
+        error = best_match(self.validator(kind, version).iter_errors(descriptor))
+        if error is None:
+            return None
+
+        path = '/'.join(str(p) for p in error.absolute_path)
+        return kind.upper() + ' ' + (path + ': ' if path else '') + error.message
+
+    def validate_request(self, service_request):
+        """
+        Validates the NSD and VNFDs of a service request. Returns None if they
+        are valid, and the error for the GK if not.
+        """
+        error = self.validate('nsd', service_request['NSD'])
+        if error is not None:
+            return error
+
+        for key in sorted(service_request.keys()):
+            if key[:4] == 'VNFD':
+                error = self.validate('vnfd', service_request[key])
+                if error is not None:
+                    return key + ': ' + error
+        return None
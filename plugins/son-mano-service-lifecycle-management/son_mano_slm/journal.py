@@ -0,0 +1,207 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the journal in which the SLM records the state of the
+deployments and updates it is handling, so they can be recovered after
+a restart.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+LOG = logging.getLogger("plugin:slm:journal")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the journal, can be overwritten by ENV variables.
+# Location of the journal file, journaling is disabled if empty
+JOURNAL_PATH = os.environ.get("slm_journal_path", "")
+# Max. time (in seconds) appended entries are collected before they are
+# written and synced to disk in one go
+JOURNAL_COMMIT_INTERVAL = float(os.environ.get("slm_journal_commit_interval", 0.01))
+# The journal is compacted once it holds this many obsolete entries
+JOURNAL_COMPACT_THRESHOLD = int(os.environ.get("slm_journal_compact_threshold", 1000))
+
+# Entries in these states end a deployment or update
+FINAL_STATES = ['DONE', 'FAILED']
+
+
+class Journal(object):
+    """
+    Append-only journal of state transitions. Each line is a JSON object
+    with the kind ('deployment' or 'update'), id, state and optional data
+    of an entry. The data of an entry is kept until it reaches a final
+    state.
+
+    append() only queues the entry. A background thread writes all queued
+    entries and syncs the file once (group commit), so the callers never
+    wait for the disk. When enough entries became obsolete, the journal is
+    rewritten with only the pending entries.
+    """
+
+    def __init__(self, path,
+                 commit_interval=JOURNAL_COMMIT_INTERVAL,
+                 compact_threshold=JOURNAL_COMPACT_THRESHOLD):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.compact_threshold = compact_threshold
+
+        # (kind, id) -> latest entry of the pending deployments/updates
+        self._pending = OrderedDict()
+        self._lines = 0
+
+        self._queue = []
+        self._appended = 0
+        self._committed = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._file = None
+        self._writer = None
+
+    def replay(self):
+        """
+        Reads the journal and returns the entries of the deployments and
+        updates that did not reach a final state, in the order they were
+        started. The journal is compacted to these entries. Must be
+        called before start().
+        """
+        self._pending = OrderedDict()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a crash can leave the last line incomplete
+                        LOG.info("Skipping corrupt journal line.")
+                        continue
+                    self._apply(entry)
+        self._compact()
+        return list(self._pending.values())
+
+    def start(self):
+        self._file = open(self.path, 'a')
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def append(self, kind, entry_id, state, data=None):
+        """
+        Queues an entry. The data is serialized right away, so the caller
+        can continue to modify it.
+        """
+        entry = {'kind': kind, 'id': entry_id, 'state': state, 'time': time.time()}
+        if data is not None:
+            entry['data'] = data
+        line = json.dumps(entry, default=str)
+        with self._cond:
+            self._queue.append(line)
+            self._appended += 1
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """
+        Waits until all entries appended so far are on disk. Returns False
+        on time-out.
+        """
+        with self._cond:
+            target = self._appended
+            return self._cond.wait_for(lambda: self._committed >= target or self._stopped, timeout)
+
+    def close(self):
+        self.flush(timeout=5)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join(5)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _apply(self, entry):
+        key = (entry['kind'], entry['id'])
+        self._lines += 1
+        if entry['state'] in FINAL_STATES:
+            self._pending.pop(key, None)
+            return
+        if 'data' not in entry and key in self._pending:
+            entry['data'] = self._pending[key].get('data')
+        if key not in self._pending:
+            self._pending[key] = entry
+        else:
+            self._pending[key].update(entry)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._stopped)
+                if self._stopped and not self._queue:
+                    return
+            # collect the entries appended while we wait, they are
+            # committed together
+            if self.commit_interval > 0:
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch = self._queue
+                self._queue = []
+                target = self._appended
+
+            try:
+                self._file.write('\n'.join(batch) + '\n')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                for line in batch:
+                    self._apply(json.loads(line))
+                if self._lines - len(self._pending) > self.compact_threshold:
+                    self._compact()
+            except Exception:
+                LOG.exception("Writing the journal failed.")
+
+            with self._cond:
+                self._committed = target
+                self._cond.notify_all()
+
+    def _compact(self):
+        """
+        Rewrites the journal with the latest entry of each pending
+        deployment and update. The new file replaces the old one
+        atomically.
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self._pending.values():
+                f.write(json.dumps(entry, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(self._pending)
+
+        if self._file is not None:
+            self._file.close()
+            self._file = open(self.path, 'a')
+        LOG.debug("Journal compacted to " + str(self._lines) + " entries.")
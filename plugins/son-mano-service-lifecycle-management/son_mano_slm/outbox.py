@@ -0,0 +1,362 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the outbox of the SLM: the records it stores and the
+messages it sends to the GK are queued, and delivered in the background
+with retries.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+try:
+    from son_mano_slm import journal
+except:
+    import journal
+
+LOG = logging.getLogger("plugin:slm:outbox")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the outbox, can be overwritten by ENV variables.
+# File in which queued entries are journaled, kept in memory only if empty
+OUTBOX_PATH = os.environ.get("slm_outbox_path", "")
+# Number of delivery attempts of an entry before it is given up
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("outbox_max_attempts", 5))
+# Delay (in seconds) before the first retry, doubled for each retry up to
+# the max. backoff
+OUTBOX_RETRY_BACKOFF = float(os.environ.get("outbox_retry_backoff", 0.5))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("outbox_max_backoff", 30.0))
+# Max. number of entries being delivered at the same time
+OUTBOX_BATCH_SIZE = int(os.environ.get("outbox_batch_size", 100))
+
+# States of the entries
+QUEUED = 'QUEUED'
+SENDING = 'SENDING'
+DELIVERED = 'DELIVERED'
+UNDELIVERABLE = 'UNDELIVERABLE'
+# The batch of the entry was reported, the entry is dropped from the journal
+DONE = 'DONE'
+
+
+class Outbox(object):
+    """
+    Queue of entries (record writes, notifications) that are delivered by
+    a background dispatcher on an executor. Each entry has a target, the
+    function registered for it sends the entry and returns a result.
+    Entries that raise, or whose result the should_retry function of the
+    target rejects, are retried with exponential backoff.
+
+    Entries are put in batches for a group (e.g. a deployment). Within a
+    group, entries are delivered by stage: an entry is sent once all
+    entries of its group with a lower stage are finished. Batches put
+    later for a group are delivered after the earlier ones. Once all
+    entries of a batch are finished, on_done is called with the group and
+    the entries, each with its state and result.
+
+    Every entry has a key that stays the same over retries and restarts,
+    the targets send it along so the receiver can drop duplicates. With a
+    path, entries are journaled before they are sent and recovered after a
+    restart. Recovered batches are reported to on_recovered.
+    """
+
+    def __init__(self, executor, path=OUTBOX_PATH,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 backoff=OUTBOX_RETRY_BACKOFF,
+                 max_backoff=OUTBOX_MAX_BACKOFF,
+                 batch_size=OUTBOX_BATCH_SIZE,
+                 on_recovered=None):
+        """
+        :param executor: concurrent.futures executor the entries are sent on
+        :param path: journal file, entries are only kept in memory if empty
+        :param max_attempts: delivery attempts of an entry
+        :param backoff: delay before the first retry in seconds
+        :param max_backoff: max. delay between retries in seconds
+        :param batch_size: max. number of entries sent at the same time
+        :param on_recovered: called as on_recovered(group, entries) for recovered batches
+        """
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self.on_recovered = on_recovered
+
+        self._targets = {}
+        # group -> entries not finished yet, ordered by stage
+        self._groups = OrderedDict()
+        # batch id -> {'group', 'entries', 'left', 'on_done'}
+        self._batches = {}
+        self._sending = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._dispatcher = None
+
+        self.journal = journal.Journal(path) if path else None
+        self.delivered = 0
+        self.undeliverable = 0
+        self.retries = 0
+
+    def register_target(self, target, send, should_retry=None):
+        """
+        :param send: called as send(entry), returns the result of the delivery
+        :param should_retry: called as should_retry(result), True if the entry has to be sent again
+        """
+        self._targets[target] = (send, should_retry)
+
+    def recover(self):
+        """
+        Reads the journal and queues the entries that were not reported yet.
+        Must be called before start().
+        """
+        if self.journal is None:
+            return 0
+
+        recovered = []
+        for entry in self.journal.replay():
+            if entry['kind'] == 'outbox':
+                recovered.append(dict(entry['data'], state=entry['state']))
+        self.journal.start()
+
+        with self._cond:
+            for entry in recovered:
+                entry['attempts'] = 0
+                entry['due'] = 0
+                if entry['state'] == SENDING:
+                    # it may or may not have arrived, the key tells
+                    entry['state'] = QUEUED
+                batch = self._batches.setdefault(entry['batch'], {'group': entry['group'], 'entries': [], 'left': 0, 'on_done': self.on_recovered})
+                batch['entries'].append(entry)
+                if entry['state'] == QUEUED:
+                    batch['left'] += 1
+                    self._groups.setdefault(entry['group'], []).append(entry)
+            for entries in self._groups.values():
+                entries.sort(key=lambda e: e['stage'])
+
+        finished = [b for b in self._batches.values() if b['left'] == 0]
+        for batch in finished:
+            self._finish(batch)
+        LOG.info(str(len(recovered)) + " outbox entries recovered from journal.")
+        return len(recovered)
+
+    def start(self):
+        if self._dispatcher is not None:
+            return
+        self._dispatcher = threading.Thread(target=self._dispatch_loop)
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def put(self, group, entries, on_done=None):
+        """
+        Queues a batch of entries for a group. Each entry is a dictionary
+        with the 'target', an optional 'stage' (0) and 'key' (a uuid),
+        and the 'payload' handed to the target. Returns the queued entries.
+        """
+        if not entries:
+            if on_done is not None:
+                on_done(group, [])
+            return []
+
+        batch_id = str(uuid.uuid4())
+        with self._cond:
+            pending = self._groups.setdefault(group, [])
+            offset = pending[-1]['stage'] + 1 if pending else 0
+            queued = []
+            for entry in entries:
+                queued.append({'key': entry.get('key') or str(uuid.uuid4()),
+                               'group': group,
+                               'batch': batch_id,
+                               'target': entry['target'],
+                               'stage': entry.get('stage', 0) + offset,
+                               'payload': entry.get('payload'),
+                               'state': QUEUED,
+                               'attempts': 0,
+                               'due': 0})
+            queued.sort(key=lambda e: e['stage'])
+            pending.extend(queued)
+            self._batches[batch_id] = {'group': group, 'entries': queued, 'left': len(queued), 'on_done': on_done}
+
+            if self.journal is not None:
+                for entry in queued:
+                    self.journal.append('outbox', entry['key'], QUEUED, self._journaled(entry))
+            self._cond.notify()
+        return queued
+
+    def pending(self, group=None):
+        """
+        Returns the number of entries not delivered yet, of one group or
+        of all groups.
+        """
+        with self._cond:
+            if group is not None:
+                return len(self._groups.get(group, []))
+            return sum(len(entries) for entries in self._groups.values())
+
+    def status(self):
+        with self._cond:
+            return {'pending': sum(len(entries) for entries in self._groups.values()),
+                    'sending': self._sending,
+                    'delivered': self.delivered,
+                    'undeliverable': self.undeliverable,
+                    'retries': self.retries}
+
+    def flush(self, timeout=None):
+        """
+        Waits until all batches put so far are finished and reported.
+        Returns False on time-out.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._batches or self._stopped, timeout)
+
+    def sync(self, timeout=None):
+        """
+        Waits until the journal of the outbox is on disk.
+        """
+        if self.journal is not None:
+            return self.journal.flush(timeout)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._dispatcher is not None:
+            self._dispatcher.join(5)
+            self._dispatcher = None
+        if self.journal is not None:
+            self.journal.close()
+
+    def __len__(self):
+        return self.pending()
+
+    def _journaled(self, entry):
+        return dict((k, v) for k, v in entry.items() if k not in ['state', 'attempts', 'due'])
+
+    def _ready(self, now):
+        """
+        Returns the entries that can be sent now, and the time at which the
+        next entry waiting for a retry is due.
+        """
+        ready = []
+        next_due = None
+        for entries in self._groups.values():
+            stage = entries[0]['stage']
+            for entry in entries:
+                if entry['stage'] != stage:
+                    break
+                if entry['state'] != QUEUED:
+                    continue
+                if entry['due'] > now:
+                    next_due = entry['due'] if next_due is None else min(next_due, entry['due'])
+                    continue
+                if self._sending + len(ready) >= self.batch_size:
+                    return ready, next_due
+                ready.append(entry)
+        return ready, next_due
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    ready, next_due = self._ready(time.time())
+                    if ready:
+                        break
+                    timeout = None if next_due is None else max(next_due - time.time(), 0)
+                    self._cond.wait(timeout)
+                for entry in ready:
+                    entry['state'] = SENDING
+                self._sending += len(ready)
+
+            # the entries are on disk before anything is sent
+            if self.journal is not None:
+                self.journal.flush(timeout=5)
+            for entry in ready:
+                self.executor.submit(self._send, entry)
+
+    def _send(self, entry):
+        send, should_retry = self._targets[entry['target']]
+        retry = False
+        try:
+            result = send(entry)
+            retry = should_retry is not None and should_retry(result)
+        except Exception as e:
+            LOG.info("Sending " + entry['target'] + " " + entry['key'] + " failed: " + str(e))
+            result = {'error': str(e)}
+            retry = True
+
+        finished = None
+        with self._cond:
+            self._sending -= 1
+            entry['attempts'] += 1
+            entry['result'] = result
+            if retry and entry['attempts'] < self.max_attempts and not self._stopped:
+                self.retries += 1
+                entry['state'] = QUEUED
+                entry['due'] = time.time() + min(self.backoff * 2 ** (entry['attempts'] - 1), self.max_backoff)
+            else:
+                if retry:
+                    LOG.info("Giving up " + entry['target'] + " " + entry['key'] + " after " + str(entry['attempts']) + " attempts.")
+                    entry['state'] = UNDELIVERABLE
+                    self.undeliverable += 1
+                else:
+                    entry['state'] = DELIVERED
+                    self.delivered += 1
+                if self.journal is not None:
+                    self.journal.append('outbox', entry['key'], entry['state'], dict(self._journaled(entry), result=result))
+                # the next stage of the group can be sent
+                pending = self._groups[entry['group']]
+                pending.remove(entry)
+                if not pending:
+                    del self._groups[entry['group']]
+                batch = self._batches[entry['batch']]
+                batch['left'] -= 1
+                if batch['left'] == 0:
+                    finished = batch
+            self._cond.notify_all()
+
+        if finished is not None:
+            self._finish(finished)
+
+    def _finish(self, batch):
+        """
+        Reports a batch whose entries are all delivered or given up, and
+        drops it.
+        """
+        if batch['on_done'] is not None:
+            try:
+                batch['on_done'](batch['group'], batch['entries'])
+            except Exception:
+                LOG.exception("Callback of outbox group " + str(batch['group']) + " failed.")
+
+        with self._cond:
+            self._batches.pop(batch['entries'][0]['batch'], None)
+            if self.journal is not None:
+                for entry in batch['entries']:
+                    self.journal.append('outbox', entry['key'], DONE)
+            self._cond.notify_all()
@@ -0,0 +1,255 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the placement engine that selects the vim a service is
+deployed on.
+"""
+
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger("plugin:slm:placement")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the placement, can be overwritten by ENV variables.
+# Strategy used to select a vim: best-fit, worst-fit or spread
+PLACEMENT_STRATEGY = os.environ.get("placement_strategy", "best-fit")
+# Unit of the memory_total and memory_used fields of the IA vim list
+VIM_MEMORY_UNIT = os.environ.get("vim_memory_unit", "MB")
+# Max. time (in seconds) the resources of a deployed service stay reserved
+# if the vim list of the IA does not show them as used
+RESERVATION_TIMEOUT = float(os.environ.get("placement_reservation_timeout", 300))
+
+# Factors to convert memory sizes to GB
+MEMORY_UNITS = {'KB': 1.0 / 1024 ** 2, 'MB': 1.0 / 1024, 'GB': 1.0, 'TB': 1024.0}
+
+# Tolerance when resources from the vim list are compared with reservations
+EPSILON = 1e-6
+
+
+def best_fit(cpu_left, memory_left, cpu_total, memory_total, placements):
+    """
+    Prefers the vim with the least resources left after the placement,
+    keeping large vims free for large services.
+    """
+    return cpu_left / cpu_total + memory_left / memory_total
+
+
+def worst_fit(cpu_left, memory_left, cpu_total, memory_total, placements):
+    """
+    Prefers the vim with the most resources left after the placement.
+    """
+    return -(cpu_left / cpu_total + memory_left / memory_total)
+
+
+def spread(cpu_left, memory_left, cpu_total, memory_total, placements):
+    """
+    Prefers the vim with the fewest services placed by this SLM that are
+    not yet reflected in the vim list, the one with most resources left
+    on a tie.
+    """
+    return (placements, -(cpu_left / cpu_total + memory_left / memory_total))
+
+
+class PlacementEngine(object):
+    """
+    Selects a vim for a service from the vim list of the IA, based on the
+    free capacity of the vims (cores and memory) and the demand of the
+    service. Capacity reserved for services that were placed but are not
+    yet reflected in the vim list is taken into account. Reservations of
+    deployed services are dropped once the used resources of their vim
+    grew by their demand from one vim list to the next, or after
+    reservation_timeout seconds.
+
+    Strategies are functions that score a candidate vim, given the cpu
+    and memory left after the placement, its total cpu and memory and the
+    number of reservations on it. The feasible vim with the lowest score
+    is selected. Vims without capacity
+    information are only selected if no other vim fits, in list order.
+    """
+
+    def __init__(self, strategy=PLACEMENT_STRATEGY, memory_unit=VIM_MEMORY_UNIT, reservation_timeout=RESERVATION_TIMEOUT):
+        self.strategies = {'best-fit': best_fit, 'worst-fit': worst_fit, 'spread': spread}
+        self.strategy = strategy
+        self.memory_factor = MEMORY_UNITS[memory_unit]
+        self.reservation_timeout = reservation_timeout
+
+        # deployment id -> reservation
+        self._reservations = {}
+        # vim uuid -> [cpu, memory, placements] reserved on it
+        self._reserved = {}
+        # vim uuid -> (cpu, memory) used according to the last vim list
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def register_strategy(self, name, score):
+        self.strategies[name] = score
+
+    def place(self, deployment_id, vims, demand, strategy=None):
+        """
+        Selects a vim and reserves the demanded resources on it for the
+        deployment. Returns the vim_uuid, None if no vim fits.
+
+        :param deployment_id: id under which the reservation is kept
+        :param vims: vim list of the IA
+        :param demand: dictionary with the 'cpu' and 'memory' (in GB) the service needs
+        :param strategy: name of the strategy, the default one if None
+        """
+        score = self.strategies[strategy or self.strategy]
+        cpu = demand.get('cpu', 0)
+        memory = demand.get('memory', 0)
+
+        with self._lock:
+            reservations = self._reserved
+            best = None
+            best_score = None
+            unknown = None
+            for vim_uuid, cpu_total, cpu_free, memory_total, memory_free in self._capacities(vims):
+                if cpu_total is None:
+                    if unknown is None:
+                        unknown = vim_uuid
+                    continue
+                reserved = reservations.get(vim_uuid)
+                if reserved is None:
+                    cpu_left = cpu_free - cpu
+                    memory_left = memory_free - memory
+                    placements = 0
+                else:
+                    cpu_left = cpu_free - reserved[0] - cpu
+                    memory_left = memory_free - reserved[1] - memory
+                    placements = reserved[2]
+
+                if cpu_left < 0 or memory_left < 0:
+                    continue
+                candidate_score = score(cpu_left, memory_left, cpu_total, memory_total, placements)
+                if best is None or candidate_score < best_score:
+                    best = vim_uuid
+                    best_score = candidate_score
+
+            selected = best if best is not None else unknown
+            if selected is not None:
+                self._reserve(deployment_id, selected, cpu, memory)
+            return selected
+
+    def commit(self, deployment_id):
+        """
+        The service of the deployment is deployed. Its reservation is kept
+        until a vim list shows its resources as used.
+        """
+        with self._lock:
+            if deployment_id in self._reservations:
+                self._reservations[deployment_id]['committed'] = True
+                self._reservations[deployment_id]['committed_at'] = time.time()
+
+    def release(self, deployment_id):
+        """
+        Drops the reservation of a deployment, unless it is committed.
+        """
+        with self._lock:
+            reservation = self._reservations.get(deployment_id)
+            if reservation is not None and not reservation['committed']:
+                self._unreserve(deployment_id)
+
+    def on_vim_list_update(self, vims):
+        """
+        A new vim list was received. The growth of the used resources of
+        each vim since the last list is matched with the reservations of
+        services deployed on it, oldest first. Reservations that are
+        covered are dropped, their resources are part of the list now.
+        """
+        now = time.time()
+        with self._lock:
+            used = {}
+            for vim_uuid, cpu_total, cpu_free, memory_total, memory_free in self._capacities(vims):
+                if cpu_total is not None:
+                    used[vim_uuid] = (cpu_total - cpu_free, memory_total - memory_free)
+
+            committed = sorted([r['committed_at'], d] for d, r in self._reservations.items() if r['committed'])
+            growth = {}
+            for vim_uuid in used:
+                if vim_uuid in self._used:
+                    growth[vim_uuid] = [used[vim_uuid][0] - self._used[vim_uuid][0],
+                                        used[vim_uuid][1] - self._used[vim_uuid][1]]
+            for committed_at, deployment_id in committed:
+                reservation = self._reservations[deployment_id]
+                grown = growth.get(reservation['vim_uuid'])
+                if grown is not None and grown[0] >= reservation['cpu'] - EPSILON and grown[1] >= reservation['memory'] - EPSILON:
+                    grown[0] -= reservation['cpu']
+                    grown[1] -= reservation['memory']
+                    self._unreserve(deployment_id)
+                    continue
+                if grown is not None:
+                    # the younger reservations of this vim are not covered either
+                    grown[0] = grown[1] = -1
+                if now - committed_at > self.reservation_timeout:
+                    LOG.info("Resources of deployment " + str(deployment_id) + " not in the vim list after " + str(self.reservation_timeout) + "s, reservation dropped.")
+                    self._unreserve(deployment_id)
+            self._used.update(used)
+
+    def reserved(self, vim_uuid):
+        """
+        Returns the cpu and memory reserved on a vim.
+        """
+        with self._lock:
+            reserved = self._reserved.get(vim_uuid, (0, 0, 0))
+            return {'cpu': reserved[0], 'memory': reserved[1]}
+
+    def _capacities(self, vims):
+        """
+        Returns (vim_uuid, cpu_total, cpu_free, memory_total, memory_free)
+        for each vim of the list, memory in GB. The capacities are None if
+        the vim list does not report them.
+        """
+        capacities = []
+        for vim in vims:
+            try:
+                cpu_total = float(vim['core_total'])
+                memory_total = float(vim['memory_total']) * self.memory_factor
+                cpu_free = cpu_total - float(vim['core_used'])
+                memory_free = memory_total - float(vim['memory_used']) * self.memory_factor
+                if cpu_total <= 0 or memory_total <= 0:
+                    raise ValueError()
+                capacities.append((vim['vim_uuid'], cpu_total, cpu_free, memory_total, memory_free))
+            except (KeyError, TypeError, ValueError):
+                capacities.append((vim['vim_uuid'], None, None, None, None))
+        return capacities
+
+    def _reserve(self, deployment_id, vim_uuid, cpu, memory):
+        if deployment_id in self._reservations:
+            self._unreserve(deployment_id)
+        self._reservations[deployment_id] = {'vim_uuid': vim_uuid, 'cpu': cpu, 'memory': memory, 'committed': False, 'committed_at': None}
+        reserved = self._reserved.setdefault(vim_uuid, [0, 0, 0])
+        reserved[0] += cpu
+        reserved[1] += memory
+        reserved[2] += 1
+
+    def _unreserve(self, deployment_id):
+        reservation = self._reservations.pop(deployment_id)
+        reserved = self._reserved[reservation['vim_uuid']]
+        reserved[0] -= reservation['cpu']
+        reserved[1] -= reservation['memory']
+        reserved[2] -= 1
+        if reserved[2] == 0:
+            del self._reserved[reservation['vim_uuid']]
@@ -0,0 +1,392 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the http client used by `slm.py` to talk to the record
+repositories and the monitoring manager.
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import requests
+
+from collections import OrderedDict
+
+from requests.adapters import HTTPAdapter
+
+LOG = logging.getLogger("plugin:slm:repository")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the connection pools, can be overwritten by ENV variables.
+# Number of keep-alive connections kept per repository
+REPOSITORY_POOL_SIZE = int(os.environ.get("repository_pool_size", 10))
+# Timeout of a single request (in seconds)
+REPOSITORY_TIMEOUT = float(os.environ.get("repository_timeout", 10.0))
+# Number of retries of idempotent requests and the initial backoff (in seconds)
+REPOSITORY_RETRIES = int(os.environ.get("repository_retries", 2))
+REPOSITORY_BACKOFF = float(os.environ.get("repository_backoff", 0.2))
+
+# Size and time-to-live (in seconds) of the cache of fetched records
+RECORD_CACHE_SIZE = int(os.environ.get("record_cache_size", 1000))
+RECORD_CACHE_TTL = float(os.environ.get("record_cache_ttl", 30.0))
+
+# Requests with these methods can safely be repeated
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+
+# Responses of a repository that does not support PATCH requests
+PATCH_UNSUPPORTED = [405, 501]
+
+
+class RepositoryClient(object):
+    """
+    Http client for one repository (base url). Connections are kept alive
+    in a pool and reused by all requests. Idempotent requests are retried
+    with exponential backoff on connection errors, time-outs and 5xx
+    responses.
+    """
+
+    def __init__(self, base_url,
+                 pool_size=REPOSITORY_POOL_SIZE,
+                 timeout=REPOSITORY_TIMEOUT,
+                 retries=REPOSITORY_RETRIES,
+                 backoff=REPOSITORY_BACKOFF):
+        """
+        :param base_url: url all request paths are relative to
+        :param pool_size: max. number of kept-alive connections
+        :param timeout: default timeout of a request in seconds
+        :param retries: number of retries of idempotent requests
+        :param backoff: delay before the first retry in seconds, doubled for each retry
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # Unknown until the first PATCH request
+        self.supports_patch = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, path):
+        return '%s%s' % (self.base_url, path)
+
+    def request(self, method, path, **kwargs):
+        """
+        Perform a request on base_url + path. Arguments are the ones of
+        requests.request. Raises the exceptions of requests.
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = 1
+        if method in IDEMPOTENT_METHODS:
+            attempts = attempts + self.retries
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.session.request(method, self.url(path), **kwargs)
+                if response.status_code < 500 or last_attempt:
+                    return response
+                LOG.debug(method + ' ' + self.url(path) + ' returned ' + str(response.status_code) + ', retrying.')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    raise
+                LOG.debug(method + ' ' + self.url(path) + ' failed (' + str(e) + '), retrying.')
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def timed_request(self, method, path, **kwargs):
+        """
+        Perform a request and measure its duration. Instead of raising, it
+        returns a dictionary with the response (None on failure), the
+        exception that occured (None on success), the url and the duration
+        in seconds.
+        """
+        start = time.time()
+        response = None
+        exception = None
+        try:
+            response = self.request(method, path, **kwargs)
+        except Exception as e:
+            exception = e
+
+        return {'url': self.url(path), 'response': response, 'exception': exception, 'duration': time.time() - start}
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+class RecordCache(object):
+    """
+    Small LRU cache of recently fetched records, keyed by the record id.
+    Each entry remembers the version of the record, a lookup can require
+    a specific version, and the ETag the repository sent with it, if any.
+    Entries expire after ttl seconds, the oldest entry
+    is evicted when the cache is full. Copies are handed out, so callers
+    can modify the returned records.
+    """
+
+    def __init__(self, size=RECORD_CACHE_SIZE, ttl=RECORD_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, record_id, version=None):
+        """
+        Returns a copy of the cached record, or None if it is not cached,
+        expired or has another version than the requested one.
+        """
+        with self._lock:
+            entry = self._entries.get(record_id)
+            if entry is None:
+                return None
+            if time.time() - entry['stored_at'] > self.ttl:
+                del self._entries[record_id]
+                return None
+            if version is not None and str(entry['version']) != str(version):
+                return None
+            self._entries.move_to_end(record_id)
+            return copy.deepcopy(entry['record'])
+
+    def etag(self, record_id):
+        """
+        Returns the ETag of the cached record, None if it has none.
+        """
+        with self._lock:
+            entry = self._entries.get(record_id)
+            return None if entry is None else entry['etag']
+
+    def put(self, record_id, record, etag=None):
+        with self._lock:
+            self._entries[record_id] = {'record': copy.deepcopy(record),
+                                        'version': record.get('version'),
+                                        'etag': etag,
+                                        'stored_at': time.time()}
+            self._entries.move_to_end(record_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, record_id):
+        with self._lock:
+            self._entries.pop(record_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def fetch_records(client, collection, record_ids, executor, cache=None, revalidate=False):
+    """
+    Retrieves the records with the given ids from a collection of the
+    repository. Records found in the cache are not requested, the others
+    are fetched concurrently on the executor and added to the cache.
+    The repositories offer no bulk query, hence one GET per record.
+
+    Records that are the base of an update must be current. With
+    revalidate, cached records are requested with the ETag the repository
+    sent with them in an If-None-Match header, and only used if it answers
+    304. Cached records without an ETag, e.g. the ones the SLM stored
+    itself, are fetched again.
+
+    :param client: RepositoryClient of the repository
+    :param collection: path of the collection, e.g. 'vnf-instances'
+    :param record_ids: list of record ids
+    :param executor: concurrent.futures executor running the requests
+    :param cache: optional RecordCache
+    :param revalidate: check cached records with the repository
+    :return: dictionary record id -> record, None for records that could not be retrieved
+    """
+    records = {}
+    cached = {}
+    futures = {}
+    for record_id in record_ids:
+        if record_id in records or record_id in futures:
+            continue
+        if cache is not None:
+            cached[record_id] = cache.get(record_id)
+        if cached.get(record_id) is None:
+            futures[record_id] = executor.submit(client.timed_request, 'get', collection + '/' + record_id)
+        elif not revalidate:
+            records[record_id] = cached[record_id]
+        else:
+            headers = {}
+            etag = cache.etag(record_id)
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            futures[record_id] = executor.submit(client.timed_request, 'get', collection + '/' + record_id, headers=headers)
+
+    for record_id, future in futures.items():
+        result = future.result()
+        response = result['response']
+        records[record_id] = None
+        if response is not None and response.status_code == 304 and cached.get(record_id) is not None:
+            records[record_id] = cached[record_id]
+            cache.put(record_id, records[record_id], etag=response.headers.get('ETag') or cache.etag(record_id))
+        elif response is not None and response.status_code == 200:
+            records[record_id] = response.json()
+            if cache is not None:
+                cache.put(record_id, records[record_id], etag=response.headers.get('ETag'))
+        else:
+            LOG.debug('GET ' + result['url'] + ' failed: ' + str(result['exception'] or response.status_code))
+            if cache is not None:
+                cache.invalidate(record_id)
+
+    return records
+
+
+def merge_patch(old, new):
+    """
+    Computes the JSON merge patch (RFC 7386) that turns the old record
+    into the new one. Removed fields are set to None, lists are replaced
+    as a whole. A None value in the new record would become a removal as
+    well, see has_null_fields.
+    """
+    patch = {}
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub_patch = merge_patch(old[key], value)
+            if sub_patch:
+                patch[key] = sub_patch
+        elif value != old[key]:
+            patch[key] = value
+    return patch
+
+
+def apply_merge_patch(record, patch):
+    """
+    Applies a JSON merge patch (RFC 7386) to a record, returns the result.
+    The record is not modified.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(record) if isinstance(record, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def has_null_fields(record):
+    """
+    Returns whether a field of the record, or of a nested object, is None.
+    Such records can not be sent as a merge patch, as the field would be
+    removed instead of being stored as null. Lists are sent as a whole, so
+    their items are not checked.
+    """
+    if not isinstance(record, dict):
+        return False
+    return any(value is None or has_null_fields(value) for value in record.values())
+
+
+def update_record(client, path, old, new):
+    """
+    Replaces the old version of a record, as stored in the repository, by
+    the new one. Only the changed fields are sent, as a JSON merge patch.
+    The request carries the version of the old record in an If-Match
+    header, the repository answers with 412 if the record changed in the
+    meantime. Repositories without PATCH support get the full record with
+    a PUT, the client remembers they lack it. Records with null fields are
+    always sent with a PUT.
+
+    :return: the response of the repository
+    """
+    if client.supports_patch is not False and not has_null_fields(new):
+        headers = {'Content-Type': 'application/merge-patch+json'}
+        if old.get('version') is not None:
+            headers['If-Match'] = str(old['version'])
+        patch = merge_patch(old, new)
+        response = client.patch(path, data=json.dumps(patch), headers=headers)
+        if response.status_code not in PATCH_UNSUPPORTED:
+            client.supports_patch = True
+            return response
+        LOG.info(client.base_url + ' does not support PATCH, updating records with PUT.')
+        client.supports_patch = False
+
+    return client.put(path, data=json.dumps(new), headers={'Content-Type': 'application/json'})
+
+
+def summary(result):
+    """
+    Turns the result of timed_request into a dictionary that can be
+    serialized: the url, duration, status code (None on failure) and body
+    of the response (parsed if it is JSON), or the error.
+    """
+    response = result['response']
+    summary = {'url': result['url'], 'duration': result['duration'], 'status_code': None, 'body': None, 'error': None}
+    if response is None:
+        summary['error'] = str(result['exception'])
+        return summary
+
+    summary['status_code'] = response.status_code
+    try:
+        summary['body'] = response.json()
+    except ValueError:
+        summary['body'] = response.text
+    return summary
+
+
+def should_retry(summary):
+    """
+    Returns whether a request failed for a reason that can be temporary:
+    no response, 429 or a 5xx other than 501.
+    """
+    status_code = summary.get('status_code')
+    return status_code is None or status_code == 429 or (status_code >= 500 and status_code != 501)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url):
+    """
+    Returns the shared client of the given base url. All users of a
+    repository share its connection pool.
+    """
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = RepositoryClient(base_url)
+        return _clients[base_url]
@@ -0,0 +1,145 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the store of the service requests the SLM is handling.
+"""
+
+import threading
+import uuid
+
+
+class ServiceRequestStore(object):
+    """
+    Keeps the service requests that are being handled by the SLM. Each
+    request can be looked up in constant time by
+
+    * its current correlation id, which changes with every async call made
+      on behalf of the request,
+    * the original correlation id of the GK request,
+    * the correlation id of the SSM on-boarding request.
+
+    Lookups by current correlation id use the dictionary syntax, e.g.
+    store[corr_id], corr_id in store and store.pop(corr_id, None).
+    """
+
+    def __init__(self):
+        # current corr_id -> request
+        self._by_current = {}
+        # original corr_id -> current corr_id
+        self._current_of_original = {}
+        # on-boarding corr_id -> original corr_id
+        self._original_of_onboarding = {}
+        self._lock = threading.RLock()
+
+    def add(self, correlation_id, request):
+        """
+        Adds a new request, received with the given correlation id. This
+        id is stored as 'original_corr_id' in the request. Returns False if
+        a request with the same original correlation id is already being
+        handled.
+        """
+        with self._lock:
+            if correlation_id in self._current_of_original:
+                return False
+            request['original_corr_id'] = correlation_id
+            self._by_current[correlation_id] = request
+            self._current_of_original[correlation_id] = correlation_id
+            return True
+
+    def has_original(self, original_corr_id):
+        with self._lock:
+            return original_corr_id in self._current_of_original
+
+    def get_by_original(self, original_corr_id):
+        with self._lock:
+            current = self._current_of_original.get(original_corr_id)
+            return self._by_current.get(current)
+
+    def replace_corr_id(self, old_correlation_id):
+        """
+        Generates a new current correlation id for a request, to be used
+        for the next async call. Returns the new correlation id.
+        """
+        new_correlation_id = uuid.uuid4().hex
+        with self._lock:
+            request = self._by_current.pop(old_correlation_id)
+            self._by_current[new_correlation_id] = request
+            self._current_of_original[request['original_corr_id']] = new_correlation_id
+        return new_correlation_id
+
+    def renew_corr_id(self, original_corr_id):
+        """
+        Same as replace_corr_id, for the request with the given original
+        correlation id.
+        """
+        with self._lock:
+            return self.replace_corr_id(self._current_of_original[original_corr_id])
+
+    def set_onboarding_corr_id(self, correlation_id, onboarding_corr_id):
+        """
+        Stores the correlation id of the SSM on-boarding request of the
+        request with the given current correlation id.
+        """
+        with self._lock:
+            request = self._by_current[correlation_id]
+            request['corr_id_for_onboarding'] = onboarding_corr_id
+            self._original_of_onboarding[onboarding_corr_id] = request['original_corr_id']
+
+    def get_by_onboarding(self, onboarding_corr_id):
+        with self._lock:
+            original = self._original_of_onboarding.get(onboarding_corr_id)
+            return self.get_by_original(original)
+
+    def pop(self, correlation_id, *default):
+        """
+        Removes the request with the given current correlation id, and
+        returns it.
+        """
+        with self._lock:
+            if correlation_id not in self._by_current and default:
+                return default[0]
+            request = self._by_current.pop(correlation_id)
+            self._current_of_original.pop(request['original_corr_id'], None)
+            if 'corr_id_for_onboarding' in request:
+                self._original_of_onboarding.pop(request['corr_id_for_onboarding'], None)
+            return request
+
+    def pop_by_original(self, original_corr_id, *default):
+        with self._lock:
+            current = self._current_of_original.get(original_corr_id)
+            return self.pop(current, *default)
+
+    def get(self, correlation_id, default=None):
+        with self._lock:
+            return self._by_current.get(correlation_id, default)
+
+    def __getitem__(self, correlation_id):
+        with self._lock:
+            return self._by_current[correlation_id]
+
+    def __contains__(self, correlation_id):
+        with self._lock:
+            return correlation_id in self._by_current
+
+    def __len__(self):
+        return len(self._by_current)
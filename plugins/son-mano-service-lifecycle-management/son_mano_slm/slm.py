@@ -27,21 +27,47 @@ This is SONATA's service lifecycle management plugin
 import logging
 import yaml
 import time
-import requests
 import uuid
 import threading
 import json
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from sonmanobase.plugin import ManoBasePlugin
+from sonmanobase.lazylog import Payload, PayloadSampler
 try:
     from son_mano_slm import slm_helpers as tools
+    from son_mano_slm import repository
+    from son_mano_slm import workflow
+    from son_mano_slm import journal
+    from son_mano_slm import vim_inventory
+    from son_mano_slm import placement
+    from son_mano_slm import admission
+    from son_mano_slm import capture
+    from son_mano_slm import descriptors
+    from son_mano_slm import outbox
+    from son_mano_slm import timings
+    from son_mano_slm.request_store import ServiceRequestStore
 except:
     import slm_helpers as tools
+    import repository
+    import workflow
+    import journal
+    import vim_inventory
+    import placement
+    import admission
+    import capture
+    import descriptors
+    import outbox
+    import timings
+    from request_store import ServiceRequestStore
 
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger("plugin:slm")
-LOG.setLevel(logging.DEBUG)
+# Records, descriptors and messages are logged at DEBUG level, they are
+# only serialized if the slm_log_level ENV variable is set to DEBUG.
+LOG.setLevel(os.environ.get("slm_log_level", "INFO"))
+LOG.addFilter(PayloadSampler())
 
 #
 # Configurations
@@ -50,6 +76,10 @@ LOG.setLevel(logging.DEBUG)
 # of the GK are published
 GK_INSTANCE_CREATE_TOPIC = "service.instances.create"
 
+# The topic to which batches of service instantiation
+# requests of the GK are published
+GK_INSTANCE_BATCH_CREATE_TOPIC = "service.instances.batch.create"
+
 GK_INSTANCE_UPDATE = 'service.instances.update'
 
 # The topic to which service instance deploy replies
@@ -59,6 +89,17 @@ INFRA_ADAPTOR_INSTANCE_DEPLOY_REPLY_TOPIC = "infrastructure.service.deploy"
 # The topic to which available vims are published
 INFRA_ADAPTOR_AVAILABLE_VIMS = 'infrastructure.management.compute.list'
 
+# The topic on which the IA can push the updated list of vims
+INFRA_ADAPTOR_VIM_UPDATES = 'infrastructure.management.compute.update'
+
+# The topic on which the requests captured by the SLM can be dumped
+SLM_REQUEST_CAPTURE = 'platform.management.slm.capture'
+
+# The topics on which the latency histograms of the deployment phases,
+# and the phases of a single deployment can be queried
+SLM_METRICS = 'platform.management.slm.metrics'
+SLM_TIMINGS = 'platform.management.slm.timings'
+
 # Topics for interaction with the specific manager registry 
 SRM_ONBOARD = 'specific.manager.registry.ssm.on-board'
 SRM_START = 'specific.manager.registry.ssm.instantiate'
@@ -73,6 +114,23 @@ VNFR_REPOSITORY_URL = os.environ.get("url_vnfr_repository")
 # API. Link is red from ENV variable.
 MONITORING_REPOSITORY_URL = os.environ.get("url_monitoring_server")
 
+# Max. number of concurrent requests towards the repositories and the
+# monitoring manager when the records of deployed services are stored.
+RECORD_STORAGE_POOL_SIZE = int(os.environ.get("record_storage_pool_size", 10))
+
+# Max. time (in seconds) the SMR gets to on-board the SSMs of a service,
+# 0 waits forever.
+SSM_ONBOARDING_TIMEOUT = float(os.environ.get("ssm_onboarding_timeout", 300))
+
+# Records are posted to these paths of their repository, in this format.
+RECORD_TARGETS = {'vnfr': ('vnf-instances', 'application/x-yaml'),
+                  'nsr': ('ns-instances', 'application/json'),
+                  'monitoring': ('service/new', 'application/json')}
+
+# Deployments recovered from the journal in these states are restarted.
+# Later on, the IA might have deployed (parts of) the service already.
+RESUMABLE_STATES = [admission.QUEUED, workflow.REQUESTED, workflow.VIM_LIST, workflow.PLACEMENT]
+
 
 class ServiceLifecycleManager(ManoBasePlugin):
     """
@@ -92,9 +150,80 @@ class ServiceLifecycleManager(ManoBasePlugin):
         'on_lifecycle_start' method is called.
         :return:
         """
-        self.service_requests_being_handled = {}
+        self.service_requests_being_handled = ServiceRequestStore()
         self.service_updates_being_handled = {}
 
+        # Clients of the repositories, sharing keep-alive connections.
+        self.nsr_repository = repository.get_client(NSR_REPOSITORY_URL)
+        self.vnfr_repository = repository.get_client(VNFR_REPOSITORY_URL)
+        self.monitoring_repository = repository.get_client(MONITORING_REPOSITORY_URL)
+
+        # Records of a service are stored and retrieved concurrently on this pool.
+        self.record_storage_pool = ThreadPoolExecutor(max_workers=RECORD_STORAGE_POOL_SIZE)
+        # Recently stored or retrieved vnfrs, used when a service is updated.
+        self.vnfr_cache = repository.RecordCache()
+
+        # The vim list of the IA, shared by all deployments.
+        self.vim_inventory = vim_inventory.VimInventory()
+        self.vim_inventory_refresher = None
+        # Time the pending periodic vim list request was sent, if any.
+        self.vim_inventory_refresh_sent_at = None
+        # Deployments waiting for the vim list requested from the IA.
+        self.vim_list_waiters = []
+        self.vim_list_lock = threading.Lock()
+        # Selects the vims, keeps track of the resources of in-flight deployments.
+        self.placement = placement.PlacementEngine()
+        # Limits the number of deployments running, globally and per vim.
+        self.admission = admission.AdmissionController()
+
+        # The state transitions of deployments and updates are journaled,
+        # to recover them after a restart of the SLM.
+        self.journal = None
+        self.recovered_entries = []
+        if journal.JOURNAL_PATH:
+            self.journal = journal.Journal(journal.JOURNAL_PATH)
+            self.recovered_entries = self.journal.replay()
+            self.journal.start()
+            LOG.info(str(len(self.recovered_entries)) + " pending requests found in journal.")
+
+        # The descriptors of service requests are validated against their schema,
+        # descriptors sent again unchanged are not validated again.
+        self.descriptor_validator = descriptors.DescriptorValidator(cache=descriptors.DescriptorCache())
+
+        # The phases of each deployment are timed, from the receipt of the
+        # request until the GK is informed.
+        self.timings = timings.TimingRecorder()
+
+        # The requests sent to the IA can be captured for debugging.
+        self.request_capture = capture.RequestCapture()
+        self.request_capture.start()
+
+        # Each service deployment is a state machine, driven by the
+        # messages received for it on the pool of the workflow engine.
+        self.deployments = workflow.WorkflowEngine(on_failed=self.on_deployment_failed,
+                                                   on_finished=self.on_deployment_finished,
+                                                   on_transition=self.on_deployment_transition)
+        self.deployments.register_state(workflow.REQUESTED, self.start_new_service_deployment)
+        self.deployments.register_state(workflow.VIM_LIST, self.request_vim_list)
+        self.deployments.register_state(workflow.PLACEMENT, self.start_vim_selection)
+        self.deployments.register_state(workflow.IA_DEPLOY, self.request_deployment_from_IA)
+        self.deployments.register_state(workflow.RECORDS, self.store_service_records)
+        self.deployments.register_state(workflow.MONITORING, self.start_monitoring)
+        self.deployments.register_state(workflow.SSM_START, self.start_ssms)
+        self.deployments.register_task(workflow.TASK_SSM_START, self.on_ssm_start_ready)
+
+        # Records and messages for the GK are queued in the outbox, and
+        # delivered in the background with retries. The outbox is started
+        # once the SLM is registered.
+        self.record_clients = {'vnfr': self.vnfr_repository,
+                               'nsr': self.nsr_repository,
+                               'monitoring': self.monitoring_repository}
+        self.outbox = outbox.Outbox(self.record_storage_pool, on_recovered=self.on_outbox_recovered)
+        for target in RECORD_TARGETS:
+            self.outbox.register_target(target, self.send_record, repository.should_retry)
+        self.outbox.register_target('gk', self.send_to_gk)
+        self.outbox.recover()
+
         # call super class (will automatically connect to
         # broker and register the SLM to the plugin manger)
         super(self.__class__, self).__init__(version="0.1-dev", description="This is the SLM plugin")
@@ -120,10 +249,33 @@ class ServiceLifecycleManager(ManoBasePlugin):
             self.on_gk_service_instance_create, # function called when message received
             GK_INSTANCE_CREATE_TOPIC)           # topic to listen to
 
+        self.manoconn.register_async_endpoint(
+            self.on_gk_service_instance_batch_create,
+            GK_INSTANCE_BATCH_CREATE_TOPIC)
+
         self.manoconn.register_async_endpoint(
             self.on_gk_service_update,
             GK_INSTANCE_UPDATE)
 
+        self.manoconn.register_async_endpoint(
+            self.on_request_capture_dump,
+            SLM_REQUEST_CAPTURE)
+
+        self.manoconn.register_async_endpoint(
+            self.on_metrics_request,
+            SLM_METRICS)
+
+        self.manoconn.register_async_endpoint(
+            self.on_timings_request,
+            SLM_TIMINGS)
+
+        #
+        # IA -> SLM interface
+        #
+        self.manoconn.subscribe(
+            self.on_vim_inventory_update,
+            INFRA_ADAPTOR_VIM_UPDATES)
+
     def on_lifecycle_start(self, ch, method, properties, message):
         """
         This event is called when the plugin has successfully registered itself
@@ -141,6 +293,161 @@ class ServiceLifecycleManager(ManoBasePlugin):
         super(self.__class__, self).on_lifecycle_start(ch, method, properties, message)
         LOG.info("Lifecycle start event")
 
+    def on_registration_ok(self):
+        """
+        Once connected and registered, the requests recovered from the
+        journal are handled.
+        """
+        super(self.__class__, self).on_registration_ok()
+        self.outbox.start()
+        self.recover_requests()
+        self.start_vim_inventory_refresh()
+
+    def recover_requests(self):
+        """
+        Handles the deployments and updates that were in flight when the
+        SLM stopped. Deployments that did not contact the IA yet are
+        restarted. Deployments whose records were queued in the outbox are
+        finished by it. The others are failed, as it is unknown whether the
+        IA deployed them. Updates are failed as well.
+        """
+        entries, self.recovered_entries = self.recovered_entries, []
+        for entry in entries:
+            if entry['kind'] == 'update':
+                LOG.info("Update " + entry['id'] + " was interrupted, inform GK.")
+                message = {'status':'ERROR', 'error':'Update interrupted by restart of the SLM.'}
+                self.notify_gk(GK_INSTANCE_UPDATE, message, entry['data']['orig_corr_id'])
+                self.journal.append('update', entry['id'], workflow.FAILED)
+
+            elif self.outbox.pending(entry['id']):
+                #The outbox stores the records and informs the GK.
+                LOG.info("Deployment " + entry['id'] + " was interrupted in state " + entry['state'] + ", its records and reply are in the outbox.")
+                self.journal.append('deployment', entry['id'], workflow.DONE)
+
+            elif entry['state'] in RESUMABLE_STATES:
+                LOG.info("Deployment " + entry['id'] + " was interrupted in state " + entry['state'] + ", restarting it.")
+                self.service_requests_being_handled.add(entry['id'], entry['data'])
+                decision, position = self.admit_service(entry['id'], entry['data'])
+                if decision == admission.REJECTED:
+                    self.service_requests_being_handled.pop_by_original(entry['id'], None)
+                    self.inform_gk_with_error(entry['id'], error_msg='Too many service requests, please retry later.')
+                    self.journal.append('deployment', entry['id'], workflow.FAILED)
+
+            else:
+                LOG.info("Deployment " + entry['id'] + " was interrupted in state " + entry['state'] + ", inform GK.")
+                self.inform_gk_with_error(entry['id'], error_msg='Deployment interrupted by restart of the SLM.')
+                self.journal.append('deployment', entry['id'], workflow.FAILED)
+
+    def start_vim_inventory_refresh(self, interval=vim_inventory.VIM_INVENTORY_REFRESH_INTERVAL):
+        """
+        Starts a thread that periodically requests the vim list from the
+        IA, so deployments can use the cached list. No request is sent
+        while the previous one is unanswered, unless the cached list
+        expired. All requests use the same correlation id, so an IA that
+        does not answer leaves a single pending call behind.
+        """
+        if interval <= 0 or self.vim_inventory_refresher is not None:
+            return
+
+        correlation_id = str(uuid.uuid4())
+
+        def refresh():
+            while True:
+                sent_at = self.vim_inventory_refresh_sent_at
+                if sent_at is None or time.time() - sent_at >= vim_inventory.VIM_INVENTORY_TTL:
+                    self.vim_inventory_refresh_sent_at = time.time()
+                    self.manoconn.call_async(self.on_vim_inventory_refresh, INFRA_ADAPTOR_AVAILABLE_VIMS, None, correlation_id=correlation_id)
+                else:
+                    LOG.debug("Previous vim list request still pending, refresh skipped.")
+                time.sleep(interval)
+
+        self.vim_inventory_refresher = threading.Thread(target=refresh)
+        self.vim_inventory_refresher.daemon = True
+        self.vim_inventory_refresher.start()
+
+    def on_vim_inventory_refresh(self, ch, method, properties, message):
+        """
+        This method handles the reply of the IA to a periodic refresh.
+        """
+        self.vim_inventory_refresh_sent_at = None
+        self.on_vim_inventory_update(ch, method, properties, message)
+
+    def on_vim_inventory_update(self, ch, method, properties, message):
+        """
+        This method handles vim lists pushed by the IA or received on a
+        periodic refresh.
+        """
+        self.update_vim_inventory(yaml.load(message))
+
+    def update_vim_inventory(self, vims):
+        """
+        Caches a vim list received from the IA. The reservations of the
+        services deployed so far are dropped once it shows their resources
+        as used.
+        """
+        self.vim_inventory.update(vims)
+        if isinstance(vims, list):
+            self.placement.on_vim_list_update(vims)
+
+    def flush(self):
+        """
+        A draining SLM makes sure the journal and the outbox are on disk.
+        """
+        flushed = self.journal is None or self.journal.flush(timeout=5)
+        return self.outbox.sync(timeout=5) and flushed
+
+    def in_flight_work(self):
+        """
+        Deployments and updates span several callbacks, a draining SLM
+        has to wait until they are handled completely, and until the
+        outbox is delivered.
+        """
+        return (super(self.__class__, self).in_flight_work() +
+                len(self.service_requests_being_handled) +
+                len(self.service_updates_being_handled) +
+                len(self.outbox))
+
+    def on_request_capture_dump(self, ch, method, properties, message):
+        """
+        This method replies with the requests captured by the SLM, oldest
+        first. If the message has a 'clear' field set to True, the capture
+        is emptied.
+        """
+        if not self.request_capture.enabled:
+            return yaml.dump({'status': 'ERROR', 'error': 'Request capture is disabled.'})
+
+        request = yaml.load(message) if message else None
+        clear = isinstance(request, dict) and request.get('clear') is True
+        return yaml.dump({'status': 'OK', 'requests': self.request_capture.dump(clear=clear)})
+
+    def on_metrics_request(self, ch, method, properties, message):
+        """
+        This method replies with the latency histograms of the deployment
+        phases, and the state of the workflow engine, admission control
+        and outbox.
+        """
+        return yaml.dump({'status': 'OK',
+                          'phases': self.timings.histograms(),
+                          'states': self.deployments.metrics(),
+                          'admission': self.admission.status(),
+                          'outbox': self.outbox.status(),
+                          'timestamp': time.time()})
+
+    def on_timings_request(self, ch, method, properties, message):
+        """
+        This method replies with the phases of a deployment, the message
+        has its 'instance_uuid' or 'correlation_id'. Finished deployments
+        are kept up to TIMING_HISTORY_SIZE.
+        """
+        request = yaml.load(message) if message else None
+        if not isinstance(request, dict):
+            return yaml.dump({'status': 'ERROR', 'error': 'No instance_uuid or correlation_id given.'})
+
+        breakdown = self.timings.breakdown(request.get('instance_uuid') or request.get('correlation_id'))
+        if breakdown is None:
+            return yaml.dump({'status': 'ERROR', 'error': 'No timings for this service.'})
+        return yaml.dump({'status': 'OK', 'timings': breakdown})
+
     def on_gk_service_instance_create(self, ch, method, properties, message):
         """
         This is our first SLM specific event method. It is called when the SLM
@@ -155,6 +462,7 @@ class ServiceLifecycleManager(ManoBasePlugin):
         :return:
         """
 
+        received_at = time.time()
         LOG.info("Message received on service.instances.create corr_id: " + str(properties.correlation_id))
 
         #The request data is in the message as a yaml file,
@@ -176,97 +484,210 @@ class ServiceLifecycleManager(ManoBasePlugin):
         LOG.info("Checking whether request payload is formatted correctly.")
         # The request should not have a correlation_id that is already being
         # used by a different request path/track
-        for prop_id in self.service_requests_being_handled.keys():
-            if properties.correlation_id in self.service_requests_being_handled[prop_id]['original_corr_id']:
-                LOG.info("Request has correlation_id that is already in use.")
-                return yaml.dump({'status'   : 'ERROR',
-                                  'error'    : 'Correlation_id is already in use, please make sure to generate a new one.',
-                                  'timestamp': time.time()})
-
-        # The service request in the yaml file should be a dictionary
-        if not isinstance(service_request_from_gk, dict):
-            LOG.info("service request with corr_id " + properties.correlation_id + "rejected: Message is not a dictionary.")
+        if self.service_requests_being_handled.has_original(properties.correlation_id):
+            LOG.info("Request has correlation_id that is already in use.")
             return yaml.dump({'status'   : 'ERROR',
-                              'error'    : 'Message is not a dictionary',
+                              'error'    : 'Correlation_id is already in use, please make sure to generate a new one.',
                               'timestamp': time.time()})
 
-        # The dictionary should contain a 'NSD' key
-        if 'NSD' not in service_request_from_gk.keys():
-            LOG.info("service request with corr_id " + properties.correlation_id + "rejected: NSD is not a dictionary.")
+        error = self.check_service_request(service_request_from_gk)
+        validated_at = time.time()
+        if error is not None:
+            self.timings.record(None, timings.VALIDATION, received_at, validated_at)
+            LOG.info("service request with corr_id " + properties.correlation_id + " rejected: " + error)
             return yaml.dump({'status'   : 'ERROR',
-                              'error'    : 'No NSD field in dictionary',
+                              'error'    : error,
                               'timestamp': time.time()})
 
-        # Their should be as many VNFDx keys in the dictionary as their
-        # are network functions according to the NSD.
-        number_of_vnfds = 0
-        for key in service_request_from_gk.keys():
-            if key[:4] == 'VNFD':
-                number_of_vnfds = number_of_vnfds + 1
+        LOG.info("Request payload is formatted correctly, proceeding...")
 
-        if len(service_request_from_gk['NSD']['network_functions']) != number_of_vnfds:
-            LOG.info("service request with corr_id " + properties.correlation_id + "rejected: number of vnfds does not match nsd.")
+        if not self.add_service_request(properties.correlation_id, service_request_from_gk, received_at, validated_at):
+            LOG.info("Request has correlation_id that is already in use.")
+            return yaml.dump({'status'   : 'ERROR',
+                              'error'    : 'Correlation_id is already in use, please make sure to generate a new one.',
+                              'timestamp': time.time()})
 
+        #Admission control decides whether the deployment starts right away,
+        #waits in the queue, or is rejected because the SLM is overloaded.
+        decision, position = self.admit_service(properties.correlation_id, service_request_from_gk)
+        if decision == admission.REJECTED:
+            LOG.info("service request with corr_id " + properties.correlation_id + " rejected: queue is full.")
+            self.service_requests_being_handled.pop(properties.correlation_id, None)
             return yaml.dump({'status'   : 'ERROR',
-                              'error'    : 'Number of VNFDs doesn\'t match number of vnfs',
+                              'error'    : 'Too many service requests, please retry later.',
                               'timestamp': time.time()})
 
-        #Check whether a vnfd is none.
-        for key in service_request_from_gk.keys():
-            if key[:4] == 'VNFD':
-                if service_request_from_gk[key] is None:
-                    return yaml.dump({'status'   : 'ERROR',
-                                      'error'    : 'VNFDs are not allowed to be empty',
-                                      'timestamp': time.time()})
+        response_for_gk = {'status'  : 'INSTANTIATING', # INSTANTIATING, QUEUED or ERROR
+                          'error'    : None,            # NULL or a string describing the ERROR
+                          'timestamp': time.time()}     # time() returns the number of seconds since the epoch in UTC as a float      
+        if decision == admission.QUEUED:
+            response_for_gk['status'] = 'QUEUED'
+            response_for_gk['queue_position'] = position
 
-        LOG.info("Request payload is formatted correctly, proceeding...")
+        LOG.info('Response from SLM to GK on request: ' + str(response_for_gk))
+        return yaml.dump(response_for_gk)
 
-        #If all checks on the received message pass, an uuid is created for
-        #the service, and we add it to the dict of services being deployed.
-        #Each VNF also gets an uuid. This is added to the VNFD dictionary.
-        #The correlation_id is used as key for this dict, since it should
-        #be available in all the callback functions.
-        self.service_requests_being_handled[properties.correlation_id] = service_request_from_gk
+    def on_gk_service_instance_batch_create(self, ch, method, properties, message):
+        """
+        This method handles a batch of service requests, published by the
+        GK to GK_INSTANCE_BATCH_CREATE_TOPIC. The message has a 'services'
+        field with a list of service requests, formatted as the requests on
+        GK_INSTANCE_CREATE_TOPIC. Each service gets its own correlation_id,
+        the GK is informed about the deployment of each service on
+        GK_INSTANCE_CREATE_TOPIC with this correlation_id.
+        """
+
+        LOG.info("Message received on " + GK_INSTANCE_BATCH_CREATE_TOPIC + " corr_id: " + str(properties.correlation_id))
+        batch = yaml.load(message)
+
+        if not isinstance(batch, dict) or not isinstance(batch.get('services'), list):
+            LOG.info("batch request with corr_id " + str(properties.correlation_id) + " rejected: no list of services.")
+            return yaml.dump({'status'   : 'ERROR',
+                              'error'    : 'No services field with a list of service requests',
+                              'timestamp': time.time()})
+
+        #The services of a batch are admitted one after the other. They
+        #share the vim list requested from the IA, see request_vim_list.
+        statuses = []
+        for service_request in batch['services']:
+            corr_id = str(uuid.uuid4())
+            status = {'correlation_id': corr_id, 'status': 'ERROR', 'error': None}
+            statuses.append(status)
+
+            received_at = time.time()
+            status['error'] = self.check_service_request(service_request)
+            if status['error'] is not None:
+                self.timings.record(None, timings.VALIDATION, received_at)
+                continue
+
+            self.add_service_request(corr_id, service_request, received_at, time.time())
+            decision, position = self.admit_service(corr_id, service_request)
+            if decision == admission.REJECTED:
+                self.service_requests_being_handled.pop(corr_id, None)
+                status['error'] = 'Too many service requests, please retry later.'
+            elif decision == admission.QUEUED:
+                status['status'] = 'QUEUED'
+                status['queue_position'] = position
+            else:
+                status['status'] = 'INSTANTIATING'
+
+        accepted = [status for status in statuses if status['status'] != 'ERROR']
+        LOG.info("Batch with corr_id " + str(properties.correlation_id) + ": " + str(len(accepted)) + " of " + str(len(statuses)) + " services accepted.")
+
+        response_for_gk = {'status'   : 'INSTANTIATING' if accepted else 'ERROR',
+                           'error'    : None if accepted else 'No service of the batch accepted.',
+                           'services' : statuses,
+                           'timestamp': time.time()}
+        return yaml.dump(response_for_gk)
+
+    def check_service_request(self, service_request):
+        """
+        This method checks the format of a service request and validates its
+        descriptors, before any resources are requested for it. Returns None
+        if the request is valid, and the error for the GK if not.
+        """
 
+        error = tools.validate_service_request(service_request)
+        if error is None and 'priority' in service_request and admission.parse_priority(service_request['priority']) is None:
+            error = 'Invalid priority, use one of ' + ', '.join(admission.PRIORITIES)
+        if error is None and descriptors.DESCRIPTOR_VALIDATION:
+            error = self.descriptor_validator.validate_request(service_request)
+        return error
+
+    def add_service_request(self, correlation_id, service_request, received_at=None, validated_at=None):
+        """
+        This method adds a validated service request to the store of
+        services being deployed. An uuid is created for the service and
+        for each VNF, these are added to the descriptors. The timing of
+        the deployment starts at the receipt of the request. If the
+        request has a 'timings' field set to True, the phases are added to
+        the final message for the GK. Returns False if the correlation_id
+        is in use already.
+        """
+
+        #The correlation_id is used as key for this store, since it should
+        #be available in all the callback functions.
         #Since the key will change when new async calls are being made
-        #(each new call needs a unique corr_id), we need to keep track
+        #(each new call needs a unique corr_id), the store keeps track
         #of the original one to reply to the GK at a later stage.
-        self.service_requests_being_handled[properties.correlation_id]['original_corr_id'] = properties.correlation_id
+        if not self.service_requests_being_handled.add(correlation_id, service_request):
+            return False
 
-        self.service_requests_being_handled[properties.correlation_id]['NSD']['instance_uuid'] = str(uuid.uuid4())
-        LOG.info("instance uuid for service generated: " + self.service_requests_being_handled[properties.correlation_id]['NSD']['instance_uuid'])
+        service_request['NSD']['instance_uuid'] = str(uuid.uuid4())
+        LOG.info("instance uuid for service generated: " + service_request['NSD']['instance_uuid'])
 
-        for key in service_request_from_gk.keys():
+        for key in service_request.keys():
             if key[:4] == 'VNFD':
-                self.service_requests_being_handled[properties.correlation_id][key]['instance_uuid'] = str(uuid.uuid4())
-                LOG.info("instance uuid for vnf <" + key + "> generated: " + self.service_requests_being_handled[properties.correlation_id][key]['instance_uuid'])
+                service_request[key]['instance_uuid'] = str(uuid.uuid4())
+                LOG.info("instance uuid for vnf <" + key + "> generated: " + service_request[key]['instance_uuid'])
+
+        self.timings.start(correlation_id, received_at, service_request['NSD']['instance_uuid'],
+                           include_in_reply=service_request.get('timings') is True)
+        if received_at is not None and validated_at is not None:
+            self.timings.record(correlation_id, timings.VALIDATION, received_at, validated_at)
+        return True
+
+    def admit_service(self, correlation_id, service_request):
+        """
+        This method passes a service request, stored under its original
+        correlation id, to the admission control. Admitted requests are
+        deployed right away, queued ones once running deployments finish.
+        The request can have a 'priority' field: high, normal or low.
+        Returns the decision and the position in the queue.
+        """
+
+        priority = service_request.get('priority', admission.DEFAULT_PRIORITY)
+        decision, position = self.admission.submit(correlation_id, priority)
+        if decision == admission.ADMITTED:
+            self.deploy_service(correlation_id, service_request)
+        elif decision == admission.QUEUED:
+            LOG.info("Deployment of service request " + correlation_id + " queued at position " + str(position))
+            self.timings.begin(correlation_id, timings.ADMISSION)
+            if self.journal is not None:
+                self.journal.append('deployment', correlation_id, admission.QUEUED, service_request)
+        else:
+            self.timings.finish(correlation_id, admission.REJECTED)
+        return decision, position
+
+    def start_queued_service(self, correlation_id):
+        """
+        This method starts the deployment of a queued service request, and
+        informs the GK about it.
+        """
+
+        service_request = self.service_requests_being_handled.get_by_original(correlation_id)
+        if service_request is None:
+            return
+        LOG.info("Queued service request " + correlation_id + " admitted.")
+        self.timings.end(correlation_id, timings.ADMISSION)
+        response_for_gk = {'status': 'INSTANTIATING', 'error': None, 'timestamp': time.time()}
+        self.notify_gk(GK_INSTANCE_CREATE_TOPIC, response_for_gk, correlation_id)
+        self.deploy_service(correlation_id, service_request)
+
+    def deploy_service(self, correlation_id, service_request):
+        """
+        This method starts the deployment of a service request, which is
+        stored in service_requests_being_handled under its original
+        correlation id.
+        """
 
 	    #SSM handling: if NSD has service_specific_managers field,
-	    #then SLM contacts the SMR with this NSD.
-        #'ssms_ready_to_start' is set to false. This flag is used
-        #To make sure that both the ssm onboarding is finished and
-        #the service deployed before the ssm start trigger is made.
-        if 'service_specific_managers' in service_request_from_gk['NSD'].keys():
-            if len(service_request_from_gk['NSD']['service_specific_managers']) > 0:
-                LOG.info('SSMs needed for this service, trigger on-boarding process in SMR.')
-                corr_id_for_onboarding = str(uuid.uuid4())
-                self.service_requests_being_handled[properties.correlation_id]['corr_id_for_onboarding'] = corr_id_for_onboarding
-                self.manoconn.call_async(self.on_ssm_onboarding_return, SRM_ONBOARD, yaml.dump(service_request_from_gk['NSD']), correlation_id=corr_id_for_onboarding)
-                self.service_requests_being_handled[properties.correlation_id]['ssms_ready_to_start'] = False
-
-        #After the received request has been processed, we can start
-        #handling it in a different thread.
+	    #then SLM contacts the SMR with this NSD. The on-boarding runs
+        #next to the deployment, as a task of it.
+        corr_id_for_onboarding = None
+        if tools.needs_ssms(service_request['NSD']):
+            corr_id_for_onboarding = str(uuid.uuid4())
+            self.service_requests_being_handled.set_onboarding_corr_id(correlation_id, corr_id_for_onboarding)
+
+        #After the received request has been processed, its deployment
+        #is handled by the workflow engine, keyed by the original corr_id.
         LOG.info('Starting deployment of new service.')
-        t = threading.Thread(target=self.start_new_service_deployment, args=(ch, method, properties, message))
-        t.daemon = True
-        t.start()
+        self.deployments.start(correlation_id, service_request, self.build_deployment_tasks(service_request['NSD']))
 
-        response_for_gk = {'status'  : 'INSTANTIATING', # INSTANTIATING or ERROR
-                          'error'    : None,            # NULL or a string describing the ERROR
-                          'timestamp': time.time()}     # time() returns the number of seconds since the epoch in UTC as a float      
-
-        LOG.info('Response from SLM to GK on request: ' + str(response_for_gk))
-        return yaml.dump(response_for_gk)
+        if corr_id_for_onboarding is not None:
+            LOG.info('SSMs needed for this service, trigger on-boarding process in SMR.')
+            self.timings.begin(correlation_id, timings.SSM_ONBOARDING)
+            self.manoconn.call_async(self.on_ssm_onboarding_return, SRM_ONBOARD, yaml.dump(service_request['NSD']), correlation_id=corr_id_for_onboarding)
 
     def on_gk_service_update(self, ch, method, properties, message):
         """
@@ -278,33 +699,31 @@ class ServiceLifecycleManager(ManoBasePlugin):
 
         #get nsr from repository
         appendix_nsr_link = 'ns-instances/' + request['Instance_id']
-        nsr_response = requests.get(NSR_REPOSITORY_URL + appendix_nsr_link, timeout=10.0)
+        nsr_response = self.nsr_repository.get(appendix_nsr_link)
 
         if (nsr_response.status_code == 200):
             LOG.info("NSR retrieved successfully")
             nsr = nsr_response.json()
 
-            #get the vnfrs from repository
-            vnfrs = [] 
-            vnfr_dict = {}           
-            for vnfr_obj in nsr['network_functions']:
-                vnfr_id = vnfr_obj['vnfr_id']
-                vnfr_response = requests.get(VNFR_REPOSITORY_URL + 'vnf-instances/' + vnfr_id, timeout=10.0)
-                
-                if (vnfr_response.status_code == 200):
-                    vnfr = vnfr_response.json()
-                    vnfrs.append(vnfr)
-                    vnfr_dict[vnfr_id] = vnfr
-
-                else:
-                    LOG.info('retrieving vnfr failed, aborting...')
-                    error_message = {'status':'ERROR', 'error':'Updating failed, could not retrieve vnfr.'}
-                    return yaml.dump(error_message)
+            #get the vnfrs from repository, all at once.
+            vnfr_ids = [vnfr_obj['vnfr_id'] for vnfr_obj in nsr['network_functions']]
+            start = time.time()
+            vnfr_dict = repository.fetch_records(self.vnfr_repository, 'vnf-instances', vnfr_ids, self.record_storage_pool, cache=self.vnfr_cache, revalidate=True)
+            LOG.info('Retrieving ' + str(len(vnfr_ids)) + ' vnfrs took ' + '%.3f' % (time.time() - start) + 's')
+
+            if None in vnfr_dict.values():
+                LOG.info('retrieving vnfr failed, aborting...')
+                error_message = {'status':'ERROR', 'error':'Updating failed, could not retrieve vnfr.'}
+                return yaml.dump(error_message)
+            vnfrs = [vnfr_dict[vnfr_id] for vnfr_id in vnfr_ids]
         else:
             LOG.info('retrieving nsr failed, aborting...')
             error_message = {'status':'ERROR', 'error':'Updating failed, could not retrieve nsr.'}
             return yaml.dump(error_message)
 
+        #The record as it is stored, the next version is sent as a patch on it.
+        stored_nsr = tools.record_for_repository(nsr)
+
         nsr['status'] = 'updating'
         try:
             nsr['id'] = nsr['uuid']
@@ -316,31 +735,27 @@ class ServiceLifecycleManager(ManoBasePlugin):
         corr_id = str(uuid.uuid4())
         #keep track of running updates, so we can update the records after the response is received.
         self.service_updates_being_handled[corr_id] = {'nsd':request['NSD'], 'nsr':nsr, 'instance_id':request['Instance_id'], 'orig_corr_id':properties.correlation_id, 'vnfrs':vnfr_dict}
+        if self.journal is not None:
+            self.journal.append('update', corr_id, 'UPDATING', {'instance_id':request['Instance_id'], 'orig_corr_id':properties.correlation_id})
 
         #Change status of NSR to updating.
-        second_nsr_dict = {}
+        LOG.info("making request to change status of NSR to updating")
+        try:
+            nsr_response, stored_nsr = self.update_nsr(request['Instance_id'], stored_nsr, nsr)
+        except:
+            LOG.exception('storing the nsr failed, request denied.')
+            self.end_update(corr_id, workflow.FAILED)
+            message = {'status':'ERROR', 'error':'time-out on storing the record.'}
+            return yaml.dump(message)
+        self.service_updates_being_handled[corr_id]['stored_nsr'] = stored_nsr
 
-        #remove fields that SLM is not allowed to set.
-        for key in nsr.keys():  
-            if key not in ['uuid', 'created_at', 'updated_at']:
-                second_nsr_dict[key] = nsr[key]
-
-#        try:
-        link_for_put = NSR_REPOSITORY_URL + 'ns-instances/' + str(request['Instance_id'])
-        LOG.info("making put request to change status of NSR to updating")
-        nsr_response = requests.put(link_for_put, data=json.dumps(second_nsr_dict), headers={'Content-Type':'application/json'}, timeout=10.0)
-        
-        if nsr_response.status_code is not 200:
+        if nsr_response.status_code != 200:
             LOG.info('nsr updated failed, request denied.')
+            self.end_update(corr_id, workflow.FAILED)
             message = {'status':'ERROR', 'error':'could not update records.'}
             return yaml.dump(message)
 
-        LOG.info(nsr_response.json())
-     
-#        except:
-#            message = {'status':'ERROR', 'error':'time-out on storing the record.'}
-#            return yaml.dump(message)
-            
+        LOG.debug('NSR stored: %s', Payload(nsr_response.text))
 
         #Build request for SMR
         LOG.info('retrieving nsr and vnfrs succeeded, building message for SMR...')
@@ -359,7 +774,7 @@ class ServiceLifecycleManager(ManoBasePlugin):
         message_from_srm = yaml.load(message)
 
         LOG.info('Update report received from SMR, updating the records...')
-        LOG.info('Response from SMR: ' + yaml.dump(message, indent=4))
+        LOG.debug('Response from SMR: %s', Payload(message))
 
         if message_from_srm['status'] == 'Updated':
             message_from_srm['status'] = 'UPDATE_COMPLETED'
@@ -377,23 +792,20 @@ class ServiceLifecycleManager(ManoBasePlugin):
             except:
                 pass
 
-            second_nsr_dict = {}
-
-            #remove fields that SLM is not allowed to set.
-            for key in nsr.keys():  
-                if key not in ['uuid', 'created_at', 'updated_at']:
-                    second_nsr_dict[key] = nsr[key]
+            stored_nsr = self.service_updates_being_handled[properties.correlation_id]['stored_nsr']
 
             try:
-                nsr_response = requests.put(NSR_REPOSITORY_URL + 'ns-instances/' + str(instance_id), data=json.dumps(second_nsr_dict), headers={'Content-Type':'application/json'}, timeout=10.0)
+                nsr_response, second_nsr_dict = self.update_nsr(instance_id, stored_nsr, nsr)
                 
-                if nsr_response.status_code is not 200:
+                if nsr_response.status_code != 200:
                     message = {'status':'ERROR', 'error':'could not update records.'}
-                    self.manoconn.notify(GK_INSTANCE_UPDATE, yaml.dump(message), correlation_id=self.service_updates_being_handled[properties.correlation_id]['orig_corr_id']) 
+                    self.notify_gk(GK_INSTANCE_UPDATE, message, self.service_updates_being_handled[properties.correlation_id]['orig_corr_id'])
+                    self.end_update(properties.correlation_id, workflow.FAILED)
                     return       
             except:
                 message = {'status':'ERROR', 'error':'time-out on storing the record.'}
-                self.manoconn.notify(GK_INSTANCE_UPDATE, yaml.dump(message), correlation_id=self.service_updates_being_handled[properties.correlation_id]['orig_corr_id']) 
+                self.notify_gk(GK_INSTANCE_UPDATE, message, self.service_updates_being_handled[properties.correlation_id]['orig_corr_id'])
+                self.end_update(properties.correlation_id, workflow.FAILED)
                 return       
             
             message_from_srm['nsr'] = second_nsr_dict
@@ -402,108 +814,343 @@ class ServiceLifecycleManager(ManoBasePlugin):
         LOG.info('Reporting back to GK.')
         message_for_gk = message_from_srm
         #The SLM just takes the message from the SMR and forwards it towards the GK
-        self.manoconn.notify(GK_INSTANCE_UPDATE, yaml.dump(message_for_gk), correlation_id=self.service_updates_being_handled[properties.correlation_id]['orig_corr_id'])        
+        self.notify_gk(GK_INSTANCE_UPDATE, message_for_gk, self.service_updates_being_handled[properties.correlation_id]['orig_corr_id'])
+        #Handling of this update is finished.
+        self.end_update(properties.correlation_id, workflow.DONE)
+
+    def update_nsr(self, instance_id, stored_nsr, nsr):
+        """
+        This method stores a new version of an NSR. Only the fields that
+        changed since the stored version are sent to the repository.
+        Returns the response and the record as it is stored now.
+        """
+        #remove fields that SLM is not allowed to set.
+        second_nsr_dict = tools.record_for_repository(nsr)
+        nsr_response = repository.update_record(self.nsr_repository, 'ns-instances/' + str(instance_id), stored_nsr, second_nsr_dict)
+        return nsr_response, second_nsr_dict
+
+    def end_update(self, corr_id, state):
+        """
+        Handling of an update is finished.
+        """
+        self.service_updates_being_handled.pop(corr_id, None)
+        if self.journal is not None:
+            self.journal.append('update', corr_id, state)
+
+    def build_deployment_tasks(self, nsd):
+        """
+        This method builds the sub-tasks of a deployment. The SSMs of a
+        service are started once the service is deployed, registered at
+        the monitoring manager, and the SSMs are on-boarded. Services
+        without SSMs have no sub-tasks.
+        """
+
+        tasks = workflow.TaskGraph()
+        if tools.needs_ssms(nsd):
+            tasks.add(workflow.TASK_SERVICE_DEPLOYMENT)
+            tasks.add(workflow.TASK_MONITORING_REGISTRATION, requires=[workflow.TASK_SERVICE_DEPLOYMENT])
+            tasks.add(workflow.TASK_SSM_ONBOARDING, timeout=SSM_ONBOARDING_TIMEOUT or None)
+            tasks.add(workflow.TASK_SSM_START, requires=[workflow.TASK_SSM_ONBOARDING, workflow.TASK_MONITORING_REGISTRATION])
+        return tasks
 
     def on_ssm_onboarding_return(self, ch, method, properties, message):
         """
-        This method catches a reply on the ssm onboarding topic
+        This method catches a reply on the ssm onboarding topic. The SMR
+        replies with status 'On-boarded', anything else is a failure and
+        the SSMs are not started.
         """
 
         LOG.info("Response from SRM regarding on-boarding received.")
 
-        for service_request in self.service_requests_being_handled:
-            service_request = self.service_requests_being_handled[service_request]
-            #Check which service the response relates to.
-            if 'corr_id_for_onboarding' in service_request.keys():
-                if service_request['corr_id_for_onboarding'] == properties.correlation_id:
-                    #If service deployment is finished, the ssm start can be triggered.
-                    if service_request['ssms_ready_to_start'] == True:
-                        LOG.info("Request to start SSMs sent.")
-                        self.manoconn.call_async(self.on_ssm_start_return, SRM_START, yaml.dump(service_request['message_for_srm']))
-                        self.service.requests_being_handled.pop(service_request)
-                        break
-                    #If service deployment is not finished, this sets a flag to state
-                    #that onboarding is finished.
-                    else:
-                        LOG.info("Request to start SSMs is pending, waiting for service deployement to finish.")
-                        service_request['ssms_ready_to_start'] = True
-                        break
-                        
-
-    def start_new_service_deployment(self, ch, method, properties, message):
+        #Check which service the response relates to.
+        service_request = self.service_requests_being_handled.get_by_onboarding(properties.correlation_id)
+        if service_request is None:
+            LOG.info("No service request matches the on-boarding response.")
+            return
+
+        self.timings.end(service_request['original_corr_id'], timings.SSM_ONBOARDING)
+        try:
+            reply = yaml.load(message)
+        except yaml.YAMLError:
+            reply = None
+        if not isinstance(reply, dict):
+            error = 'Malformed on-boarding reply: ' + str(message)
+        elif reply.get('status') != 'On-boarded':
+            error = 'On-boarding failed: ' + str(reply.get('status')) + ', ' + str(reply.get('error'))
+        else:
+            error = None
+        self.deployments.finish_task(service_request['original_corr_id'], workflow.TASK_SSM_ONBOARDING, message, error=error)
+
+    def on_infra_adaptor_vim_list(self, ch, method, properties, message):
+        """
+        This method is called when the IA replies with the list of vims.
+        The list is cached and passed to all deployments waiting for it.
+        """
+        vims = yaml.load(message)
+        self.update_vim_inventory(vims)
+
+        with self.vim_list_lock:
+            waiters, self.vim_list_waiters = self.vim_list_waiters, []
+        for deployment_id in waiters:
+            self.deployments.post(deployment_id, 'vim_list', vims)
+
+    def on_infra_adaptor_service_deploy_reply(self, ch, method, properties, message):
+        """
+        This method is called when the Infrastructure Adaptor replies to a service deploy request from the SLM.
+        """
+        self.post_deployment_event(properties.correlation_id, 'ia_reply', message)
+
+    def post_deployment_event(self, correlation_id, event, message):
+        """
+        Replies on the calls made for a deployment are posted to the
+        workflow engine, which handles them on its pool. The message
+        broker threads are not blocked by the deployment.
+        """
+        service_request = self.service_requests_being_handled.get(correlation_id)
+        if service_request is None:
+            LOG.info("No service request matches the reply with corr_id " + str(correlation_id))
+            return
+        self.deployments.post(service_request['original_corr_id'], event, message)
+
+    def start_new_service_deployment(self, deployment, event, message):
         """
         This method initiates the deployment of a new service
         """
 
-        LOG.info("VIM list requested from IA, to facilitate service with uuid " + self.service_requests_being_handled[properties.correlation_id]['NSD']['instance_uuid'])
-        #First, we need to request a list of the available vims, in order
-        #to choose one to place the service on. This is done by sending
-        #a message with an empty body on the infrastructure.management.
-        #resource.list topic.
-        new_corr_id, self.service_requests_being_handled = tools.replace_old_corr_id_by_new(self.service_requests_being_handled, properties.correlation_id)
-        self.manoconn.call_async(self.start_vim_selection, INFRA_ADAPTOR_AVAILABLE_VIMS, None, correlation_id=new_corr_id)
+        LOG.info("Deployment of service with uuid " + deployment.context['NSD']['instance_uuid'] + " started.")
+        self.deployments.transition(deployment, workflow.VIM_LIST)
+
+    def request_vim_list(self, deployment, event, message):
+        """
+        This method requests the list of available vims from the IA.
+        """
 
-    def start_vim_selection(self, ch, method, properties, message):
+        if event == workflow.ENTER:
+            #Most deployments can use the cached vim list.
+            vim_list = self.vim_inventory.get()
+            if vim_list is not None:
+                LOG.info("Cached VIM list used for service with uuid " + deployment.context['NSD']['instance_uuid'])
+                deployment.context['vim_list'] = vim_list
+                self.deployments.transition(deployment, workflow.PLACEMENT)
+                return
+
+            #Deployments started together, e.g. from a batch, share the
+            #request for the vim list that is in flight.
+            with self.vim_list_lock:
+                self.vim_list_waiters.append(deployment.id)
+                if len(self.vim_list_waiters) > 1:
+                    LOG.info("VIM list already requested, service with uuid " + deployment.context['NSD']['instance_uuid'] + " waits for it.")
+                    return
+
+            LOG.info("VIM list requested from IA, to facilitate service with uuid " + deployment.context['NSD']['instance_uuid'])
+            #First, we need to request a list of the available vims, in order
+            #to choose one to place the service on. This is done by sending
+            #a message with an empty body on the infrastructure.management.
+            #resource.list topic.
+            self.manoconn.call_async(self.on_infra_adaptor_vim_list, INFRA_ADAPTOR_AVAILABLE_VIMS, None, correlation_id=str(uuid.uuid4()))
+
+        elif event == 'vim_list':
+            deployment.context['vim_list'] = message
+            self.deployments.transition(deployment, workflow.PLACEMENT)
+
+    def start_vim_selection(self, deployment, event, message):
         """
         This method manages the decision of which vim the service is going to be placed on.
         """
-        #For now, we will go through the vims in the list and check if they have enough resources for the service. Once we find such a vim, we stick with this one.
+        #The placement engine selects a vim with enough free resources for the service.
         #TODO: Outsource this process to an SSM if there is one available.
 
-        vimList = yaml.load(message)
-        LOG.info("VIM list received: " + yaml.dump(vimList, indent=4))
+        #The deployment got the slot on the selected vim it was waiting for.
+        if event == 'vim_slot':
+            self.deployments.transition(deployment, workflow.IA_DEPLOY)
+            return
+
+        vimList = deployment.context.pop('vim_list', None)
+        LOG.info("VIM list with " + str(len(vimList) if isinstance(vimList, list) else 0) + " vims received.")
 
         if not isinstance(vimList, list):
-            self.inform_gk_with_error(properties.correlation_id, error_msg='No VIM.')
+            self.deployments.fail(deployment, 'No VIM.')
             return
         if len(vimList) == 0:
-            self.inform_gk_with_error(properties.correlation_id, error_msg='No VIM.')
+            self.deployments.fail(deployment, 'No VIM.')
             return
 
         #TODO: If an SSM needs to select the vim, this is where to trigger it. Currently, an internal method is handling the decision.
-        #For now, we take the first one in the list, and just store the vim_uuid
-        self.service_requests_being_handled[properties.correlation_id]['vim'] = vimList[0]['vim_uuid']
-        LOG.info("VIM selected: " + yaml.dump(self.service_requests_being_handled[properties.correlation_id]['vim'], indent=4))
+        try:
+            demand = tools.build_resource_request(deployment.context, None)
+        except (KeyError, TypeError):
+            LOG.info("Resource requirements of the service are incomplete, placing it without.")
+            demand = {}
+
+        vim = self.placement.place(deployment.id, vimList, demand)
+        if vim is None:
+            self.deployments.fail(deployment, 'No VIM with enough resources.')
+            return
+
+        deployment.context['vim'] = vim
+        LOG.info("VIM selected: " + str(deployment.context['vim']))
 
-        self.request_deployment_from_IA(properties.correlation_id)
+        #The number of deployments the IA handles at once per vim is limited.
+        if not self.admission.acquire_vim(deployment.id, vim):
+            LOG.info("Deployment " + deployment.id + " waits for a free slot on vim " + vim)
+            return
+
+        self.deployments.transition(deployment, workflow.IA_DEPLOY)
 
-    def inform_gk_with_error(self, correlation_id, error_msg=None):
+    def release_vim_slot(self, deployment):
         """
-        This method informs the gk that no vim has the resources neede to deploy this service.
+        The IA finished the deployment on its vim, the next deployment
+        waiting for the vim can continue.
         """
+        next_id = self.admission.release_vim(deployment.id)
+        if next_id is not None:
+            self.deployments.post(next_id, 'vim_slot')
 
-        LOG.info("Inform GK of Error for service with instance uuid " + self.service_requests_being_handled[correlation_id]['NSD']['instance_uuid'])
+    def inform_gk_with_error(self, original_corr_id, error_msg=None):
+        """
+        This method informs the gk that the deployment of a service failed.
+        """
+
+        LOG.info("Inform GK of Error for service request with corr_id " + str(original_corr_id))
         response_message = {'status':'ERROR', 'error': error_msg, 'timestamp': time.time()}
-        self.manoconn.notify(GK_INSTANCE_CREATE_TOPIC, yaml.dump(response_message), correlation_id=self.service_requests_being_handled[correlation_id]['original_corr_id'])
+        self.add_timings(response_message, original_corr_id)
+        self.notify_gk(GK_INSTANCE_CREATE_TOPIC, response_message, original_corr_id)
 
+    def add_timings(self, message_for_gk, correlation_id):
+        """
+        This method adds the phases of a deployment to the final message
+        for the GK, if its request asked for them.
+        """
+        if self.timings.include_in_reply(correlation_id):
+            message_for_gk['timings'] = self.timings.breakdown(correlation_id)
 
-    def request_deployment_from_IA(self, correlation_id):
+    def notify_gk(self, topic, message, correlation_id):
         """
-        This method is triggered once a vim is selected to place the service on.
+        This method queues a message for the GK in the outbox. Messages
+        with the same correlation id are delivered in order.
         """
+        payload = {'topic': topic, 'message': yaml.dump(message), 'correlation_id': correlation_id}
+        queued_at = time.time()
 
-        request = tools.build_message_for_IA(self.service_requests_being_handled[correlation_id])
-        LOG.info('Request message for IA built: ' + yaml.dump(request, indent=4))
-        #In the service_requests_being_handled dictionary, we replace the old corr_id with the new one, to be able to keep track of the request
-        new_corr_id, self.service_requests_being_handled = tools.replace_old_corr_id_by_new(self.service_requests_being_handled, correlation_id)
-        LOG.info('Contacting the IA on infrastructure.service.deploy.')
-        self.manoconn.call_async(self.on_infra_adaptor_service_deploy_reply,
-                                 INFRA_ADAPTOR_INSTANCE_DEPLOY_REPLY_TOPIC,
-                                 yaml.dump(request),
-                                 correlation_id=new_corr_id)
+        def on_done(group, entries):
+            self.timings.record(correlation_id, timings.GK_NOTIFY, queued_at, status=message.get('status'), delivery=entries[0]['state'], attempts=entries[0]['attempts'])
 
-    def on_infra_adaptor_service_deploy_reply(self, ch, method, properties, message):
+        self.outbox.put(correlation_id, [{'target': 'gk', 'payload': payload}], on_done=on_done)
+
+    def send_to_gk(self, entry):
         """
-        This method is called when the Infrastructure Adaptor replies to a service deploy request from the SLM.
-        Based on the content of the reply message, the NSR has to be contacted.
-        The GK should be notified of the result of the service request.
+        This method sends a message for the GK queued in the outbox. The
+        outbox key is sent along as idempotency_key header.
         """
+        payload = entry['payload']
+        self.manoconn.notify(payload['topic'], payload['message'], correlation_id=payload['correlation_id'], headers={'idempotency_key': entry['key']})
 
-        LOG.info("Deployment reply received from IA for instance uuid " + self.service_requests_being_handled[properties.correlation_id]['NSD']['instance_uuid'])
+    def on_deployment_failed(self, deployment):
+        """
+        Called by the workflow engine when a deployment is aborted.
+        """
+        self.inform_gk_with_error(deployment.id, error_msg=deployment.error)
 
-        msg = yaml.load(message)
+    def on_deployment_transition(self, deployment):
+        """
+        Called by the workflow engine when a deployment changes state. The
+        request itself is journaled when the deployment starts. The time
+        spent in the previous state is recorded.
+        """
+        if deployment.timings:
+            state, duration = deployment.timings[-1]
+            self.timings.record(deployment.id, state.lower(), deployment.entered_at - duration, deployment.entered_at)
+        if self.journal is not None:
+            data = deployment.context if deployment.state == workflow.REQUESTED else None
+            self.journal.append('deployment', deployment.id, deployment.state, data)
+
+    def on_deployment_finished(self, deployment):
+        """
+        Called by the workflow engine when a deployment is done or failed.
+        Handling of the request is finished.
+        """
+        self.service_requests_being_handled.pop_by_original(deployment.id, None)
+        self.timings.finish(deployment.id, deployment.state)
+        self.placement.release(deployment.id)
+        self.release_vim_slot(deployment)
+        for correlation_id in self.admission.release(deployment.id):
+            self.start_queued_service(correlation_id)
+        timings = ', '.join(state + ': ' + '%.3f' % duration + 's' for state, duration in deployment.timings)
+        LOG.info("Deployment " + str(deployment.id) + " ended in state " + deployment.state + " after " + '%.3f' % deployment.duration() + "s (" + timings + ")")
+
+    def request_deployment_from_IA(self, deployment, event, message):
+        """
+        This method is triggered once a vim is selected to place the service on.
+        """
+
+        if event == workflow.ENTER:
+            request = tools.build_message_for_IA(deployment.context)
+            LOG.debug('Request message for IA built: %s', Payload(request))
+            #In the service_requests_being_handled store, we replace the old corr_id with the new one, to be able to keep track of the request
+            new_corr_id = self.service_requests_being_handled.renew_corr_id(deployment.id)
+            self.request_capture.capture(INFRA_ADAPTOR_INSTANCE_DEPLOY_REPLY_TOPIC, new_corr_id, request)
+            LOG.info('Contacting the IA on infrastructure.service.deploy.')
+            self.manoconn.call_async(self.on_infra_adaptor_service_deploy_reply,
+                                     INFRA_ADAPTOR_INSTANCE_DEPLOY_REPLY_TOPIC,
+                                     yaml.dump(request),
+                                     correlation_id=new_corr_id)
+
+        elif event == 'ia_reply':
+            LOG.info("Deployment reply received from IA for instance uuid " + deployment.context['NSD']['instance_uuid'])
+            msg = yaml.load(message)
+            LOG.debug('Response from IA: %s', Payload(msg))
+            self.release_vim_slot(deployment)
+
+            if msg['request_status'][:8] != 'DEPLOYED':
+                #The resources of the vim are not what we thought.
+                self.vim_inventory.invalidate(deployment.context['vim'])
+                self.placement.release(deployment.id)
+                self.deployments.fail(deployment, 'Deployment result: ' + msg['request_status'])
+                return
+
+            deployment.context['ia_reply'] = msg
+            self.placement.commit(deployment.id)
+            if deployment.tasks:
+                self.deployments.finish_task(deployment.id, workflow.TASK_SERVICE_DEPLOYMENT)
+            self.deployments.transition(deployment, workflow.RECORDS)
+
+    def store_service_records(self, deployment, event, message):
+        """
+        This method builds the records of the deployed service and queues
+        them in the outbox. Once they are stored, the reply for the GK is
+        built from the results.
+        """
+
+        if event == workflow.ENTER:
+            msg = deployment.context['ia_reply']
+
+            #The descriptors are indexed once for all records.
+            bundle = tools.ServiceBundle(deployment.context)
+            nsr = tools.build_nsr(bundle, msg)
+            LOG.debug('nsr built: %s', Payload(nsr))
+            #Retrieve VNFRs from message and translate
+            vnfrs = tools.build_vnfrs(bundle, msg['vnfrs'])
+            LOG.debug('vnfrs built: %s', Payload(vnfrs))
+            monitoring_message = tools.build_monitoring_message(bundle, msg, nsr, vnfrs)
+            LOG.debug('Monitoring message built: %s', Payload(monitoring_message, fmt='json'))
+
+            deployment.context['nsr'] = nsr
+            self.store_records(deployment.id, nsr, vnfrs, monitoring_message)
+
+        elif event == 'records_stored':
+            entries = message
+            deployment.context['record_timings'] = [{'url': e['result'].get('url'), 'duration': e['result'].get('duration')} for e in entries]
+            deployment.context['message_for_gk'] = self.build_message_for_gk(entries)
+            deployment.context['monitoring_result'] = [e['result'] for e in entries if e['target'] == 'monitoring'][0]
+            self.deployments.transition(deployment, workflow.MONITORING)
+
+    def build_message_for_gk(self, entries):
+        """
+        This method builds the reply for the GK from the results of the
+        record entries of the outbox. The stored records are added to it,
+        the errors of the others.
+        """
 
-        LOG.info("Response from IA: " + yaml.dump(msg, indent=4))
         #The message that will be returned to the gk
         message_for_gk = {}
         message_for_gk['status'] = 'ERROR'
@@ -512,106 +1159,179 @@ class ServiceLifecycleManager(ManoBasePlugin):
 
         message_for_gk['timestamp'] = time.time()
 
-        if msg['request_status'][:8] == 'DEPLOYED':
-            nsr = tools.build_nsr(self.service_requests_being_handled[properties.correlation_id], msg)
-            LOG.info('nsr built: ' + yaml.dump(nsr, indent=4))
-            #Retrieve VNFRs from message and translate
-            vnfrs = tools.build_vnfrs(self.service_requests_being_handled[properties.correlation_id], msg['vnfrs'])
-            LOG.info('vnfrs built: ' + yaml.dump(vnfrs, indent=4))
-            ## Store vnfrs in the repository and add vnfr ids to nsr if it is not already present
-            for vnfr in vnfrs:
-                #Store the message, catch exception when time-out occurs
-                try:
-                    vnfr_response = requests.post(VNFR_REPOSITORY_URL + 'vnf-instances', data=yaml.dump(vnfr), headers={'Content-Type':'application/x-yaml'}, timeout=10.0)
-                    #If storage succeeds, add vnfr to reply to gk
-                    if (vnfr_response.status_code == 200):
-                        message_for_gk['vnfrs'].append(vnfr)
-                    #If storage fails, add error code and message to rply to gk
-                        LOG.info('repo response for vnfr: ' + str(vnfr_response))
-                    else:
-                        message_for_gk['error']['vnfr'] = {'http_code': vnfr_response.status_code, 'message': vnfr_response.json()}
-                        LOG.info('vnfr to repo failed: ' + str(message_for_gk['error']['vnfr']))
-                        break
-                except:
-                    message_for_gk['error']['vnfr'] = {'http_code': '0', 'message': 'Timeout when contacting server'}
-                    LOG.info('time-out on vnfr to repo')
-
-                    break
-
-            #Store nsr in the repository, catch exception when time-out occurs
-            try:
-                nsr_response = requests.post(NSR_REPOSITORY_URL + 'ns-instances', data=json.dumps(nsr), headers={'Content-Type':'application/json'}, timeout=10.0)
-                if (nsr_response.status_code == 200):
-                    LOG.info('repo response for nsr: ' + str(nsr_response))
-                    message_for_gk['nsr'] = nsr
-
+        for entry in entries:
+            if entry['target'] not in ['vnfr', 'nsr']:
+                continue
+            status_code = entry['result'].get('status_code')
+            #A time-out or connection problem occured
+            if status_code is None:
+                message_for_gk['error'][entry['target']] = {'http_code': '0', 'message': 'Timeout when contacting server'}
+                LOG.info('time-out on ' + entry['target'] + ' to repo')
+            #If storage succeeds, add record to reply to gk
+            elif status_code == 200:
+                if entry['target'] == 'vnfr':
+                    message_for_gk['vnfrs'].append(entry['payload'])
                 else:
-                    message_for_gk['error']['nsr'] = {'http_code': nsr_response.status_code, 'message': nsr_response.json()}
-                    LOG.info('nsr to repo failed: ' + str(message_for_gk['error']['nsr']))
-            except:
-                message_for_gk['error']['nsr'] = {'http_code': '0', 'message': 'Timeout when contacting server'}
+                    message_for_gk['nsr'] = entry['payload']
+            #If storage fails, add error code and message to reply to gk
+            else:
+                message_for_gk['error'][entry['target']] = {'http_code': status_code, 'message': entry['result'].get('body')}
+                LOG.info(entry['target'] + ' to repo failed: ' + str(message_for_gk['error'][entry['target']]))
 
-            #TODO: put this in an if clause, so it is only done when nsr and
-            #vnfrs are accepted by repository.
-            LOG.info('nsr and vnfrs stored in Repositories, starting montitoring process.')
-            monitoring_message = tools.build_monitoring_message(self.service_requests_being_handled[properties.correlation_id], msg, nsr, vnfrs)
-            LOG.info('Monitoring message built: ' + json.dumps(monitoring_message, indent=4))
+        return message_for_gk
 
-            try:
-                monitoring_response = requests.post(MONITORING_REPOSITORY_URL + 'service/new', data=json.dumps(monitoring_message), headers={'Content-Type':'application/json'}, timeout=10.0)
+    def complete_message_for_gk(self, message_for_gk, monitoring_result):
+        """
+        This method adds the result of the monitoring manager to the reply
+        for the GK, and sets its status. Returns whether the deployment
+        succeeded.
+        """
 
-                if (monitoring_response.status_code == 200):
-                    LOG.info('Monitoring response: ' + str(monitoring_response))
-                    monitoring_json = monitoring_response.json()
-                    LOG.info('Monitoring json: ' + str(monitoring_json))
-        
-                    if ('status' not in monitoring_json.keys()) or (monitoring_json['status'] != 'success'):
-                        message_for_gk['error']['monitoring'] = monitoring_json
+        ## Check the monitoring manager result
+        status_code = monitoring_result.get('status_code')
+        if status_code is None:
+            message_for_gk['error']['monitoring'] = {'http_code': '0', 'message': 'Timeout when contacting server'}
+            LOG.info('time-out on monitoring manager.')
+        elif status_code == 200:
+            monitoring_json = monitoring_result.get('body')
+            LOG.info('Monitoring json: ' + str(monitoring_json))
+
+            if not isinstance(monitoring_json, dict) or monitoring_json.get('status') != 'success':
+                message_for_gk['error']['monitoring'] = monitoring_json
+        else:
+            message_for_gk['error']['monitoring'] = {'http_code': status_code, 'message': monitoring_result.get('body')}
 
-                else:
-                    message_for_gk['error']['monitoring'] = {'http_code': monitoring_response.status_code, 'message': monitoring_response.json()}
+        #If no errors occured, return message fields are set accordingly
+        succeeded = message_for_gk['error'] == {}
+        if succeeded:
+            message_for_gk['status'] = 'READY'
+            message_for_gk['error'] = None
+        return succeeded
 
-            except:
-                message_for_gk['error']['monitoring'] = {'http_code': '0', 'message': 'Timeout when contacting server'}
-                LOG.info('time-out on monitoring manager.')
-
-
-            #If no errors occured, return message fields are set accordingly 
-            #And SRM is informed to start ssms if needed.
-            self.service_requests_being_handled[properties.correlation_id]['completed'] = True
-            if message_for_gk['error'] == {}:
-                message_for_gk['status'] = 'READY'
-                message_for_gk['error'] = None
-
-                #Check if SSMs must be started with this service
-                if 'service_specific_managers' in self.service_requests_being_handled[properties.correlation_id]['NSD'].keys():
-                    if len(self.service_requests_being_handled[properties.correlation_id]['NSD']['service_specific_managers']) > 0:
-                        dict_for_srm = {'NSD':self.service_requests_being_handled[properties.correlation_id]['NSD'], 'NSR':nsr}
-                        #If onboarding is finished, the ssm start trigger can be sent.
-                        if self.service_requests_being_handled[properties.correlation_id]['ssms_ready_to_start'] == True:   
-                            LOG.info("Informing SRM that SSMs can be started.")                                             
-                            self.manoconn.call_async(self.on_ssm_start_return, SRM_START, yaml.dump(dict_for_srm))
-                        #If onboarding is not finished, this sets a flag so that when onboarding is finished, they can trigger ssm start.
-                        else:
-                            LOG.info("service deployement completed. Waiting for SSM onboarding to finish so SSMs can be started.")
-                            self.service_requests_being_handled[properties.correlation_id]['ssms_ready_to_start'] = True
-                            self.service_requests_being_handled[properties.correlation_id]['completed'] = False
-                            self.service_requests_being_handled[properties.correlation_id]['message_for_srm'] = dict_for_srm
+    def start_monitoring(self, deployment, event, message):
+        """
+        This method checks whether the monitoring manager accepted the
+        service, and informs the GK of the result of the deployment.
+        """
+
+        message_for_gk = deployment.context.pop('message_for_gk')
+        succeeded = self.complete_message_for_gk(message_for_gk, deployment.context.pop('monitoring_result'))
+        self.add_timings(message_for_gk, deployment.id)
 
+        #Inform the gk of the result.
+        LOG.info("inform gk of result of deployment for service with uuid " + deployment.context['NSD']['instance_uuid'])
+        LOG.debug('Message for gk: %s', Payload(message_for_gk))
+        self.notify_gk(GK_INSTANCE_CREATE_TOPIC, message_for_gk, deployment.id)
+
+        if not succeeded:
+            #The GK already received the errors.
+            self.deployments.transition(deployment, workflow.FAILED)
+        elif tools.needs_ssms(deployment.context['NSD']):
+            self.deployments.transition(deployment, workflow.SSM_START)
+            self.deployments.finish_task(deployment.id, workflow.TASK_MONITORING_REGISTRATION)
         else:
-            LOG.info("inform gk of result of deployment for service with uuid " + self.service_requests_being_handled[properties.correlation_id]['NSD']['instance_uuid'])
-            LOG.info("Message for gk: " + yaml.dump(message_for_gk, indent=4))
-            message_for_gk['error'] = 'Deployment result: ' + msg['request_status']
-            self.manoconn.notify(GK_INSTANCE_CREATE_TOPIC, yaml.dump(message_for_gk), correlation_id=self.service_requests_being_handled[properties.correlation_id]['original_corr_id'])
+            self.deployments.transition(deployment, workflow.DONE)
+
+    def start_ssms(self, deployment, event, message):
+        """
+        The service is deployed. The SSMs are started by on_ssm_start_ready
+        once all tasks they require are finished, unless their on-boarding
+        failed already. The GK was informed of the READY service already, a
+        failure of the SSMs is only logged.
+        """
+
+        error = deployment.context.pop('ssm_error', None)
+        if error is not None:
+            LOG.warning("SSMs of deployment " + str(deployment.id) + " not started: " + error)
+            self.deployments.transition(deployment, workflow.DONE)
             return
 
-        #Inform the gk of the result.
-        LOG.info("inform gk of result of deployment for service with uuid " + self.service_requests_being_handled[properties.correlation_id]['NSD']['instance_uuid'])
-        LOG.info("Message for gk: " + yaml.dump(message_for_gk, indent=4))
-        self.manoconn.notify(GK_INSTANCE_CREATE_TOPIC, yaml.dump(message_for_gk), correlation_id=self.service_requests_being_handled[properties.correlation_id]['original_corr_id'])
-        #Delete service request from handling dictionary, as handling is completed.
-        if self.service_requests_being_handled[properties.correlation_id]['completed']:
-            self.service_requests_being_handled.pop(properties.correlation_id, None)
+        LOG.info("service deployement completed. Waiting for SSM onboarding to finish so SSMs can be started.")
+
+    def on_ssm_start_ready(self, deployment, task):
+        """
+        This method informs the SRM that the SSMs of the service can be
+        started. It is called once, when the SSMs are on-boarded and the
+        service is deployed and monitored, or when the on-boarding failed.
+        """
+
+        if task['state'] == workflow.SKIPPED:
+            LOG.info("SSMs of deployment " + str(deployment.id) + " are not started: " + str(task['error']))
+            if deployment.state == workflow.SSM_START:
+                # the GK already received READY, no second result is sent
+                self.deployments.transition(deployment, workflow.DONE)
+            else:
+                deployment.context['ssm_error'] = str(task['error'])
+            return
+
+        LOG.info("Informing SRM that SSMs can be started.")
+        dict_for_srm = {'NSD':deployment.context['NSD'], 'NSR':deployment.context['nsr']}
+        self.manoconn.call_async(self.on_ssm_start_return, SRM_START, yaml.dump(dict_for_srm))
+        self.deployments.transition(deployment, workflow.DONE)
+
+    def store_records(self, correlation_id, nsr, vnfrs, monitoring_message):
+        """
+        This method queues the records of a deployed service in the outbox.
+        All VNFRs are posted concurrently, afterwards the NSR (which
+        references the VNFRs) and the monitoring message are posted in
+        parallel. Requests that time out or fail with a 5xx are retried,
+        the deployment is informed once all records are handled.
+        """
+        entries = []
+        for vnfr in vnfrs:
+            entries.append({'target': 'vnfr', 'stage': 0, 'key': correlation_id + ':vnfr:' + str(vnfr['id']), 'payload': vnfr})
+        entries.append({'target': 'nsr', 'stage': 1, 'key': correlation_id + ':nsr:' + str(nsr['id']), 'payload': nsr})
+        entries.append({'target': 'monitoring', 'stage': 1, 'key': correlation_id + ':monitoring', 'payload': monitoring_message})
+
+        return self.outbox.put(correlation_id, entries, on_done=self.on_records_stored)
+
+    def send_record(self, entry):
+        """
+        This method posts a record queued in the outbox to its repository.
+        The outbox key is sent as Idempotency-Key header, so a repository
+        can recognize a retry of a request it handled already.
+        """
+        path, content_type = RECORD_TARGETS[entry['target']]
+        if content_type == 'application/x-yaml':
+            data = yaml.dump(entry['payload'])
+        else:
+            data = json.dumps(entry['payload'])
+        headers = {'Content-Type': content_type, 'Idempotency-Key': entry['key']}
+        start = time.time()
+        result = repository.summary(self.record_clients[entry['target']].timed_request('post', path, data=data, headers=headers))
+
+        phase = timings.MONITORING_REGISTRATION if entry['target'] == 'monitoring' else timings.REPOSITORY_WRITE
+        self.timings.record(entry['group'], phase, start, record=entry['target'], attempt=entry['attempts'] + 1, status_code=result['status_code'])
+        return result
+
+    def on_records_stored(self, correlation_id, entries):
+        """
+        Called by the outbox once all records of a deployment are stored or
+        given up. The results are posted to the deployment.
+        """
+        for entry in entries:
+            result = entry['result']
+            LOG.info('POST ' + str(result.get('url')) + ' took ' + '%.3f' % (result.get('duration') or 0) + 's, ' + str(entry['attempts']) + ' attempt(s)')
+            if entry['target'] == 'vnfr' and result.get('status_code') == 200:
+                self.vnfr_cache.put(entry['payload']['id'], entry['payload'])
+            elif entry['target'] == 'vnfr':
+                #The record may or may not be stored, it is fetched again.
+                self.vnfr_cache.invalidate(entry['payload']['id'])
+
+        if not self.deployments.post(correlation_id, 'records_stored', entries):
+            #The deployment was recovered from the outbox after a restart.
+            message_for_gk = self.build_message_for_gk(entries)
+            self.complete_message_for_gk(message_for_gk, [e['result'] for e in entries if e['target'] == 'monitoring'][0])
+            LOG.info("inform gk of result of recovered deployment " + str(correlation_id))
+            self.notify_gk(GK_INSTANCE_CREATE_TOPIC, message_for_gk, correlation_id)
+
+    def on_outbox_recovered(self, group, entries):
+        """
+        Called for the batches of the outbox that were recovered after a
+        restart and are delivered. Messages for the GK need no follow-up.
+        """
+        if entries and entries[0]['target'] in RECORD_TARGETS:
+            self.on_records_stored(group, entries)
 
     def on_ssm_start_return(self, ch, method, properties, message):
         """
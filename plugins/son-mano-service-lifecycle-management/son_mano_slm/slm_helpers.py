@@ -24,27 +24,98 @@ partner consortium (www.sonata-nfv.eu).
 This contains helper functions for `slm.py`.
 """
 
+import re
 import requests
 import uuid
 import yaml
 
 
+class ServiceBundle(object):
+    """
+    A service request of the GK (NSD and VNFDs), parsed once. The VNFDs are
+    indexed by uuid, their VDUs by id and their monitoring rules by the name
+    of the monitoring parameter in the condition, so building the records
+    of a service takes linear time in the number of VNFs and VDUs.
+
+    The bundle refers to the request, it does not copy it.
+    """
+
+    # The monitoring parameter in a condition like "vdu01:vm_cpu_perc > 10"
+    CONDITION_PARAMETER = re.compile(r'^(?:[^:]*:)?\s*([^\s<>=!]+)')
+
+    def __init__(self, service_request):
+        self.request = service_request
+        self.nsd = service_request['NSD']
+        self.vnfd_keys = [key for key in service_request.keys() if key[:4] == 'VNFD']
+        self.vnfds = [service_request[key] for key in self.vnfd_keys]
+
+        self._vnfds = {}
+        self._vdus = {}
+        self._monitoring_rules = {}
+        for vnfd in self.vnfds:
+            vnfd_uuid = vnfd.get('uuid')
+            if vnfd_uuid in self._vnfds:
+                continue
+            self._vnfds[vnfd_uuid] = vnfd
+
+            vdus = {}
+            for vdu in vnfd.get('virtual_deployment_units') or []:
+                vdus.setdefault(vdu['id'], vdu)
+            self._vdus[vnfd_uuid] = vdus
+
+            rules = {}
+            for rule in vnfd.get('monitoring_rules') or []:
+                match = self.CONDITION_PARAMETER.match(rule.get('condition', ''))
+                if match:
+                    rules.setdefault(match.group(1), rule)
+            self._monitoring_rules[vnfd_uuid] = rules
+
+    def vnfd(self, vnfd_uuid):
+        """
+        Returns the VNFD with this uuid, or None.
+        """
+        return self._vnfds.get(vnfd_uuid)
+
+    def vdu(self, vnfd_uuid, vdu_reference):
+        """
+        Returns the VDU a reference like "firewall-vnf:vdu01" points to in
+        the VNFD with this uuid, or None.
+        """
+        vdu = self._vdus.get(vnfd_uuid, {}).get(vdu_reference.split(':')[-1])
+        if vdu is None and vnfd_uuid in self._vnfds:
+            vdu = get_vnfd_vdu_by_reference(self._vnfds[vnfd_uuid], vdu_reference)
+        return vdu
+
+    def monitoring_rule(self, vnfd_uuid, monitoring_parameter_name):
+        """
+        Returns the monitoring rule of the VNFD with this uuid whose
+        condition is on this monitoring parameter, or None.
+        """
+        return self._monitoring_rules.get(vnfd_uuid, {}).get(monitoring_parameter_name)
+
+
+def as_bundle(service_request):
+    """
+    The builders accept a service request as a dictionary or as a
+    ServiceBundle. Build the bundle once when calling several of them.
+    """
+    if isinstance(service_request, ServiceBundle):
+        return service_request
+    return ServiceBundle(service_request)
+
+
 def build_message_for_IA(request_dictionary):
     """
     This method converts the deploy request from the gk to a messsaga for the
     IA.
     """
-    resulting_message = {}
-    resulting_message['vim_uuid'] = request_dictionary['vim']
-    resulting_message['nsd'] = request_dictionary['NSD']
-    resulting_message['vnfds'] = []
+    bundle = as_bundle(request_dictionary)
 
-    for key in request_dictionary.keys():
-        if key[:4] == 'VNFD':
-            resulting_message['vnfds'].append(request_dictionary[key])
+    resulting_message = {}
+    resulting_message['vim_uuid'] = bundle.request['vim']
+    resulting_message['nsd'] = bundle.nsd
+    resulting_message['vnfds'] = list(bundle.vnfds)
 
-    newFile = open('service_request.yml', 'w')
-    newFile.write(yaml.dump(resulting_message))
     return resulting_message
 
 
@@ -52,6 +123,8 @@ def build_resource_request(descriptors, vim):
     """
     This method builds a resource request message based on the needed resourcs.
     The needed resources for a service are described in the descriptors.
+    The requirements of all vdus of all vnfds are summed up, memory and
+    storage are converted to GB.
     """
 
     needed_cpu     = 0
@@ -61,26 +134,63 @@ def build_resource_request(descriptors, vim):
     memory_unit  = 'GB'
     storage_unit = 'GB'
 
-    for key in descriptors.keys():
-        if key[:4] == 'VNFD':
-            needed_cpu = needed_cpu + descriptors[key]['virtual_deployment_units'][0]['resource_requirements']['cpu']['vcpus']
-            needed_memory = needed_memory + descriptors[key]['virtual_deployment_units'][0]['resource_requirements']['memory']['size']
-            needed_storage = needed_storage + descriptors[key]['virtual_deployment_units'][0]['resource_requirements']['storage']['size']
+    def size_in_gb(requirement):
+        factor = {'KB': 1.0 / 1024 ** 2, 'MB': 1.0 / 1024, 'GB': 1, 'TB': 1024}.get(requirement.get('size_unit', 'GB'), 1)
+        return requirement['size'] * factor
+
+    for vnfd in as_bundle(descriptors).vnfds:
+        for vdu in vnfd['virtual_deployment_units']:
+            needed_cpu = needed_cpu + vdu['resource_requirements']['cpu']['vcpus']
+            needed_memory = needed_memory + size_in_gb(vdu['resource_requirements']['memory'])
+            needed_storage = needed_storage + size_in_gb(vdu['resource_requirements']['storage'])
 
     return {'vim_uuid': vim, 'cpu': needed_cpu, 'memory': needed_memory, 'storage': needed_storage, 'memory_unit': memory_unit, 'storage_unit': storage_unit}
 
 
-def replace_old_corr_id_by_new(dictionary, old_correlation_id):
+def validate_service_request(service_request):
+    """
+    This method checks whether a service request of the GK is formatted
+    correctly. It returns None if it is, and the error for the GK if not.
+    """
+
+    # The service request should be a dictionary
+    if not isinstance(service_request, dict):
+        return 'Message is not a dictionary'
+
+    # The dictionary should contain a 'NSD' key
+    if 'NSD' not in service_request.keys():
+        return 'No NSD field in dictionary'
+
+    # Their should be as many VNFDx keys in the dictionary as their
+    # are network functions according to the NSD.
+    vnfd_keys = [key for key in service_request.keys() if key[:4] == 'VNFD']
+    if len(service_request['NSD']['network_functions']) != len(vnfd_keys):
+        return 'Number of VNFDs doesn\'t match number of vnfs'
+
+    # Check whether a vnfd is none.
+    for key in vnfd_keys:
+        if service_request[key] is None:
+            return 'VNFDs are not allowed to be empty'
+
+    return None
+
+
+def record_for_repository(record):
     """
-    This method takes a dictionary with uuid's as keys. The method replaces a
-    certain key with a new uuid.
+    This method removes the fields of a record that are set by the
+    repository, the SLM is not allowed to set them.
     """
 
-    new_correlation_id = uuid.uuid4().hex
-    dictionary[new_correlation_id] = dictionary[old_correlation_id]
-    dictionary.pop(old_correlation_id, None)
+    return dict((key, value) for key, value in record.items() if key not in ['uuid', 'created_at', 'updated_at'])
 
-    return new_correlation_id, dictionary
+
+def needs_ssms(nsd):
+    """
+    This method checks whether the service has service specific managers
+    that need to be on-boarded and started.
+    """
+
+    return len(nsd.get('service_specific_managers') or []) > 0
 
 
 def build_nsr(gk_request, ia_payload):
@@ -88,6 +198,7 @@ def build_nsr(gk_request, ia_payload):
     This method builds the whole NSR from the payload (stripped nsr and vnfrs)
     returned by the Infrastructure Adaptor (IA).
     """
+    nsd = as_bundle(gk_request).nsd
 
     nsr = {}
     # nsr mandatory fields
@@ -96,7 +207,7 @@ def build_nsr(gk_request, ia_payload):
     nsr['status'] = ia_payload['nsr']['status']
     # Building the nsr makes it the first version of this nsr
     nsr['version'] = '1'
-    nsr['descriptor_reference'] = gk_request['NSD']['uuid']
+    nsr['descriptor_reference'] = nsd['uuid']
 
     # Future functionality
 #    if 'instanceVimUuid' in ia_payload:
@@ -111,18 +222,18 @@ def build_nsr(gk_request, ia_payload):
             nsr['network_functions'].append(function)
 
     # connection points
-    if 'connection_points' in gk_request['NSD']:
+    if 'connection_points' in nsd:
         nsr['connection_points'] = []
-        for connection_point in gk_request['NSD']['connection_points']:
+        for connection_point in nsd['connection_points']:
             cp = {}
             cp['id'] = connection_point['id']
             cp['type'] = connection_point['type']
             nsr['connection_points'].append(cp)
 
     # virtual links
-    if 'virtual_links' in gk_request['NSD']:
+    if 'virtual_links' in nsd:
         nsr['virtual_links'] = []
-        for virtual_link in gk_request['NSD']['virtual_links']:
+        for virtual_link in nsd['virtual_links']:
             vlink = {}
             vlink['id'] = virtual_link['id']
             vlink['connectivity_type'] = virtual_link['connectivity_type']
@@ -130,39 +241,39 @@ def build_nsr(gk_request, ia_payload):
             nsr['virtual_links'].append(vlink)
 
     # forwarding graphs
-    if 'forwarding_graphs' in gk_request['NSD']:
+    if 'forwarding_graphs' in nsd:
         nsr['forwarding_graphs'] = []
-        for forwarding_graph in gk_request['NSD']['forwarding_graphs']:
+        for forwarding_graph in nsd['forwarding_graphs']:
             nsr['forwarding_graphs'].append(forwarding_graph)
 
     # lifecycle events
-    if 'lifecycle_events' in gk_request['NSD']:
+    if 'lifecycle_events' in nsd:
         nsr['lifecycle_events'] = []
-        for lifecycle_event in gk_request['NSD']['lifecycle_events']:
+        for lifecycle_event in nsd['lifecycle_events']:
             nsr['lifecycle_events'].append(lifecycle_event)
 
     # vnf_dependency
-    if 'vnf_dependency' in gk_request['NSD']:
+    if 'vnf_dependency' in nsd:
         nsr['vnf_dependency'] = []
-        for vd in gk_request['NSD']['vnf_dependency']:
+        for vd in nsd['vnf_dependency']:
             nsr['vnf_dependency'].append(vd)
 
     # services_dependency
-    if 'services_dependency' in gk_request['NSD']:
+    if 'services_dependency' in nsd:
         nsr['services_dependency'] = []
-        for sd in gk_request['NSD']['services_dependency']:
+        for sd in nsd['services_dependency']:
             nsr['services_dependency'].append(sd)
 
     # monitoring_parameters
-    if 'monitoring_parameters' in gk_request['NSD']:
+    if 'monitoring_parameters' in nsd:
         nsr['monitoring_parameters'] = []
-        for mp in gk_request['NSD']['monitoring_parameters']:
+        for mp in nsd['monitoring_parameters']:
             nsr['monitoring_parameters'].append(mp)
 
     # auto_scale_policy
-    if 'auto_scale_policy' in gk_request['NSD']:
+    if 'auto_scale_policy' in nsd:
         nsr['auto_scale_policy'] = []
-        for asp in gk_request['NSD']['auto_scale_policy']:
+        for asp in nsd['auto_scale_policy']:
             nsr['monitoring_parameters'].append(asp)
 
     return nsr
@@ -174,9 +285,11 @@ def build_vnfrs(gk_request, ia_vnfrs):
     from the stripped VNFRs returned by the Infrastructure Adaptor (IA),
     combining it with the provided VNFD.
     """
+    bundle = as_bundle(gk_request)
+
     vnfrs = []
     for ia_vnfr in ia_vnfrs:
-        vnfd = get_vnfd_by_reference(gk_request, ia_vnfr['descriptor_reference'])
+        vnfd = bundle.vnfd(ia_vnfr['descriptor_reference'])
 
         vnfr = {}
         # vnfd base fields
@@ -194,7 +307,7 @@ def build_vnfrs(gk_request, ia_vnfrs):
         # virtual_deployment_units
         vnfr['virtual_deployment_units'] = []
         for ia_vdu in ia_vnfr['virtual_deployment_units']:
-            vnfd_vdu = get_vnfd_vdu_by_reference(vnfd, ia_vdu['vdu_reference'])
+            vnfd_vdu = bundle.vdu(ia_vnfr['descriptor_reference'], ia_vdu['vdu_reference'])
 
             vdu = {}
             # vdu info returned by IA
@@ -255,13 +368,7 @@ def get_vnfd_vdu_by_reference(vnfd, vdu_reference):
 
 def get_vnfd_by_reference(gk_request, vnfd_reference):
 
-    for key in gk_request.keys():
-        if key[:4] == 'VNFD':
-            vnfd = gk_request[key]
-            if vnfd['uuid'] == vnfd_reference:
-                return vnfd
-
-    return None
+    return as_bundle(gk_request).vnfd(vnfd_reference)
 
 
 def build_monitoring_message(gk_request, message_from_ia, nsr, vnfrs):
@@ -269,31 +376,6 @@ def build_monitoring_message(gk_request, message_from_ia, nsr, vnfrs):
     This method builds the message for the Monitoring Manager.
     """
 
-    def get_matching_vdu(vnfrs, vnfd, vdu):
-        """
-        This method searches inside the VNFRs for the VDU that makes reference
-        to a specific VDU of a VNFD.
-        """
-        for vnfr in vnfrs:
-            if vnfr['descriptor_reference'] == vnfd['uuid']:
-                for nsr_vdu in vnfr['virtual_deployment_units']:
-                    if vdu['id'] in nsr_vdu['vdu_reference']:
-                        return nsr_vdu
-
-        return None
-
-    def get_associated_monitoring_rule(vnfd, monitoring_parameter_name):
-        """
-        This method searches with monitoring rule of the VNFD is assocated to a
-        monitoring parameter, identified by the provided monitoring_parameter
-        name.
-        """
-        if 'monitoring_rules' in vnfd.keys():
-            for mp in vnfd['monitoring_rules']:
-                if monitoring_parameter_name in mp['condition']:
-                    return mp
-        return None
-
     def get_threshold(condition):
         """
         This method retrieves a threshold from a condition message.
@@ -305,18 +387,12 @@ def build_monitoring_message(gk_request, message_from_ia, nsr, vnfrs):
 
         return None
 
-    def get_vnfd_by_id(gk_request, vnfd_reference):
-        for key in gk_request.keys():
-            if key[:4] == 'VNFD':
-                if gk_request[key]['uuid'] == vnfd_reference:
-                    return gk_request[key]
-
-        return None
+    bundle = as_bundle(gk_request)
 
     message = {}
     service = {}
 
-    nsd = gk_request['NSD']
+    nsd = bundle.nsd
 
     # add nsd fields
     service['sonata_srv_id'] = nsr['id']
@@ -340,7 +416,7 @@ def build_monitoring_message(gk_request, message_from_ia, nsr, vnfrs):
 
         function = {}
 
-        vnfd = get_vnfd_by_id(gk_request, vnfr['descriptor_reference'])
+        vnfd = bundle.vnfd(vnfr['descriptor_reference'])
 
         function['sonata_func_id'] = vnfr['id']
         function['name'] = vnfd['name']
@@ -370,7 +446,7 @@ def build_monitoring_message(gk_request, message_from_ia, nsr, vnfrs):
                     metric['name'] = mp['name']
                     metric['unit'] = mp['unit']
 
-                    associated_rule = get_associated_monitoring_rule(vnfd, mp['name'])
+                    associated_rule = bundle.monitoring_rule(vnfr['descriptor_reference'], mp['name'])
                     if (associated_rule is not None):
                         if 'threshold' in mp.keys():
                             metric['threshold'] = mp['threshold']
@@ -0,0 +1,249 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the timing of the phases of service deployments: the
+breakdown of each deployment, and histograms of all of them.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+LOG = logging.getLogger("plugin:slm:timings")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the timings, can be overwritten by ENV variables.
+# Upper bounds (in seconds) of the buckets of the histograms
+TIMING_BUCKETS = [float(b) for b in os.environ.get("timing_buckets", "0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300").split(',')]
+# Number of finished deployments whose breakdown is kept
+TIMING_HISTORY_SIZE = int(os.environ.get("timing_history_size", 1000))
+
+# Phases that are not a state of the workflow engine, whose states are
+# timed under their own name in lower case
+VALIDATION = 'validation'
+ADMISSION = 'admission'
+SSM_ONBOARDING = 'ssm_onboarding'
+REPOSITORY_WRITE = 'repository_write'
+MONITORING_REGISTRATION = 'monitoring_registration'
+GK_NOTIFY = 'gk_notify'
+# From the receipt of the request until the deployment is finished
+TOTAL = 'total'
+
+
+class Histogram(object):
+    """
+    Histogram of durations with fixed buckets. Keeps the count per bucket,
+    and the count, sum and max. of all durations.
+    """
+
+    def __init__(self, buckets=TIMING_BUCKETS):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, duration):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if duration <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += duration
+        self.max = max(self.max, duration)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in,
+        the max. for the last bucket.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        """
+        The buckets are cumulative: pairs of a bound and the number of
+        durations up to it. The count includes the durations above the
+        last bound.
+        """
+        buckets = []
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            buckets.append([bound, seen])
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': buckets}
+
+
+class Timeline(object):
+    """
+    The phases of one deployment, with their start time and duration.
+    Phases can be recorded when they are finished, or begun and ended.
+    """
+
+    def __init__(self, correlation_id, started_at, include_in_reply=False):
+        self.correlation_id = correlation_id
+        self.started_at = started_at
+        self.include_in_reply = include_in_reply
+        self.instance_uuid = None
+        self.finished_at = None
+        self.state = None
+        self.spans = []
+        self.open = {}
+
+    def as_dict(self):
+        end = self.finished_at if self.finished_at is not None else time.time()
+        phases = []
+        for phase, start, duration, details in sorted(self.spans, key=lambda s: s[1]):
+            span = {'phase': phase, 'start': start - self.started_at, 'duration': duration}
+            span.update(details)
+            phases.append(span)
+        return {'correlation_id': self.correlation_id,
+                'instance_uuid': self.instance_uuid,
+                'state': self.state,
+                'started_at': self.started_at,
+                'duration': end - self.started_at,
+                'phases': phases}
+
+
+class TimingRecorder(object):
+    """
+    Records the phases of the deployments, keyed by the original
+    correlation id of their request. Each phase is added to the timeline
+    of its deployment and to the histogram of the phase. Timelines of
+    finished deployments are kept in a bounded history, so they can be
+    queried afterwards, also by the instance uuid of the service.
+    """
+
+    def __init__(self, history_size=TIMING_HISTORY_SIZE, buckets=TIMING_BUCKETS):
+        self.history_size = history_size
+        self.buckets = buckets
+        self._active = {}
+        self._history = OrderedDict()
+        self._instances = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def start(self, correlation_id, started_at=None, instance_uuid=None, include_in_reply=False):
+        """
+        Starts the timeline of a deployment, at the receipt of its request.
+        """
+        timeline = Timeline(correlation_id, started_at or time.time(), include_in_reply)
+        timeline.instance_uuid = instance_uuid
+        with self._lock:
+            self._active[correlation_id] = timeline
+            if instance_uuid is not None:
+                self._instances[instance_uuid] = correlation_id
+        return timeline
+
+    def record(self, correlation_id, phase, start, end=None, **details):
+        """
+        Records a phase. Phases of unknown deployments are only added to
+        the histogram.
+        """
+        end = end if end is not None else time.time()
+        with self._lock:
+            self._histogram(phase).observe(end - start)
+            timeline = self._timeline(correlation_id)
+            if timeline is not None:
+                timeline.spans.append((phase, start, end - start, details))
+
+    def begin(self, correlation_id, phase):
+        with self._lock:
+            timeline = self._timeline(correlation_id)
+            if timeline is not None:
+                timeline.open[phase] = time.time()
+
+    def end(self, correlation_id, phase, **details):
+        with self._lock:
+            timeline = self._timeline(correlation_id)
+            start = timeline.open.pop(phase, None) if timeline is not None else None
+        if start is not None:
+            self.record(correlation_id, phase, start, **details)
+
+    def finish(self, correlation_id, state):
+        """
+        Ends the timeline of a deployment and moves it to the history.
+        """
+        with self._lock:
+            timeline = self._active.pop(correlation_id, None)
+            if timeline is None:
+                return
+            timeline.finished_at = time.time()
+            timeline.state = state
+            self._histogram(TOTAL).observe(timeline.finished_at - timeline.started_at)
+
+            self._history[correlation_id] = timeline
+            while len(self._history) > self.history_size:
+                _, evicted = self._history.popitem(last=False)
+                self._instances.pop(evicted.instance_uuid, None)
+
+    def breakdown(self, key):
+        """
+        Returns the timeline of a deployment as a dictionary, looked up by
+        correlation id or instance uuid. None if it is unknown.
+        """
+        with self._lock:
+            timeline = self._timeline(self._instances.get(key, key))
+            return timeline.as_dict() if timeline is not None else None
+
+    def include_in_reply(self, correlation_id):
+        with self._lock:
+            timeline = self._timeline(correlation_id)
+            return timeline is not None and timeline.include_in_reply
+
+    def histograms(self):
+        with self._lock:
+            return dict((phase, h.as_dict()) for phase, h in self._histograms.items())
+
+    def __len__(self):
+        return len(self._active)
+
+    def _timeline(self, correlation_id):
+        timeline = self._active.get(correlation_id)
+        if timeline is None:
+            timeline = self._history.get(correlation_id)
+        return timeline
+
+    def _histogram(self, phase):
+        if phase not in self._histograms:
+            self._histograms[phase] = Histogram(self.buckets)
+        return self._histograms[phase]
@@ -0,0 +1,99 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the cache of the vims known to the infrastructure adaptor.
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger("plugin:slm:vim_inventory")
+LOG.setLevel(logging.DEBUG)
+
+# Configuration of the inventory, can be overwritten by ENV variables.
+# Time (in seconds) a vim list received from the IA is used
+VIM_INVENTORY_TTL = float(os.environ.get("vim_inventory_ttl", 30))
+# Interval (in seconds) of the periodic refresh, disabled if 0
+VIM_INVENTORY_REFRESH_INTERVAL = float(os.environ.get("vim_inventory_refresh_interval", 20))
+
+
+class VimInventory(object):
+    """
+    Keeps the last vim list received from the IA, so deployments do not
+    have to request it. The list expires after ttl seconds. It is dropped
+    when a deployment fails on one of its vims, since the resources of
+    that vim are no longer known.
+    """
+
+    def __init__(self, ttl=VIM_INVENTORY_TTL):
+        self.ttl = ttl
+        self._vims = None
+        self._updated_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns a copy of the vim list, or None if there is no valid list.
+        """
+        with self._lock:
+            if self._vims is None or time.time() - self._updated_at > self.ttl:
+                return None
+            return copy.deepcopy(self._vims)
+
+    def update(self, vims):
+        """
+        Stores a vim list received from the IA. Lists that are empty or
+        malformed are not cached, deployments will request the list
+        themselves.
+        """
+        if not isinstance(vims, list) or len(vims) == 0:
+            self.invalidate()
+            return
+        with self._lock:
+            self._vims = copy.deepcopy(vims)
+            self._updated_at = time.time()
+
+    def invalidate(self, vim_uuid=None):
+        """
+        Drops the vim list. If a vim is given, the list is only dropped if
+        it contains this vim.
+        """
+        with self._lock:
+            if vim_uuid is not None and self._vims is not None:
+                if vim_uuid not in [vim.get('vim_uuid') for vim in self._vims]:
+                    return
+            if self._vims is not None:
+                LOG.info("VIM inventory invalidated.")
+            self._vims = None
+
+    def age(self):
+        """
+        Seconds since the last update, None if there is no vim list.
+        """
+        with self._lock:
+            if self._vims is None:
+                return None
+            return time.time() - self._updated_at
@@ -0,0 +1,479 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+This contains the workflow engine that drives the service deployments
+of the SLM. Each deployment is a state machine:
+
+    REQUESTED -> VIM_LIST -> PLACEMENT -> IA_DEPLOY -> RECORDS
+              -> MONITORING -> SSM_START -> DONE
+
+Any state can end in FAILED. Messages received for a deployment are
+posted as events to its mailbox. The events of a deployment are handled
+one after the other, the events of different deployments concurrently
+on a bounded pool of worker threads.
+
+Work that runs next to the states, like the on-boarding of the SSMs of
+a service while it is deployed, is tracked as sub-tasks of the
+deployment. Tasks that require other tasks are started once all of them
+are finished.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger("plugin:slm:workflow")
+LOG.setLevel(logging.DEBUG)
+
+# Number of threads handling deployment events, can be overwritten by ENV.
+WORKFLOW_POOL_SIZE = int(os.environ.get("workflow_pool_size", 10))
+
+# Deployment states
+REQUESTED = 'REQUESTED'
+VIM_LIST = 'VIM_LIST'
+PLACEMENT = 'PLACEMENT'
+IA_DEPLOY = 'IA_DEPLOY'
+RECORDS = 'RECORDS'
+MONITORING = 'MONITORING'
+SSM_START = 'SSM_START'
+DONE = 'DONE'
+FAILED = 'FAILED'
+
+STATES = [REQUESTED, VIM_LIST, PLACEMENT, IA_DEPLOY, RECORDS, MONITORING, SSM_START, DONE, FAILED]
+FINAL_STATES = [DONE, FAILED]
+
+# Event that is posted when a deployment enters a new state
+ENTER = 'enter'
+# Events that are posted when a task is finished or its time is up
+TASK_FINISHED = 'task_finished'
+TASK_TIMEOUT = 'task_timeout'
+
+# States of the tasks of a deployment, besides FAILED
+WAITING = 'WAITING'
+RUNNING = 'RUNNING'
+SUCCEEDED = 'SUCCEEDED'
+TIMED_OUT = 'TIMED_OUT'
+# A task that is not started because a task it requires did not succeed
+SKIPPED = 'SKIPPED'
+
+TASK_FINAL_STATES = [SUCCEEDED, FAILED, TIMED_OUT, SKIPPED]
+
+# Tasks of the deployments of the SLM. The SSMs of a service are started
+# once they are on-boarded, and the service is deployed and monitored.
+TASK_SSM_ONBOARDING = 'ssm_onboarding'
+TASK_SERVICE_DEPLOYMENT = 'service_deployment'
+TASK_MONITORING_REGISTRATION = 'monitoring_registration'
+TASK_SSM_START = 'ssm_start'
+
+
+class TaskGraph(object):
+    """
+    The sub-tasks of a deployment. A task can require other tasks, which
+    have to be added before it, so the tasks form a DAG. Tasks without
+    requirements are running once added. A task with requirements waits
+    until all of them succeeded and is then started, exactly once. If one
+    of them fails or times out, the task is skipped, and so are the tasks
+    that require it.
+
+    The graph is not locked, the workflow engine only changes it from the
+    mailbox of its deployment.
+    """
+
+    def __init__(self):
+        self.tasks = OrderedDict()
+
+    def add(self, name, requires=None, timeout=None):
+        """
+        Adds a task. A timeout (in seconds) counts from the start of the
+        task. Returns the task.
+        """
+        requires = list(requires or [])
+        if name in self.tasks:
+            raise ValueError('task ' + name + ' added twice')
+        for required in requires:
+            if required not in self.tasks:
+                raise ValueError('task ' + name + ' requires unknown task ' + required)
+
+        task = {'name': name,
+                'requires': requires,
+                'timeout': timeout,
+                'state': WAITING,
+                'result': None,
+                'error': None,
+                'started_at': None,
+                'finished_at': None}
+        self.tasks[name] = task
+        self._resolve(task, time.time())
+        return task
+
+    def get(self, name):
+        return self.tasks.get(name)
+
+    def finish(self, name, result=None, error=None):
+        """
+        Finishes a running task, it failed if an error is given. Returns
+        the tasks that were started or skipped because of it. Tasks that
+        are unknown or not running are ignored.
+        """
+        task = self.tasks.get(name)
+        if task is None or task['state'] != RUNNING:
+            return []
+        task['state'] = SUCCEEDED if error is None else FAILED
+        task['result'] = result
+        task['error'] = error
+        task['finished_at'] = time.time()
+        return self._propagate(task['finished_at'])
+
+    def expire(self, name, now=None):
+        """
+        Times out a running task if its timeout passed. Returns the tasks
+        that were skipped because of it.
+        """
+        now = time.time() if now is None else now
+        task = self.tasks.get(name)
+        if task is None or task['state'] != RUNNING or task['timeout'] is None:
+            return []
+        if now < task['started_at'] + task['timeout']:
+            return []
+        task['state'] = TIMED_OUT
+        task['error'] = 'Task ' + name + ' timed out after ' + str(task['timeout']) + 's.'
+        task['finished_at'] = now
+        return self._propagate(now)
+
+    def results(self, name):
+        """
+        Returns the results of the tasks a task requires, by name.
+        """
+        return dict((required, self.tasks[required]['result']) for required in self.tasks[name]['requires'])
+
+    def pending(self):
+        """
+        Returns the names of the tasks that are not finished.
+        """
+        return [name for name, task in self.tasks.items() if task['state'] not in TASK_FINAL_STATES]
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def _resolve(self, task, now):
+        """
+        Starts or skips a waiting task, depending on the tasks it requires.
+        Returns True if it did.
+        """
+        required = [self.tasks[name] for name in task['requires']]
+        failed = [r for r in required if r['state'] in [FAILED, TIMED_OUT, SKIPPED]]
+        if failed:
+            task['state'] = SKIPPED
+            task['error'] = failed[0]['error']
+            task['finished_at'] = now
+            return True
+        if all(r['state'] == SUCCEEDED for r in required):
+            task['state'] = RUNNING
+            task['started_at'] = now
+            return True
+        return False
+
+    def _propagate(self, now):
+        # the tasks are in topological order, one pass reaches all of them
+        changed = []
+        for task in self.tasks.values():
+            if task['state'] == WAITING and self._resolve(task, now):
+                changed.append(task)
+        return changed
+
+
+class Deployment(object):
+    """
+    A deployment handled by the workflow engine. The context holds the
+    data the state handlers work on, the timings the time spent in each
+    state, the tasks its sub-tasks.
+    """
+
+    def __init__(self, deployment_id, context=None, tasks=None):
+        self.id = deployment_id
+        self.context = context if context is not None else {}
+        self.tasks = tasks if tasks is not None else TaskGraph()
+        self.state = None
+        self.error = None
+        self.created_at = time.time()
+        self.entered_at = self.created_at
+        self.timings = []
+
+        self._mailbox = deque()
+        self._scheduled = False
+
+    def duration(self):
+        return time.time() - self.created_at
+
+
+class WorkflowEngine(object):
+    """
+    Runs deployments as state machines. A handler is registered for each
+    state and called as handler(deployment, event, payload) for each event
+    the deployment receives in that state, starting with ENTER. Handlers
+    for events that can arrive in any state are registered separately.
+    Handlers move the deployment on with transition() or fail().
+
+    Tasks of a deployment are finished with finish_task(). When a task
+    with requirements is started or skipped, the handler registered for
+    it is called as handler(deployment, task) from the mailbox of the
+    deployment. Tasks that time out are finished by the engine.
+    """
+
+    def __init__(self, pool_size=WORKFLOW_POOL_SIZE, on_failed=None, on_finished=None, on_transition=None):
+        """
+        :param pool_size: number of worker threads
+        :param on_failed: called with the deployment when fail() is called for it
+        :param on_finished: called with the deployment when it reaches a final state
+        :param on_transition: called with the deployment after each change of state
+        """
+        self.on_failed = on_failed
+        self.on_finished = on_finished
+        self.on_transition = on_transition
+
+        self._state_handlers = {}
+        self._event_handlers = {}
+        self._task_handlers = {}
+        self._deployments = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=pool_size)
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {}
+
+        # (due time, sequence number, deployment id, task) of running tasks
+        # with a timeout, handled by one timer thread
+        self._timeouts = []
+        self._timeout_seq = itertools.count()
+        self._timer_cond = threading.Condition()
+        self._timer = None
+        self._stopped = False
+
+    def register_state(self, state, handler):
+        self._state_handlers[state] = handler
+
+    def register_event(self, event, handler):
+        self._event_handlers[event] = handler
+
+    def register_task(self, task, handler):
+        self._task_handlers[task] = handler
+
+    def start(self, deployment_id, context=None, tasks=None):
+        """
+        Creates a new deployment in state REQUESTED, with the task graph of
+        its sub-tasks.
+        """
+        deployment = Deployment(deployment_id, context, tasks)
+        with self._lock:
+            self._deployments[deployment_id] = deployment
+        for task in deployment.tasks.tasks.values():
+            if task['state'] == RUNNING:
+                self._schedule_timeout(deployment, task)
+        self.transition(deployment, REQUESTED)
+        return deployment
+
+    def finish_task(self, deployment_id, task, result=None, error=None):
+        """
+        Finishes a task of a deployment, it failed if an error is given.
+        Returns False if the deployment is unknown or already finished.
+        """
+        return self.post(deployment_id, TASK_FINISHED, (task, result, error))
+
+    def get(self, deployment_id):
+        with self._lock:
+            return self._deployments.get(deployment_id)
+
+    def post(self, deployment_id, event, payload=None):
+        """
+        Posts an event to the mailbox of a deployment. Returns False if the
+        deployment is unknown or already finished.
+        """
+        deployment = self.get(deployment_id)
+        if deployment is None:
+            LOG.info("Event " + event + " for unknown deployment " + str(deployment_id) + " dropped.")
+            return False
+        self._post(deployment, event, payload)
+        return True
+
+    def transition(self, deployment, state):
+        """
+        Moves a deployment to a new state. The handler of the new state is
+        called with ENTER, unless the state is final.
+        """
+        now = time.time()
+        if deployment.state is not None:
+            duration = now - deployment.entered_at
+            deployment.timings.append((deployment.state, duration))
+            self._record(deployment.state, duration)
+            LOG.debug("Deployment " + str(deployment.id) + ": " + deployment.state + " -> " + state + " after " + '%.3f' % duration + "s")
+        deployment.state = state
+        deployment.entered_at = now
+        if self.on_transition is not None:
+            self._call(self.on_transition, deployment)
+
+        if state in FINAL_STATES:
+            self._record(state, deployment.duration())
+            with self._lock:
+                self._deployments.pop(deployment.id, None)
+            if self.on_finished is not None:
+                self._call(self.on_finished, deployment)
+        else:
+            self._post(deployment, ENTER)
+
+    def fail(self, deployment, error):
+        """
+        Aborts a deployment. on_failed is called before it moves to FAILED.
+        """
+        if deployment.state in FINAL_STATES:
+            return
+        LOG.info("Deployment " + str(deployment.id) + " failed in state " + str(deployment.state) + ": " + str(error))
+        deployment.error = error
+        if self.on_failed is not None:
+            self._call(self.on_failed, deployment)
+        self.transition(deployment, FAILED)
+
+    def metrics(self):
+        """
+        Returns for each state the number of deployments that went through
+        it, and the mean and max. time they spent in it. For DONE and
+        FAILED this is the duration of the whole deployment.
+        """
+        with self._metrics_lock:
+            return dict((state, {'count': m['count'],
+                                 'mean': m['total'] / m['count'],
+                                 'max': m['max']}) for state, m in self._metrics.items())
+
+    def shutdown(self, wait=False):
+        with self._timer_cond:
+            self._stopped = True
+            self._timer_cond.notify()
+        self._pool.shutdown(wait=wait)
+
+    def __len__(self):
+        return len(self._deployments)
+
+    def _record(self, state, duration):
+        with self._metrics_lock:
+            m = self._metrics.setdefault(state, {'count': 0, 'total': 0.0, 'max': 0.0})
+            m['count'] += 1
+            m['total'] += duration
+            m['max'] = max(m['max'], duration)
+
+    def _post(self, deployment, event, payload=None):
+        with self._lock:
+            deployment._mailbox.append((event, payload))
+            if deployment._scheduled:
+                return
+            deployment._scheduled = True
+        self._pool.submit(self._run, deployment)
+
+    def _run(self, deployment):
+        """
+        Handles the events in the mailbox of a deployment. Only one worker
+        at a time runs this for a deployment.
+        """
+        while True:
+            with self._lock:
+                if not deployment._mailbox:
+                    deployment._scheduled = False
+                    return
+                event, payload = deployment._mailbox.popleft()
+            self._dispatch(deployment, event, payload)
+
+    def _dispatch(self, deployment, event, payload):
+        if deployment.state in FINAL_STATES:
+            LOG.info("Event " + event + " for finished deployment " + str(deployment.id) + " dropped.")
+            return
+
+        if event in [TASK_FINISHED, TASK_TIMEOUT]:
+            handler = self._on_task_event
+        else:
+            handler = self._event_handlers.get(event, self._state_handlers.get(deployment.state))
+        if handler is None:
+            self.fail(deployment, "No handler for state " + deployment.state)
+            return
+        try:
+            handler(deployment, event, payload)
+        except Exception as e:
+            LOG.exception("Handling event " + event + " in state " + deployment.state + " failed.")
+            self.fail(deployment, str(e))
+
+    def _call(self, callback, deployment):
+        try:
+            callback(deployment)
+        except Exception:
+            LOG.exception("Callback of deployment " + str(deployment.id) + " failed.")
+
+    def _on_task_event(self, deployment, event, payload):
+        """
+        Updates the task graph of a deployment, and calls the handlers of
+        the tasks that were started or skipped.
+        """
+        if event == TASK_TIMEOUT:
+            changed = deployment.tasks.expire(payload)
+            if deployment.tasks.get(payload)['state'] == TIMED_OUT:
+                LOG.info("Deployment " + str(deployment.id) + ": task " + payload + " timed out.")
+        else:
+            task, result, error = payload
+            changed = deployment.tasks.finish(task, result, error)
+
+        for task in changed:
+            LOG.debug("Deployment " + str(deployment.id) + ": task " + task['name'] + " " + task['state'])
+            if task['state'] == RUNNING:
+                self._schedule_timeout(deployment, task)
+            handler = self._task_handlers.get(task['name'])
+            if handler is not None:
+                handler(deployment, task)
+
+    def _schedule_timeout(self, deployment, task):
+        if task['timeout'] is None:
+            return
+        with self._timer_cond:
+            heapq.heappush(self._timeouts, (task['started_at'] + task['timeout'], next(self._timeout_seq), deployment.id, task['name']))
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._timer_loop)
+                self._timer.daemon = True
+                self._timer.start()
+            self._timer_cond.notify()
+
+    def _timer_loop(self):
+        while True:
+            with self._timer_cond:
+                while True:
+                    if self._stopped:
+                        return
+                    if self._timeouts and self._timeouts[0][0] <= time.time():
+                        break
+                    self._timer_cond.wait(self._timeouts[0][0] - time.time() if self._timeouts else None)
+                _, _, deployment_id, task = heapq.heappop(self._timeouts)
+
+            # tasks of finished deployments are dropped silently
+            deployment = self.get(deployment_id)
+            if deployment is not None:
+                self._post(deployment, TASK_TIMEOUT, task)
@@ -0,0 +1,107 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+Benchmark of the record builders of the SLM on synthetic services with
+a growing number of VNFs: the NSR, the VNFRs and the monitoring message
+are built from the request dictionary (one ServiceBundle per builder) and
+from a ServiceBundle built once.
+
+Run from the plugin folder: python -m test.bench_descriptors
+"""
+
+import argparse
+import time
+
+from son_mano_slm import slm_helpers as tools
+
+PARAMETERS = ['vm_cpu_perc', 'vm_mem_perc', 'vm_net_rx_MB', 'vm_net_tx_MB']
+
+
+def synthetic_service(n_vnfs, n_vdus):
+    """
+    Builds a service request of the GK and the matching reply of the IA.
+    """
+    request = {'NSD': {'uuid': 'nsd', 'name': 'service', 'description': 'synthetic service',
+                       'network_functions': []}}
+    ia_reply = {'nsr': {'id': 'nsr', 'status': 'offline'}, 'instanceVimUuid': 'vim', 'vnfrs': []}
+
+    for i in range(n_vnfs):
+        name = 'vnf-' + str(i)
+        vdus = []
+        ia_vdus = []
+        for j in range(n_vdus):
+            vdu_id = 'vdu' + str(j)
+            vdus.append({'id': vdu_id,
+                         'resource_requirements': {'cpu': {'vcpus': 1},
+                                                   'memory': {'size': 1, 'size_unit': 'GB'},
+                                                   'storage': {'size': 10, 'size_unit': 'GB'}},
+                         'monitoring_parameters': [{'name': p, 'unit': 'Percentage'} for p in PARAMETERS]})
+            ia_vdus.append({'id': name + '-' + vdu_id,
+                            'vdu_reference': name + ':' + vdu_id,
+                            'vnfc_instance': [{'id': '0', 'vim_id': 'vim', 'vc_id': name + '-' + vdu_id + '-vc',
+                                               'connection_points': []}]})
+
+        rules = [{'name': p, 'duration': 10, 'duration_unit': 's',
+                  'condition': 'vdu0:' + p + ' > 10',
+                  'notification': [{'type': 'rabbitmq_message'}]} for p in PARAMETERS]
+
+        request['NSD']['network_functions'].append({'vnf_id': name, 'vnf_name': name})
+        request['VNFD' + str(i + 1)] = {'uuid': name, 'name': name, 'description': 'synthetic vnf',
+                                        'virtual_deployment_units': vdus, 'monitoring_rules': rules}
+        ia_reply['vnfrs'].append({'id': name + '-r', 'descriptor_version': 'vnfr-schema-01',
+                                  'status': 'offline', 'descriptor_reference': name,
+                                  'virtual_deployment_units': ia_vdus})
+
+    return request, ia_reply
+
+
+def build_records(request, ia_reply):
+    nsr = tools.build_nsr(request, ia_reply)
+    vnfrs = tools.build_vnfrs(request, ia_reply['vnfrs'])
+    tools.build_monitoring_message(request, ia_reply, nsr, vnfrs)
+    tools.build_resource_request(request, None)
+
+
+def run(name, n_vnfs, repeat, build):
+    start = time.time()
+    for i in range(repeat):
+        build()
+    duration = (time.time() - start) / repeat
+    print('%-22s vnfs=%-4d %8.3f ms per service (%6.1f us per vnf)'
+          % (name, n_vnfs, duration * 1000, duration * 1e6 / n_vnfs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='record builder benchmark')
+    parser.add_argument('--vdus', type=int, default=2, help='vdus per vnf')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for n_vnfs in [25, 50, 100, 200]:
+        request, ia_reply = synthetic_service(n_vnfs, args.vdus)
+        run('dictionary', n_vnfs, args.repeat, lambda: build_records(request, ia_reply))
+        run('ServiceBundle', n_vnfs, args.repeat, lambda: build_records(tools.ServiceBundle(request), ia_reply))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+Benchmark of the placement engine of the SLM over synthetic vim lists.
+Places services (with reservations) until the vims are full and reports
+the time per placement and the resulting utilisation.
+
+Run from the plugin folder: python -m test.bench_placement
+"""
+
+import argparse
+import random
+import time
+
+from son_mano_slm.placement import PlacementEngine
+
+
+def synthetic_vims(n_vims, rnd):
+    vims = []
+    for i in range(n_vims):
+        cores = rnd.choice([16, 32, 64, 128])
+        memory = cores * rnd.choice([2048, 4096, 8192])
+        vims.append({'vim_uuid': 'vim-%d' % i,
+                     'core_total': cores, 'core_used': rnd.randint(0, cores // 2),
+                     'memory_total': memory, 'memory_used': rnd.randint(0, memory // 2)})
+    return vims
+
+
+def run(strategy, vims, n_services, rnd):
+    engine = PlacementEngine(strategy=strategy)
+    demands = [{'cpu': rnd.randint(1, 8), 'memory': rnd.randint(1, 16)} for i in range(n_services)]
+
+    placed = 0
+    start = time.time()
+    for i, demand in enumerate(demands):
+        if engine.place(i, vims, demand) is not None:
+            placed += 1
+    duration = time.time() - start
+
+    used = sum(engine.reserved(vim['vim_uuid'])['cpu'] + vim['core_used'] for vim in vims)
+    total = sum(vim['core_total'] for vim in vims)
+    print('%-10s %5d vims %6d services: %8.1f us/placement, %6d placed, %5.1f%% cores used'
+          % (strategy, len(vims), n_services, duration / n_services * 1e6, placed, 100.0 * used / total))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='placement engine benchmark')
+    parser.add_argument('--services', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for n_vims in [10, 100, 500]:
+        for strategy in ['best-fit', 'worst-fit', 'spread']:
+            rnd = random.Random(args.seed)
+            run(strategy, synthetic_vims(n_vims, rnd), args.services, rnd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+Benchmark of the repository client of the SLM against a local stub
+repository: one new connection per request (module-level requests
+calls) versus the pooled keep-alive connections of RepositoryClient.
+
+Run from the plugin folder: python -m test.bench_repository
+"""
+
+import argparse
+import json
+import time
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from son_mano_slm.repository import RepositoryClient
+from test.stub_repository import StubRepositoryServer
+
+
+def run(name, post, n_requests, concurrency):
+    record = json.dumps({'id': '1', 'status': 'normal operation'})
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(post, 'vnf-instances', record) for i in range(n_requests)]
+        for future in futures:
+            future.result()
+    duration = time.time() - start
+    print('%-24s concurrency=%-3d %6d requests in %6.3fs (%8.1f req/s)'
+          % (name, concurrency, n_requests, duration, n_requests / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='repository client benchmark')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--delay', type=float, default=0.0, help='simulated server delay (s)')
+    args = parser.parse_args()
+
+    server = StubRepositoryServer(delay=args.delay).start()
+    headers = {'Content-Type': 'application/json'}
+
+    def post_unpooled(path, data):
+        return requests.post(server.url + path, data=data, headers=headers, timeout=10.0)
+
+    for concurrency in [1, 10]:
+        client = RepositoryClient(server.url, pool_size=concurrency)
+
+        def post_pooled(path, data):
+            return client.post(path, data=data, headers=headers)
+
+        run('requests.post', post_unpooled, args.requests, concurrency)
+        run('RepositoryClient.post', post_pooled, args.requests, concurrency)
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,538 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+End-to-end load test of the SLM. The SLM is started with simulated peers:
+the plugin manager, the infrastructure adaptor (with a configurable
+deployment delay and failure rate), the SMR, and stub record repositories
+and monitoring manager. A simulated GK sends service requests built from
+test/test_descriptors at a configurable rate and waits for the final
+message of each deployment. Reported are the throughput, the latency
+percentiles, the resource usage of the SLM and its phase histograms.
+
+By default everything runs in this process, on a local broker that
+replaces the RabbitMQ transport of son-mano-base (the CPU usage then
+includes the simulated peers). With --broker, the SLM runs in its own
+process connected to the RabbitMQ of broker_host, no other SLM, IA or
+plugin manager should be connected to it.
+
+Run from the plugin folder: python -m test.loadtest --rate 20 --count 200
+"""
+
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import re
+import resource
+import threading
+import time
+import types
+import uuid
+import yaml
+
+from unittest import mock
+from sonmanobase import messaging, plugin
+from test.stub_repository import StubRepositoryServer
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Topics of the peers of the SLM, the topics of the SLM itself are taken
+# from the slm module once it is imported
+PLUGIN_REGISTER = 'platform.management.plugin.register'
+PLUGIN_DEREGISTER = 'platform.management.plugin.deregister'
+
+
+class LocalBroker(object):
+    """
+    In-memory topic exchange. Each subscription has its own queue and
+    thread, messages of a subscription are delivered in order. Topics
+    support the '*' and '#' wildcards of AMQP.
+    """
+
+    def __init__(self):
+        self.published = 0
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic, deliver):
+        name = 'q.' + topic + '.' + str(uuid.uuid1())
+        words = []
+        for word in topic.split('.'):
+            words.append('[^.]+' if word == '*' else '.*' if word == '#' else re.escape(word))
+        pattern = re.compile('^' + r'\.'.join(words) + '$')
+        messages = queue.Queue()
+
+        def consume():
+            while True:
+                message = messages.get()
+                if message is None:
+                    return
+                try:
+                    deliver(*message)
+                except Exception:
+                    logging.exception("Error in subscription to " + topic)
+
+        with self._lock:
+            self._subscriptions[name] = (pattern, messages)
+        t = threading.Thread(target=consume)
+        t.daemon = True
+        t.start()
+        return name
+
+    def unsubscribe(self, name):
+        with self._lock:
+            subscription = self._subscriptions.pop(name, None)
+        if subscription is not None:
+            subscription[1].put(None)
+
+    def publish(self, topic, body, properties):
+        with self._lock:
+            self.published += 1
+            targets = [messages for pattern, messages in self._subscriptions.values() if pattern.match(topic)]
+        for messages in targets:
+            messages.put((topic, body, properties))
+
+
+class LocalConnection(messaging.ManoBrokerRequestResponseConnection):
+    """
+    Connection of son-mano-base to a LocalBroker instead of RabbitMQ. Only
+    the transport is replaced, requests, replies and notifications are
+    handled by the messaging module as with RabbitMQ.
+    """
+
+    def __init__(self, app_id, broker):
+        self.broker = broker
+        self._queues = []
+        super(LocalConnection, self).__init__(app_id)
+
+    def setup_connection(self):
+        return None
+
+    def stop_connection(self):
+        self.cancel_subscriptions(list(self._queues))
+
+    def publish(self, topic, message, properties=None):
+        default_properties = {'app_id': self.app_id,
+                              'content_type': 'application/json',
+                              'correlation_id': None,
+                              'reply_to': None,
+                              'headers': dict()}
+        default_properties.update(properties or {})
+        self.broker.publish(topic, message, default_properties)
+
+    def subscribe(self, cbf, topic):
+        def deliver(routing_key, body, properties):
+            method = type('method', (object,), {'routing_key': routing_key})
+            # each subscriber gets its own headers, replies modify them
+            properties = type('properties', (object,), dict(properties, headers=dict(properties['headers'] or {})))
+            cbf(None, method, properties, body)
+
+        name = self.broker.subscribe(topic, deliver)
+        self._queues.append(name)
+        return name
+
+    def cancel_subscriptions(self, subscription_queues, timeout=5):
+        for name in subscription_queues:
+            self.broker.unsubscribe(name)
+            if name in self._queues:
+                self._queues.remove(name)
+        return True
+
+    def wait_for_subscriptions(self, subscription_queues, timeout=5):
+        return True
+
+
+class SimulatedPlatform(object):
+    """
+    The peers of the SLM: the plugin manager, the infrastructure adaptor
+    and the SMR. The IA takes ia_delay seconds (+-50%) per deployment and
+    fails a fraction ia_failure_rate of them.
+    """
+
+    def __init__(self, conn, slm, ia_delay=0.1, ia_failure_rate=0.0, vims=2):
+        self.conn = conn
+        self.ia_delay = ia_delay
+        self.ia_failure_rate = ia_failure_rate
+        self.vims = [{'vim_uuid': 'vim-' + str(i), 'core_total': 100000, 'core_used': 0,
+                      'memory_total': 100000000, 'memory_used': 0} for i in range(vims)]
+        with open(os.path.join(TEST_DIR, 'test_records', 'ia-nsr.yml'), 'r') as f:
+            self.ia_reply = yaml.safe_load(f)
+        self.registered = threading.Event()
+        self.counts = {'deployments': 0, 'ia_failures': 0, 'vim_lists': 0, 'ssm_onboardings': 0, 'ssm_starts': 0}
+        self._lock = threading.Lock()
+
+        conn.register_async_endpoint(self.on_register, PLUGIN_REGISTER)
+        conn.register_async_endpoint(self.on_deregister, PLUGIN_DEREGISTER)
+        conn.register_async_endpoint(self.on_vim_list, slm.INFRA_ADAPTOR_AVAILABLE_VIMS)
+        conn.register_async_endpoint(self.on_deploy, slm.INFRA_ADAPTOR_INSTANCE_DEPLOY_REPLY_TOPIC)
+        conn.register_async_endpoint(self.on_ssm_onboard, slm.SRM_ONBOARD)
+        conn.register_async_endpoint(self.on_ssm_start, slm.SRM_START)
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def on_register(self, ch, method, properties, message):
+        self.registered.set()
+        return json.dumps({'status': 'OK', 'name': json.loads(message).get('name'), 'uuid': str(uuid.uuid4())})
+
+    def on_deregister(self, ch, method, properties, message):
+        return json.dumps({'status': 'OK'})
+
+    def on_vim_list(self, ch, method, properties, message):
+        self.count('vim_lists')
+        return yaml.dump(self.vims)
+
+    def on_deploy(self, ch, method, properties, message):
+        request = yaml.safe_load(message)
+        self.count('deployments')
+        time.sleep(self.ia_delay * random.uniform(0.5, 1.5))
+
+        reply = copy.deepcopy(self.ia_reply)
+        reply['instanceVimUuid'] = request.get('vim_uuid')
+        reply['nsr']['id'] = request['nsd'].get('instance_uuid') or str(uuid.uuid4())
+        for vnfr in reply['vnfrs']:
+            vnfr['id'] = str(uuid.uuid4())
+        if random.random() < self.ia_failure_rate:
+            self.count('ia_failures')
+            reply['request_status'] = 'FAILED: simulated failure'
+        return yaml.dump(reply)
+
+    def on_ssm_onboard(self, ch, method, properties, message):
+        self.count('ssm_onboardings')
+        return yaml.dump({'status': 'On-boarded'})
+
+    def on_ssm_start(self, ch, method, properties, message):
+        self.count('ssm_starts')
+        return yaml.dump({'status': 'Instantiated'})
+
+
+class SimulatedGatekeeper(object):
+    """
+    Sends service requests to the SLM and collects the replies. The first
+    reply of a request (INSTANTIATING or QUEUED) accepts it, it is done
+    with the first READY or ERROR message.
+    """
+
+    def __init__(self, conn, topic, request):
+        self.conn = conn
+        self.topic = topic
+        self.request = yaml.dump(request)
+        self.sent = {}
+        self.accepted = {}
+        self.results = {}
+        self.duplicates = 0
+        self.finished = threading.Event()
+        self.expected = None
+        self._lock = threading.Lock()
+        conn.subscribe(self.on_message, topic)
+
+    def send(self):
+        correlation_id = str(uuid.uuid4())
+        with self._lock:
+            self.sent[correlation_id] = time.time()
+        # a request that is answered on the topic itself, like call_async
+        # but without keeping track of pending calls
+        self.conn.notify(self.topic, self.request, correlation_id=correlation_id, reply_to=self.topic)
+
+    def drive(self, count, rate):
+        """
+        Sends count requests, rate per second (all at once if 0).
+        """
+        self.expected = count
+        start = time.time()
+        for i in range(count):
+            if rate > 0:
+                time.sleep(max(start + i / rate - time.time(), 0))
+            self.send()
+
+    def on_message(self, ch, method, properties, message):
+        if properties.reply_to is not None:
+            # a request, not a reply
+            return
+        now = time.time()
+        status = yaml.safe_load(message).get('status')
+        with self._lock:
+            if properties.correlation_id not in self.sent:
+                return
+            if status in ['INSTANTIATING', 'QUEUED']:
+                self.accepted.setdefault(properties.correlation_id, now)
+                return
+            if properties.correlation_id in self.results:
+                self.duplicates += 1
+                return
+            self.accepted.setdefault(properties.correlation_id, now)
+            error = yaml.safe_load(message).get('error') if status != 'READY' else None
+            self.results[properties.correlation_id] = (status, now, error)
+            if self.expected is not None and len(self.results) >= self.expected:
+                self.finished.set()
+
+    def wait(self, timeout):
+        return self.finished.wait(timeout)
+
+    def latencies(self):
+        """
+        Returns the time until a request was accepted, and until it was
+        done, for all requests that are done.
+        """
+        with self._lock:
+            accept = [self.accepted[c] - self.sent[c] for c in self.results]
+            done = [end - self.sent[c] for c, (status, end, error) in self.results.items()]
+        return accept, done
+
+
+def service_request(ssms=False):
+    """
+    The sonata-demo service of the test descriptors, with the SSM of the
+    service added if ssms is True.
+    """
+    path = os.path.join(TEST_DIR, 'test_descriptors')
+    with open(os.path.join(path, 'sonata-demo.yml'), 'r') as f:
+        request = {'NSD': yaml.safe_load(f)}
+    for i, name in enumerate(['firewall', 'iperf', 'tcpdump']):
+        with open(os.path.join(path, name + '-vnfd.yml'), 'r') as f:
+            request['VNFD' + str(i + 1)] = yaml.safe_load(f)
+    if ssms:
+        request['NSD']['service_specific_managers'] = [{'id': 'sonssmservice1placement1',
+                                                        'image': 'sonata-demo-ssm',
+                                                        'options': [{'key': 'myKey', 'value': 'myValue'}]}]
+    return request
+
+
+def process_usage(pid):
+    """
+    Returns the CPU time (s), rss and peak rss (MB) and number of threads
+    of a process, read from /proc. None if /proc is not available.
+    """
+    try:
+        with open('/proc/%d/stat' % pid, 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/%d/status' % pid, 'r') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except (IOError, OSError):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    return {'cpu': (int(fields[11]) + int(fields[12])) / ticks,
+            'rss': int(status['VmRSS'].split()[0]) / 1024.0,
+            'peak_rss': int(status['VmHWM'].split()[0]) / 1024.0,
+            'threads': int(status['Threads'])}
+
+
+class UsageSampler(object):
+    """
+    Samples the resource usage of a process during the test, to get the
+    peak number of threads.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.first = process_usage(pid)
+        self.last = self.first
+        self.max_threads = self.first['threads'] if self.first else None
+        self._stopped = threading.Event()
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        usage = process_usage(self.pid)
+        if usage is not None:
+            self.last = usage
+            self.max_threads = max(self.max_threads, usage['threads'])
+
+    def stop(self):
+        self._stopped.set()
+        self.sample()
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
+
+
+def set_log_level(level):
+    for name in list(logging.Logger.manager.loggerDict):
+        if name.startswith('plugin:slm') or name.startswith('son-mano-base'):
+            logging.getLogger(name).setLevel(level)
+
+
+def run_slm_process(log_level):
+    """
+    Runs the SLM connected to RabbitMQ, in the process started for it.
+    """
+    from son_mano_slm import slm
+    set_log_level(log_level)
+    slm.ServiceLifecycleManager()
+
+
+def request_metrics(conn, topic, timeout=5):
+    reply = {}
+    received = threading.Event()
+
+    def on_reply(ch, method, properties, message):
+        reply.update(yaml.safe_load(message))
+        received.set()
+
+    conn.call_async(on_reply, topic, yaml.dump({}))
+    received.wait(timeout)
+    return reply
+
+
+def report(args, gatekeeper, platform, repository, duration, sampler, metrics):
+    accept, done = gatekeeper.latencies()
+    statuses = {}
+    errors = {}
+    for status, end, error in gatekeeper.results.values():
+        statuses[status] = statuses.get(status, 0) + 1
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+
+    print('requests     %d sent, %d READY, %d ERROR, %d unanswered, %d duplicate replies in %.3fs'
+          % (len(gatekeeper.sent), statuses.get('READY', 0), statuses.get('ERROR', 0),
+             len(gatekeeper.sent) - len(gatekeeper.results), gatekeeper.duplicates, duration))
+    print('throughput   %.1f deployments/s (offered %s requests/s)'
+          % (len(done) / duration, '%.1f' % args.rate if args.rate > 0 else 'all at once'))
+    for name, values in [('accepted', accept), ('done', done)]:
+        print('%-12s p50 %.3fs  p90 %.3fs  p99 %.3fs  max %.3fs'
+              % (name, percentile(values, 0.5), percentile(values, 0.9), percentile(values, 0.99),
+                 max(values) if values else float('nan')))
+    for error, count in sorted(errors.items(), key=lambda e: -e[1])[:5]:
+        print('error        %5d x %s' % (count, error))
+
+    if sampler.first is not None:
+        cpu = sampler.last['cpu'] - sampler.first['cpu']
+        print('slm process  cpu %.2fs (%.0f%% of a core), rss %.1f MB, peak rss %.1f MB, peak threads %d%s'
+              % (cpu, 100 * cpu / duration, sampler.last['rss'], sampler.last['peak_rss'], sampler.max_threads,
+                 ' (incl. simulated peers)' if not args.broker else ''))
+    elif not args.broker:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        print('process      cpu %.2fs, max. rss %d kB' % (usage.ru_utime + usage.ru_stime, usage.ru_maxrss))
+
+    counts = platform.counts
+    print('ia           %d deployments (%d failed), %d vim lists, %d ssm on-boardings, %d ssm starts'
+          % (counts['deployments'], counts['ia_failures'], counts['vim_lists'],
+             counts['ssm_onboardings'], counts['ssm_starts']))
+    print('repositories %d requests on %d connections, %d duplicates'
+          % (repository.requests, len(repository.connections), repository.duplicates))
+
+    if metrics.get('status') == 'OK':
+        print('outbox       %s' % metrics['outbox'])
+        for phase, histogram in sorted(metrics['phases'].items()):
+            print('phase %-26s count %6d  p50 <%7.3fs  p90 <%7.3fs  p99 <%7.3fs  max %7.3fs'
+                  % (phase, histogram['count'], histogram['p50'], histogram['p90'], histogram['p99'], histogram['max']))
+    else:
+        print('no metrics received from the slm')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SLM end-to-end load test')
+    parser.add_argument('--count', type=int, default=100, help='number of service requests')
+    parser.add_argument('--rate', type=float, default=10.0, help='requests per second, 0 sends all at once')
+    parser.add_argument('--ia-delay', type=float, default=0.1, help='mean time (s) the IA takes per deployment')
+    parser.add_argument('--ia-failure-rate', type=float, default=0.0, help='fraction of deployments failed by the IA')
+    parser.add_argument('--vims', type=int, default=2, help='number of vims of the IA')
+    parser.add_argument('--repository-delay', type=float, default=0.0, help='time (s) each repository request takes')
+    parser.add_argument('--repository-failure-rate', type=float, default=0.0, help='fraction of repository requests answered with a 500')
+    parser.add_argument('--ssms', action='store_true', help='services with an SSM, on-boarded at the SMR')
+    parser.add_argument('--timeout', type=float, default=120.0, help='max. time (s) to wait for the deployments')
+    parser.add_argument('--broker', action='store_true', help='run the SLM in its own process on the RabbitMQ of broker_host')
+    parser.add_argument('--log-level', default='WARNING', help='log level of the SLM and son-mano-base')
+    args = parser.parse_args()
+
+    repository = StubRepositoryServer(delay=args.repository_delay, failure_rate=args.repository_failure_rate).start()
+    # the slm reads its configuration when it is imported
+    os.environ['url_nsr_repository'] = repository.url
+    os.environ['url_vnfr_repository'] = repository.url
+    os.environ['url_monitoring_server'] = repository.url
+    os.environ.setdefault('slm_log_level', args.log_level)
+    from son_mano_slm import slm
+    logging.getLogger().setLevel(args.log_level)
+    set_log_level(args.log_level)
+
+    manager = None
+    process = None
+    patches = []
+    if args.broker:
+        conn = messaging.ManoBrokerRequestResponseConnection('son-plugin.LoadTest')
+    else:
+        broker = LocalBroker()
+        conn = LocalConnection('son-plugin.LoadTest', broker)
+        # the plugin base class connects to the local broker
+        local_messaging = types.SimpleNamespace(ManoBrokerRequestResponseConnection=lambda app_id: LocalConnection(app_id, broker))
+        patches = [mock.patch.object(plugin, 'messaging', local_messaging),
+                   # return from the constructor instead of running forever
+                   mock.patch.object(slm.ServiceLifecycleManager, 'run', lambda self: None, create=True)]
+        for patch in patches:
+            patch.start()
+
+    platform = SimulatedPlatform(conn, slm, args.ia_delay, args.ia_failure_rate, args.vims)
+    gatekeeper = SimulatedGatekeeper(conn, slm.GK_INSTANCE_CREATE_TOPIC, service_request(args.ssms))
+
+    if args.broker:
+        process = multiprocessing.Process(target=run_slm_process, args=(args.log_level,))
+        process.daemon = True
+        process.start()
+        pid = process.pid
+        if not platform.registered.wait(30):
+            raise SystemExit('The SLM did not register.')
+        # the endpoints of the slm are bound shortly after it registered
+        time.sleep(1)
+    else:
+        manager = slm.ServiceLifecycleManager()
+        pid = os.getpid()
+
+    sampler = UsageSampler(pid)
+    start = time.time()
+    gatekeeper.drive(args.count, args.rate)
+    if not gatekeeper.wait(max(args.timeout - (time.time() - start), 0)):
+        print('time-out: %d of %d deployments unanswered' % (args.count - len(gatekeeper.results), args.count))
+    duration = time.time() - start
+    sampler.stop()
+
+    metrics = request_metrics(conn, slm.SLM_METRICS)
+    report(args, gatekeeper, platform, repository, duration, sampler, metrics)
+
+    if process is not None:
+        process.terminate()
+        process.join(5)
+    if manager is not None:
+        manager.deployments.shutdown()
+        manager.outbox.close()
+    for patch in patches:
+        patch.stop()
+    repository.stop()
+
+
+if __name__ == '__main__':
+    main()
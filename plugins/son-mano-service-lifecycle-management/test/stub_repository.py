@@ -0,0 +1,181 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+"""
+A stub of the SONATA record repositories and the monitoring manager. It
+keeps the records in memory and can simulate slow or failing servers.
+Used by benchmarks and load tests of the SLM, not by the unit tests.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+import yaml
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from son_mano_slm import repository
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubRepositoryServer(object):
+    """
+    In-memory repository: POST <collection> stores a record by its 'id',
+    GET/PUT <collection>/<id> read and replace it (GET sends an ETag and
+    answers 304 if the If-None-Match header matches it), PATCH <collection>/<id>
+    applies a JSON merge patch, if the If-Match header matches the version
+    of the record. The monitoring manager endpoint 'service/new' always
+    answers with success. A POST with an Idempotency-Key that was seen
+    before is answered like the first one, without storing anything.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, failure_rate=0.0, patch_support=True):
+        """
+        :param delay: time in s each request takes
+        :param failure_rate: fraction of requests answered with a 500
+        :param patch_support: if False, PATCH requests are answered with a 405
+        """
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.patch_support = patch_support
+        self.records = {}
+        self.replies = {}
+        self.duplicates = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # answer keep-alive connections without delayed ACK stalls
+            disable_nagle_algorithm = True
+
+            def _reply(self, code, body, etag=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return yaml.safe_load(self.rfile.read(length).decode('utf-8'))
+
+            def _simulate(self):
+                with stub._lock:
+                    stub.requests = stub.requests + 1
+                    stub.connections.add(self.client_address)
+                if stub.delay > 0:
+                    time.sleep(stub.delay)
+                return random.random() >= stub.failure_rate
+
+            def do_GET(self):
+                if not self._simulate():
+                    return self._reply(500, {'error': 'simulated failure'})
+                record = stub.records.get(self.path.strip('/'))
+                if record is None:
+                    return self._reply(404, {'error': 'not found'})
+                etag = '"' + hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    with stub._lock:
+                        stub.not_modified = stub.not_modified + 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    return self.end_headers()
+                self._reply(200, record, etag=etag)
+
+            def do_POST(self):
+                body = self._body()
+                if not self._simulate():
+                    return self._reply(500, {'error': 'simulated failure'})
+                key = self.headers.get('Idempotency-Key')
+                with stub._lock:
+                    if key is not None and key in stub.replies:
+                        stub.duplicates = stub.duplicates + 1
+                        return self._reply(200, stub.replies[key])
+                    path = self.path.strip('/')
+                    if path == 'service/new':
+                        body = {'status': 'success'}
+                    else:
+                        stub.records[path + '/' + str(body.get('id'))] = body
+                    if key is not None:
+                        stub.replies[key] = body
+                self._reply(200, body)
+
+            def do_PUT(self):
+                body = self._body()
+                if not self._simulate():
+                    return self._reply(500, {'error': 'simulated failure'})
+                stub.records[self.path.strip('/')] = body
+                self._reply(200, body)
+
+            def do_PATCH(self):
+                body = self._body()
+                if not self._simulate():
+                    return self._reply(500, {'error': 'simulated failure'})
+                if not stub.patch_support:
+                    return self._reply(405, {'error': 'method not allowed'})
+                path = self.path.strip('/')
+                with stub._lock:
+                    record = stub.records.get(path)
+                    if record is None:
+                        return self._reply(404, {'error': 'not found'})
+                    version = self.headers.get('If-Match')
+                    if version is not None and version != str(record.get('version')):
+                        return self._reply(412, {'error': 'version mismatch'})
+                    record = repository.apply_merge_patch(record, body)
+                    stub.records[path] = record
+                self._reply(200, record)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -29,11 +29,27 @@ import threading
 import logging
 import uuid
 import son_mano_slm.slm_helpers as tools
+import son_mano_slm.repository as repository
+import son_mano_slm.workflow as workflow
+import tempfile
+import os
+from son_mano_slm.request_store import ServiceRequestStore
+from son_mano_slm.journal import Journal
+from son_mano_slm.vim_inventory import VimInventory
+from son_mano_slm.placement import PlacementEngine
+from son_mano_slm import admission
+from son_mano_slm.capture import RequestCapture
+from son_mano_slm.descriptors import DescriptorValidator, DescriptorCache
+from son_mano_slm import outbox
+from son_mano_slm import timings
 
 from unittest import mock
 from multiprocessing import Process
+from concurrent.futures import ThreadPoolExecutor
 from son_mano_slm.slm import ServiceLifecycleManager
 from sonmanobase.messaging import ManoBrokerRequestResponseConnection
+from sonmanobase.plugin import decode_heartbeat
+from test.stub_repository import StubRepositoryServer
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('amqp-storm').setLevel(logging.INFO)
@@ -107,7 +123,7 @@ class testSlmRegistrationAndHeartbeat(unittest.TestCase):
             When the heartbeat message is received, this
             method checks if it is formatted correctly
             """
-            msg = json.loads(str(message))
+            msg = decode_heartbeat(message)
             #CHECK: The message should be a dictionary.
             self.assertTrue(isinstance(msg, dict), msg="Message is not a dictionary.")
             #CHECK: The dictionary should have a key 'uuid'.
@@ -686,5 +702,773 @@ class testSlmFunctionality(unittest.TestCase):
 #TEST11: Test creation of the NSR
 ###############################################################################
 
+###############################################################################
+#TEST12: Test validation of service requests.
+###############################################################################
+    def testServiceRequestValidation(self):
+        """
+        The SLM should accept correctly formatted service requests and
+        describe what is wrong with the others.
+        """
+
+        service_request = yaml.load(self.createGkNewServiceRequestMessage(correctlyFormatted=True))
+        self.assertIsNone(tools.validate_service_request(service_request))
+
+        self.assertEqual(tools.validate_service_request('NSD'), 'Message is not a dictionary')
+        self.assertEqual(tools.validate_service_request(yaml.load(self.createGkNewServiceRequestMessage(correctlyFormatted=False))), 'No NSD field in dictionary')
+
+        del service_request['VNFD3']
+        self.assertEqual(tools.validate_service_request(service_request), 'Number of VNFDs doesn\'t match number of vnfs')
+
+        service_request['VNFD3'] = None
+        self.assertEqual(tools.validate_service_request(service_request), 'VNFDs are not allowed to be empty')
+
+###############################################################################
+#TEST13: Test reaction to a batch of service requests.
+###############################################################################
+    def on_gk_response_to_batch_service_request(self, ch, method, properties, message):
+        """
+        This method checks whether the SLM reports the status of each service
+        of a batch.
+        """
+
+        msg = yaml.load(message)
+        self.assertEqual(msg['status'], 'INSTANTIATING', msg='not correct response, should be INSTANTIATING')
+        self.assertEqual(properties.correlation_id, self.corr_id, msg='response to async call doesnt have the same correlation_id')
+
+        statuses = [service['status'] for service in msg['services']]
+        self.assertEqual(statuses, ['INSTANTIATING', 'ERROR', 'INSTANTIATING'], msg='not the correct status per service.')
+        self.assertEqual(msg['services'][1]['error'], 'No NSD field in dictionary')
+        corr_ids = set(service['correlation_id'] for service in msg['services'])
+        self.assertEqual(len(corr_ids), 3, msg='services do not have their own correlation_id.')
+
+        self.firstEventFinished()
+
+    def on_slm_infra_adaptor_vim_list_test13(self, ch, method, properties, message):
+        """
+        This method counts the vim list requests of the SLM.
+        """
+
+        if properties.reply_to == 'infrastructure.management.compute.list':
+            self.vim_list_requests += 1
+
+    def testReactionToBatchServiceRequest(self):
+        """
+        If the gk sends a batch of service requests on the
+        service.instances.batch.create topic, the SLM should reply with the
+        status of each service and request the vim list from the IA once.
+        """
+
+        self.wait_for_first_event.clear()
+        self.vim_list_requests = 0
+
+        #STEP1: Spy the topic on which the SLM requests the vim list
+        self.manoconn_spy.subscribe(self.on_slm_infra_adaptor_vim_list_test13, 'infrastructure.management.compute.list')
+
+        #STEP2: Send a batch with two correct service requests and a wrong one
+        correct = yaml.load(self.createGkNewServiceRequestMessage(correctlyFormatted=True))
+        wrong = yaml.load(self.createGkNewServiceRequestMessage(correctlyFormatted=False))
+        batch = {'services': [correct, wrong, correct]}
+        self.manoconn_gk.call_async(self.on_gk_response_to_batch_service_request, 'service.instances.batch.create', msg=yaml.dump(batch), content_type='application/yaml', correlation_id=self.corr_id)
+
+        #STEP3: Start waiting for the reply of the SLM
+        self.waitForFirstEvent(timeout=10, msg='Wait for reply to batch request from GK timed out.')
+
+        #STEP4: Both services share the vim list request
+        time.sleep(2)
+        self.assertEqual(self.vim_list_requests, 1, msg='vim list is not requested once for the batch.')
+
+
+class testSlmRepositoryClient(unittest.TestCase):
+    """
+    Tests the http client the SLM uses to contact the repositories.
+    """
+
+    def setUp(self):
+        self.server = StubRepositoryServer().start()
+        self.client = repository.RepositoryClient(self.server.url, retries=2, backoff=0.01)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testStoreAndRetrieveRecord(self):
+        response = self.client.post('vnf-instances', data=json.dumps({'id': '1'}), headers={'Content-Type':'application/json'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('vnf-instances/1')
+        self.assertEqual(response.json(), {'id': '1'})
+        #CHECK: both requests used the same connection.
+        self.assertEqual(len(self.server.connections), 1)
+
+    def testRetryOfIdempotentRequests(self):
+        self.server.failure_rate = 1.0
+        response = self.client.get('vnf-instances/1')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.server.requests, 3, msg='GET should be retried twice.')
+
+        self.server.requests = 0
+        response = self.client.post('vnf-instances', data=json.dumps({'id': '1'}))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.server.requests, 1, msg='POST should not be retried.')
+
+    def testTimedRequestOnConnectionError(self):
+        self.server.stop()
+        result = self.client.timed_request('post', 'ns-instances', data='{}')
+        self.assertIsNone(result['response'])
+        self.assertIsNotNone(result['exception'])
+        self.assertTrue(result['duration'] >= 0)
+
+    def testFetchRecords(self):
+        for record_id in ['1', '2']:
+            self.client.post('vnf-instances', data=json.dumps({'id': record_id, 'version': '1'}))
+        self.server.requests = 0
+
+        cache = repository.RecordCache()
+        executor = ThreadPoolExecutor(max_workers=2)
+        records = repository.fetch_records(self.client, 'vnf-instances', ['1', '2', '3'], executor, cache=cache)
+        self.assertEqual(records['1'], {'id': '1', 'version': '1'})
+        self.assertIsNone(records['3'])
+        self.assertEqual(self.server.requests, 3)
+
+        #CHECK: the second fetch only requests the record that was not found.
+        records = repository.fetch_records(self.client, 'vnf-instances', ['1', '2', '3'], executor, cache=cache)
+        self.assertEqual(records['2'], {'id': '2', 'version': '1'})
+        self.assertEqual(self.server.requests, 4)
+
+        #CHECK: revalidated records are only taken from the cache if they did not change.
+        self.client.put('vnf-instances/2', data=json.dumps({'id': '2', 'version': '2'}))
+        records = repository.fetch_records(self.client, 'vnf-instances', ['1', '2'], executor, cache=cache, revalidate=True)
+        self.assertEqual(records, {'1': {'id': '1', 'version': '1'}, '2': {'id': '2', 'version': '2'}})
+        self.assertEqual(cache.get('2'), {'id': '2', 'version': '2'})
+        self.assertEqual(self.server.not_modified, 1, msg='Record 1 should be revalidated with its ETag.')
+
+        #CHECK: records cached without an ETag are fetched again.
+        cache.put('1', {'id': '1', 'version': '0'})
+        records = repository.fetch_records(self.client, 'vnf-instances', ['1'], executor, cache=cache, revalidate=True)
+        self.assertEqual(records['1'], {'id': '1', 'version': '1'})
+        self.assertIsNotNone(cache.etag('1'))
+        executor.shutdown()
+
+    def testRecordCache(self):
+        cache = repository.RecordCache(size=2, ttl=60)
+        cache.put('1', {'id': '1', 'version': '1'})
+        cache.put('2', {'id': '2', 'version': '1'})
+
+        record = cache.get('1')
+        record['status'] = 'updating'
+        self.assertEqual(cache.get('1'), {'id': '1', 'version': '1'}, msg='Cache returned a shared record.')
+        self.assertIsNone(cache.get('1', version='2'))
+
+        #CHECK: '2' is the least recently used entry and gets evicted.
+        cache.put('3', {'id': '3', 'version': '1'})
+        self.assertIsNone(cache.get('2'))
+        self.assertIsNotNone(cache.get('1'))
+
+        cache.ttl = 0
+        time.sleep(0.01)
+        self.assertIsNone(cache.get('1'))
+
+    def testMergePatch(self):
+        old = {'id': '1', 'version': '1', 'status': 'offline', 'vim': {'id': 'a', 'pop': 'x'}, 'links': [1, 2]}
+        new = {'id': '1', 'version': '2', 'status': 'offline', 'vim': {'id': 'b', 'pop': 'x'}, 'links': [1]}
+        patch = repository.merge_patch(old, new)
+        self.assertEqual(patch, {'version': '2', 'vim': {'id': 'b'}, 'links': [1]})
+        self.assertEqual(repository.apply_merge_patch(old, patch), new)
+
+        del new['status']
+        self.assertEqual(repository.merge_patch(old, new)['status'], None)
+        self.assertEqual(repository.apply_merge_patch(old, repository.merge_patch(old, new)), new)
+
+        #CHECK: null fields can not be sent as a patch, nulls in lists can.
+        self.assertTrue(repository.has_null_fields({'id': '1', 'vim': {'pop': None}}))
+        self.assertFalse(repository.has_null_fields({'id': '1', 'links': [None]}))
+
+    def testUpdateRecord(self):
+        old = {'id': '1', 'version': '1', 'status': 'offline', 'network_functions': [{'vnfr_id': '2'}]}
+        self.client.post('ns-instances', data=json.dumps(old))
+        new = dict(old, version='2', status='updating')
+
+        response = repository.update_record(self.client, 'ns-instances/1', old, new)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.records['ns-instances/1'], new)
+        self.assertTrue(self.client.supports_patch)
+
+        #CHECK: an update based on an outdated version is refused.
+        response = repository.update_record(self.client, 'ns-instances/1', old, dict(old, version='3'))
+        self.assertEqual(response.status_code, 412)
+
+        #CHECK: a record with a null field is PUT, so the null is stored.
+        with_null = dict(new, version='3', status=None)
+        response = repository.update_record(self.client, 'ns-instances/1', new, with_null)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.records['ns-instances/1'], with_null)
+        self.assertTrue(self.client.supports_patch)
+        new = with_null
+
+        #CHECK: without PATCH support, the full record is PUT.
+        self.server.patch_support = False
+        client = repository.RepositoryClient(self.server.url)
+        newer = dict(new, version='3', status='normal operation')
+        response = repository.update_record(client, 'ns-instances/1', new, newer)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(client.supports_patch)
+        self.assertEqual(self.server.records['ns-instances/1'], newer)
+
+
+class testServiceRequestStore(unittest.TestCase):
+    """
+    Tests the store of the service requests being handled by the SLM.
+    """
+
+    def testLookups(self):
+        store = ServiceRequestStore()
+        request = {'NSD': {}}
+        self.assertTrue(store.add('orig', request))
+        self.assertFalse(store.add('orig', {'NSD': {}}), msg='Duplicate correlation id accepted.')
+        #CHECK: ids that only contain the original one are no duplicates.
+        self.assertFalse(store.has_original('ori'))
+
+        new_corr_id = store.replace_corr_id('orig')
+        self.assertNotIn('orig', store)
+        self.assertIs(store[new_corr_id], request)
+        self.assertIs(store.get_by_original('orig'), request)
+
+        store.set_onboarding_corr_id(new_corr_id, 'onboarding')
+        self.assertIs(store.get_by_onboarding('onboarding'), request)
+
+        self.assertIs(store.pop_by_original('orig'), request)
+        self.assertEqual(len(store), 0)
+        self.assertIsNone(store.get_by_onboarding('onboarding'))
+        self.assertIsNone(store.pop(new_corr_id, None))
+
+
+class testWorkflowEngine(unittest.TestCase):
+    """
+    Tests the workflow engine that drives the deployments of the SLM.
+    """
+
+    def setUp(self):
+        self.failed = []
+        self.finished = threading.Event()
+        self.engine = workflow.WorkflowEngine(pool_size=4, on_failed=self.failed.append, on_finished=self.on_finished)
+        self.ended = []
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def on_finished(self, deployment):
+        self.ended.append(deployment)
+        if len(self.ended) == self.expected:
+            self.finished.set()
+
+    def testDeploymentsRunConcurrently(self):
+        def requested(deployment, event, payload):
+            self.engine.transition(deployment, workflow.VIM_LIST)
+
+        def vim_list(deployment, event, payload):
+            if event == 'vim_list':
+                deployment.context['events'].append(payload)
+                if len(deployment.context['events']) == 3:
+                    self.engine.transition(deployment, workflow.DONE)
+
+        self.engine.register_state(workflow.REQUESTED, requested)
+        self.engine.register_state(workflow.VIM_LIST, vim_list)
+
+        self.expected = 1000
+        for i in range(self.expected):
+            self.engine.start(i, {'events': []})
+        for n in range(3):
+            for i in range(self.expected):
+                self.engine.post(i, 'vim_list', n)
+
+        self.assertTrue(self.finished.wait(10), msg='Deployments did not finish.')
+        #CHECK: events of a deployment are handled in order.
+        for deployment in self.ended:
+            self.assertEqual(deployment.context['events'], [0, 1, 2])
+            self.assertEqual([state for state, duration in deployment.timings], [workflow.REQUESTED, workflow.VIM_LIST])
+        self.assertEqual(len(self.engine), 0)
+        self.assertEqual(self.engine.metrics()[workflow.DONE]['count'], self.expected)
+        self.assertFalse(self.engine.post(0, 'vim_list'), msg='Event for finished deployment accepted.')
+
+    def testFailingHandler(self):
+        def requested(deployment, event, payload):
+            raise KeyError('vim')
+
+        self.engine.register_state(workflow.REQUESTED, requested)
+        self.expected = 1
+        deployment = self.engine.start('1')
+
+        self.assertTrue(self.finished.wait(5), msg='Deployment did not finish.')
+        self.assertEqual(deployment.state, workflow.FAILED)
+        self.assertEqual(self.failed, [deployment])
+        self.assertEqual(deployment.error, "'vim'")
+
+    def testTaskGraph(self):
+        tasks = workflow.TaskGraph()
+        tasks.add('onboarding')
+        tasks.add('deployment')
+        tasks.add('monitoring', requires=['deployment'])
+        tasks.add('start', requires=['onboarding', 'monitoring'])
+        tasks.add('report', requires=['start'])
+        self.assertRaises(ValueError, tasks.add, 'loop', requires=['unknown'])
+        self.assertEqual(tasks.get('deployment')['state'], workflow.RUNNING)
+        self.assertEqual(tasks.get('start')['state'], workflow.WAITING)
+
+        self.assertEqual([t['name'] for t in tasks.finish('deployment', 'nsr')], ['monitoring'])
+        self.assertEqual(tasks.finish('onboarding', 'ssm'), [])
+        #CHECK: a task is started once, when all its requirements succeeded.
+        self.assertEqual([t['name'] for t in tasks.finish('monitoring')], ['start'])
+        self.assertEqual(tasks.finish('monitoring'), [])
+        self.assertEqual(tasks.results('start'), {'onboarding': 'ssm', 'monitoring': None})
+        self.assertEqual(tasks.pending(), ['start', 'report'])
+
+        #CHECK: tasks that require a task that timed out are skipped.
+        tasks = workflow.TaskGraph()
+        tasks.add('onboarding', timeout=5)
+        tasks.add('deployment')
+        tasks.add('start', requires=['onboarding', 'deployment'])
+        tasks.add('report', requires=['start'])
+        self.assertEqual(tasks.expire('onboarding'), [])
+        skipped = tasks.expire('onboarding', now=time.time() + 5)
+        self.assertEqual([(t['name'], t['state']) for t in skipped], [('start', workflow.SKIPPED), ('report', workflow.SKIPPED)])
+        self.assertEqual(tasks.get('onboarding')['state'], workflow.TIMED_OUT)
+        self.assertEqual(tasks.finish('onboarding'), [])
+        self.assertEqual(tasks.finish('deployment'), [])
+
+    def testTasksOfDeployments(self):
+        started = []
+
+        def requested(deployment, event, payload):
+            if event == workflow.ENTER:
+                self.engine.finish_task(deployment.id, 'deployment', 'deployed')
+            elif event == 'done':
+                self.engine.transition(deployment, workflow.DONE)
+
+        def start(deployment, task):
+            started.append((deployment.id, task['state'], task['error'] or deployment.tasks.results('start')))
+            if task['state'] == workflow.SKIPPED:
+                self.engine.fail(deployment, task['error'])
+            else:
+                self.engine.post(deployment.id, 'done')
+
+        self.engine.register_state(workflow.REQUESTED, requested)
+        self.engine.register_task('start', start)
+        self.expected = 2
+        for deployment_id in ['1', '2']:
+            tasks = workflow.TaskGraph()
+            tasks.add('onboarding', timeout=0.2)
+            tasks.add('deployment')
+            tasks.add('start', requires=['onboarding', 'deployment'])
+            self.engine.start(deployment_id, tasks=tasks)
+        self.engine.finish_task('1', 'onboarding', 'onboarded')
+        self.engine.finish_task('1', 'onboarding', 'onboarded')
+
+        self.assertTrue(self.finished.wait(5), msg='Deployments did not finish.')
+        #CHECK: the first deployment started once, the second timed out.
+        self.assertEqual(sorted(started), [('1', workflow.RUNNING, {'onboarding': 'onboarded', 'deployment': 'deployed'}),
+                                           ('2', workflow.SKIPPED, 'Task onboarding timed out after 0.2s.')])
+        self.assertEqual(dict((d.id, d.state) for d in self.ended), {'1': workflow.DONE, '2': workflow.FAILED})
+
+
+class testJournal(unittest.TestCase):
+    """
+    Tests the journal in which the SLM records in-flight requests.
+    """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'journal.log')
+
+    def testReplayOfPendingEntries(self):
+        journal = Journal(self.path, compact_threshold=10)
+        self.assertEqual(journal.replay(), [])
+        journal.start()
+        journal.append('deployment', 'a', 'REQUESTED', {'NSD': {}})
+        journal.append('deployment', 'b', 'REQUESTED', {'NSD': {}})
+        journal.append('deployment', 'a', 'VIM_LIST')
+        journal.append('deployment', 'b', 'DONE')
+        journal.append('update', 'c', 'UPDATING', {'orig_corr_id': 'd'})
+        self.assertTrue(journal.flush(timeout=5))
+        journal.close()
+
+        #CHECK: a crash during a write does not break the replay.
+        with open(self.path, 'a') as f:
+            f.write('{"kind": "deploym')
+
+        entries = Journal(self.path).replay()
+        self.assertEqual([(e['kind'], e['id'], e['state']) for e in entries], [('deployment', 'a', 'VIM_LIST'), ('update', 'c', 'UPDATING')])
+        self.assertEqual(entries[0]['data'], {'NSD': {}})
+
+    def testCompaction(self):
+        journal = Journal(self.path, compact_threshold=10)
+        journal.replay()
+        journal.start()
+        for i in range(100):
+            journal.append('deployment', str(i), 'REQUESTED', {})
+            journal.append('deployment', str(i), 'DONE')
+        journal.append('deployment', 'x', 'REQUESTED', {})
+        journal.flush(timeout=5)
+        journal.close()
+
+        with open(self.path, 'r') as f:
+            self.assertTrue(len(f.readlines()) < 20, msg='Journal was not compacted.')
+        self.assertEqual([e['id'] for e in Journal(self.path).replay()], ['x'])
+
+
+class testVimInventory(unittest.TestCase):
+    """
+    Tests the cache of the vim list of the IA.
+    """
+
+    def testCachedVimList(self):
+        inventory = VimInventory(ttl=60)
+        self.assertIsNone(inventory.get())
+
+        inventory.update([{'vim_uuid': '1'}, {'vim_uuid': '2'}])
+        self.assertEqual(inventory.get(), [{'vim_uuid': '1'}, {'vim_uuid': '2'}])
+
+        #CHECK: only a failure on a listed vim drops the list.
+        inventory.invalidate('3')
+        self.assertIsNotNone(inventory.get())
+        inventory.invalidate('2')
+        self.assertIsNone(inventory.get())
+
+        #CHECK: callers get their own copy.
+        inventory.update([{'vim_uuid': '1'}])
+        inventory.get()[0]['vim_uuid'] = '2'
+        self.assertEqual(inventory.get(), [{'vim_uuid': '1'}])
+
+        #CHECK: empty lists are not cached.
+        inventory.update([])
+        self.assertIsNone(inventory.get())
+
+        inventory.update([{'vim_uuid': '1'}])
+        inventory.ttl = 0
+        time.sleep(0.01)
+        self.assertIsNone(inventory.get())
+
+
+class testPlacementEngine(unittest.TestCase):
+    """
+    Tests the selection of vims by the placement engine.
+    """
+
+    def setUp(self):
+        #memory in MB, as reported by the IA
+        self.vims = [{'vim_uuid': 'small', 'core_total': 8, 'core_used': 4, 'memory_total': 16384, 'memory_used': 8192},
+                     {'vim_uuid': 'large', 'core_total': 64, 'core_used': 8, 'memory_total': 131072, 'memory_used': 8192}]
+
+    def testStrategies(self):
+        demand = {'cpu': 2, 'memory': 4}
+        self.assertEqual(PlacementEngine(strategy='best-fit').place('1', self.vims, demand), 'small')
+        self.assertEqual(PlacementEngine(strategy='worst-fit').place('1', self.vims, demand), 'large')
+        #CHECK: services that fit nowhere are not placed.
+        self.assertIsNone(PlacementEngine().place('1', self.vims, {'cpu': 100, 'memory': 1}))
+
+    def testReservations(self):
+        engine = PlacementEngine(strategy='best-fit')
+        demand = {'cpu': 3, 'memory': 4}
+        self.assertEqual(engine.place('1', self.vims, demand), 'small')
+        #CHECK: the reservation of the first service fills the small vim.
+        self.assertEqual(engine.place('2', self.vims, demand), 'large')
+
+        engine.release('1')
+        self.assertEqual(engine.reserved('small'), {'cpu': 0, 'memory': 0})
+
+        #CHECK: committed reservations are kept until a vim list shows their resources as used.
+        engine.on_vim_list_update(self.vims)
+        engine.commit('2')
+        engine.release('2')
+        engine.on_vim_list_update(self.vims)
+        self.assertEqual(engine.reserved('large'), {'cpu': 3, 'memory': 4})
+        self.vims[1]['core_used'] += 3
+        self.vims[1]['memory_used'] += 4096
+        engine.on_vim_list_update(self.vims)
+        self.assertEqual(engine.reserved('large'), {'cpu': 0, 'memory': 0})
+
+    def testReservationTimeout(self):
+        engine = PlacementEngine(reservation_timeout=0.05)
+        engine.on_vim_list_update(self.vims)
+        engine.place('1', self.vims, {'cpu': 3, 'memory': 4})
+        engine.place('2', self.vims, {'cpu': 3, 'memory': 4})
+        engine.commit('1')
+        engine.commit('2')
+
+        #CHECK: growth covering one service drops the oldest reservation.
+        self.vims[0]['core_used'] += 3
+        self.vims[0]['memory_used'] += 4096
+        engine.on_vim_list_update(self.vims)
+        self.assertEqual(engine.reserved('small'), {'cpu': 0, 'memory': 0})
+        self.assertEqual(engine.reserved('large'), {'cpu': 3, 'memory': 4})
+
+        #CHECK: reservations that never show up in the vim list time out.
+        time.sleep(0.1)
+        engine.on_vim_list_update(self.vims)
+        self.assertEqual(engine.reserved('large'), {'cpu': 0, 'memory': 0})
+
+    def testSpreadAndUnknownCapacity(self):
+        engine = PlacementEngine(strategy='spread')
+        self.assertEqual(engine.place('1', self.vims, {'cpu': 1, 'memory': 1}), 'large')
+        self.assertEqual(engine.place('2', self.vims, {'cpu': 1, 'memory': 1}), 'small')
+
+        #CHECK: vims without capacity information are used in list order.
+        vims = [{'vim_uuid': '1'}, {'vim_uuid': '2'}]
+        self.assertEqual(PlacementEngine().place('1', vims, {'cpu': 1, 'memory': 1}), '1')
+
+
+class testAdmissionController(unittest.TestCase):
+    """
+    Tests the admission control of service deployments.
+    """
+
+    def testQueueAndPriorities(self):
+        controller = admission.AdmissionController(queue_size=2, max_active=1, max_per_vim=1)
+        self.assertEqual(controller.submit('a'), (admission.ADMITTED, 0))
+        self.assertEqual(controller.submit('b', 'low'), (admission.QUEUED, 0))
+        #CHECK: a high priority request is queued in front of the low one.
+        self.assertEqual(controller.submit('c', 'high'), (admission.QUEUED, 0))
+        self.assertEqual(controller.submit('d'), (admission.REJECTED, None))
+
+        self.assertEqual(controller.release('a'), ['c'])
+        self.assertEqual(controller.release('c'), ['b'])
+        self.assertEqual(controller.release('b'), [])
+        self.assertEqual(controller.status()['active'], 0)
+
+    def testPriorities(self):
+        self.assertEqual(admission.parse_priority('High '), 'high')
+        self.assertIsNone(admission.parse_priority(['high']))
+        self.assertIsNone(admission.parse_priority({'high': 1}))
+
+        #CHECK: invalid priorities are queued with the default one.
+        controller = admission.AdmissionController(max_active=0)
+        self.assertEqual(controller.submit('a', {'high': 1}), (admission.QUEUED, 0))
+        self.assertEqual(controller.submit('b', 'high'), (admission.QUEUED, 0))
+        self.assertEqual(controller.submit('c', ['low']), (admission.QUEUED, 2))
+
+    def testVimSlots(self):
+        controller = admission.AdmissionController(max_per_vim=1)
+        self.assertTrue(controller.acquire_vim('a', 'vim'))
+        self.assertFalse(controller.acquire_vim('b', 'vim'))
+        self.assertFalse(controller.acquire_vim('c', 'vim'))
+        self.assertTrue(controller.acquire_vim('d', 'other'))
+
+        #CHECK: a deployment that stops waiting does not get the slot.
+        self.assertIsNone(controller.release_vim('b'))
+        self.assertEqual(controller.release_vim('a'), 'c')
+        self.assertIsNone(controller.release_vim('c'))
+        self.assertIsNone(controller.release_vim('c'))
+
+
+class testRequestCapture(unittest.TestCase):
+    """
+    Tests the capture of the requests sent by the SLM.
+    """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'requests.yml')
+
+    def testRingBuffer(self):
+        capture = RequestCapture(size=2)
+        for i in range(3):
+            capture.capture('topic', str(i), {'nr': i})
+
+        #CHECK: only the last requests are kept.
+        self.assertEqual([entry['request']['nr'] for entry in capture.dump(clear=True)], [1, 2])
+        self.assertEqual(capture.dump(), [])
+
+        #CHECK: a disabled capture keeps nothing.
+        capture = RequestCapture(size=0)
+        capture.capture('topic', '1', {})
+        self.assertEqual(capture.dump(), [])
+
+    def testRotatingFile(self):
+        capture = RequestCapture(size=100, path=self.path, max_bytes=200, backups=1)
+        capture.start()
+        for i in range(10):
+            capture.capture('topic', str(i), {'nr': i})
+            time.sleep(0.01)
+        capture.close()
+
+        #CHECK: the file is rotated, the last requests are in the current file.
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertFalse(os.path.exists(self.path + '.2'))
+        entries = list(yaml.safe_load_all(open(self.path)))
+        self.assertEqual(entries[-1]['request'], {'nr': 9})
+        self.assertLessEqual(os.path.getsize(self.path), 200)
+
+class testDescriptorValidator(unittest.TestCase):
+    """
+    Tests the validation of descriptors against their schema.
+    """
+
+    def setUp(self):
+        path_descriptors = '/plugins/son-mano-service-lifecycle-management/test/test_descriptors/'
+        self.service_request = {'NSD': yaml.load(open(path_descriptors + 'sonata-demo.yml', 'r')),
+                                'VNFD1': yaml.load(open(path_descriptors + 'firewall-vnfd.yml', 'r'))}
+        self.validator = DescriptorValidator()
+
+    def testValidation(self):
+        self.assertIsNone(self.validator.validate_request(self.service_request))
+
+        vdu = self.service_request['VNFD1']['virtual_deployment_units'][0]
+        del vdu['resource_requirements']['cpu']
+        error = self.validator.validate_request(self.service_request)
+        self.assertEqual(error, "VNFD1: VNFD virtual_deployment_units/0/resource_requirements: 'cpu' is a required property")
+
+        #CHECK: descriptors with an unknown version use the default schema.
+        self.service_request['VNFD1']['descriptor_version'] = 'vnfd-schema-99'
+        self.assertIsNotNone(self.validator.validate_request(self.service_request))
+        self.assertIs(self.validator.validator('vnfd', 'vnfd-schema-99'), self.validator.validator('vnfd', 'vnfd-schema-01'))
+
+    def testCache(self):
+        cache = DescriptorCache(size=2)
+        validator = DescriptorValidator(cache=cache)
+        self.assertIsNone(validator.validate_request(self.service_request))
+        self.assertIsNone(validator.validate_request(self.service_request))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        #CHECK: a changed descriptor is validated again.
+        del self.service_request['VNFD1']['virtual_deployment_units']
+        self.assertIsNotNone(validator.validate_request(self.service_request))
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(len(cache), 2)
+
+    def testUnknownVersions(self):
+        validators = dict(self.validator._validators)
+
+        #CHECK: versions are no paths, and do not add validators.
+        for version in ['../../schemas/nsd-1.0', '../nsd-1.0', 'x' * 1000]:
+            self.service_request['NSD']['descriptor_version'] = version
+            self.assertIsNone(self.validator.validate_request(self.service_request))
+        self.assertEqual(self.validator._validators, validators)
+
+
+class testOutbox(unittest.TestCase):
+    """
+    Tests the outbox through which the SLM stores records and informs the GK.
+    """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'outbox.log')
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.sent = []
+        self.done = []
+
+    def tearDown(self):
+        self.executor.shutdown(wait=False)
+
+    def send(self, entry):
+        self.sent.append(entry['key'])
+        if entry['payload'] == 'flaky' and self.sent.count(entry['key']) < 3:
+            raise Exception('not reachable')
+        return {'status_code': 503 if entry['payload'] == 'down' else 200}
+
+    def testStagesAndRetries(self):
+        box = outbox.Outbox(self.executor, path='', max_attempts=3, backoff=0.01)
+        box.register_target('record', self.send, repository.should_retry)
+        box.start()
+        box.put('g', [{'target': 'record', 'stage': 1, 'key': 'c', 'payload': 'flaky'},
+                      {'target': 'record', 'stage': 0, 'key': 'a', 'payload': 'ok'},
+                      {'target': 'record', 'stage': 0, 'key': 'b', 'payload': 'down'}],
+                on_done=lambda group, entries: self.done.append((group, entries)))
+        box.put('g', [{'target': 'record', 'key': 'd', 'payload': 'ok'}])
+        self.assertTrue(box.flush(timeout=5))
+        box.close()
+
+        #CHECK: stages are delivered in order, failures are retried.
+        self.assertEqual(sorted(self.sent[:4]), ['a', 'b', 'b', 'b'])
+        self.assertEqual(self.sent[4:], ['c', 'c', 'c', 'd'])
+        group, entries = self.done[0]
+        self.assertEqual(group, 'g')
+        self.assertEqual(dict((e['key'], e['state']) for e in entries), {'a': outbox.DELIVERED, 'b': outbox.UNDELIVERABLE, 'c': outbox.DELIVERED})
+        self.assertEqual(box.status()['retries'], 4)
+        self.assertEqual(len(box), 0)
+
+    def testRecovery(self):
+        box = outbox.Outbox(self.executor, path=self.path)
+        box.recover()
+        box.put('g', [{'target': 'record', 'key': 'a', 'payload': 'ok'},
+                      {'target': 'record', 'key': 'b', 'payload': 'ok', 'stage': 1}])
+        self.assertTrue(box.sync(timeout=5))
+        box.close()
+
+        #CHECK: entries that were not sent before the restart are recovered.
+        box = outbox.Outbox(self.executor, path=self.path, on_recovered=lambda group, entries: self.done.append((group, entries)))
+        box.register_target('record', self.send)
+        self.assertEqual(box.recover(), 2)
+        box.start()
+        self.assertTrue(box.flush(timeout=5))
+        box.close()
+        self.assertEqual(self.sent, ['a', 'b'])
+        self.assertEqual([(group, [e['state'] for e in entries]) for group, entries in self.done], [('g', [outbox.DELIVERED, outbox.DELIVERED])])
+
+        #CHECK: reported entries are not recovered again.
+        self.assertEqual(outbox.Outbox(self.executor, path=self.path).recover(), 0)
+
+    def testIdempotencyKey(self):
+        server = StubRepositoryServer().start()
+        client = repository.RepositoryClient(server.url)
+        headers = {'Content-Type': 'application/json', 'Idempotency-Key': 'k'}
+        for i in range(2):
+            result = repository.summary(client.timed_request('post', 'vnf-instances', data=json.dumps({'id': '1'}), headers=headers))
+        server.stop()
+
+        #CHECK: a repeated request is answered, but not stored twice.
+        self.assertEqual(result['status_code'], 200)
+        self.assertEqual(result['body'], {'id': '1'})
+        self.assertEqual(server.duplicates, 1)
+        self.assertFalse(repository.should_retry(result))
+        self.assertTrue(repository.should_retry({'status_code': None}))
+        self.assertTrue(repository.should_retry({'status_code': 503}))
+        self.assertFalse(repository.should_retry({'status_code': 404}))
+
+
+class testTimingRecorder(unittest.TestCase):
+    """
+    Tests the timing of the phases of deployments.
+    """
+
+    def testHistogram(self):
+        histogram = timings.Histogram([0.1, 1, 10])
+        for duration in [0.05, 0.5, 0.5, 5, 50]:
+            histogram.observe(duration)
+        result = histogram.as_dict()
+
+        #CHECK: buckets are cumulative, quantiles are estimated by bucket.
+        self.assertEqual(result['buckets'], [[0.1, 1], [1, 3], [10, 4]])
+        self.assertEqual(result['count'], 5)
+        self.assertEqual(result['max'], 50)
+        self.assertEqual(result['p50'], 1)
+        self.assertEqual(result['p99'], 50)
+        self.assertIsNone(timings.Histogram().quantile(0.5))
+
+    def testBreakdown(self):
+        recorder = timings.TimingRecorder(history_size=1)
+        start = time.time() - 10
+        recorder.start('a', started_at=start, instance_uuid='service-a', include_in_reply=True)
+        recorder.record('a', timings.VALIDATION, start, start + 1)
+        recorder.begin('a', timings.ADMISSION)
+        recorder.end('a', timings.ADMISSION)
+        recorder.record('a', timings.REPOSITORY_WRITE, start + 2, start + 3, record='nsr')
+        recorder.record(None, timings.VALIDATION, start, start + 3)
+        recorder.finish('a', 'DONE')
+
+        #CHECK: the phases of a finished deployment can be queried by instance uuid.
+        breakdown = recorder.breakdown('service-a')
+        self.assertEqual(breakdown['state'], 'DONE')
+        self.assertEqual([p['phase'] for p in breakdown['phases']], [timings.VALIDATION, timings.REPOSITORY_WRITE, timings.ADMISSION])
+        self.assertEqual(breakdown['phases'][1], {'phase': timings.REPOSITORY_WRITE, 'start': 2, 'duration': 1, 'record': 'nsr'})
+        self.assertTrue(recorder.include_in_reply('a'))
+
+        #CHECK: phases of unknown deployments only count in the histograms.
+        histograms = recorder.histograms()
+        self.assertEqual(histograms[timings.VALIDATION]['count'], 2)
+        self.assertEqual(histograms[timings.TOTAL]['count'], 1)
+
+        #CHECK: the history is bounded.
+        recorder.start('b')
+        recorder.finish('b', 'FAILED')
+        self.assertIsNone(recorder.breakdown('service-a'))
+        self.assertEqual(recorder.breakdown('b')['state'], 'FAILED')
+        self.assertEqual(len(recorder), 0)
+
 if __name__ == '__main__':
     unittest.main()
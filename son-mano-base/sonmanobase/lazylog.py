@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+
+import itertools
+import json
+import logging
+import os
+import threading
+import yaml
+
+# Rendered payloads are truncated to this many characters, 0 disables it
+LOG_PAYLOAD_MAX_LENGTH = int(os.environ.get("log_payload_max_length", 4000))
+# Only one out of this many log records with a payload is emitted
+LOG_PAYLOAD_SAMPLE_RATE = int(os.environ.get("log_payload_sample_rate", 1))
+
+
+class Payload(object):
+    """
+    A message or record to be logged, rendered as YAML or JSON only when
+    the log record is emitted. Pass it as an argument of the log call:
+
+        LOG.debug("nsr built: %s", Payload(nsr))
+
+    If the logger discards the record, the payload is never serialized.
+    """
+
+    def __init__(self, payload, fmt='yaml', max_length=None):
+        self.payload = payload
+        self.fmt = fmt
+        self.max_length = LOG_PAYLOAD_MAX_LENGTH if max_length is None else max_length
+
+    def render(self):
+        if self.fmt == 'json':
+            return json.dumps(self.payload, indent=4, default=str)
+        return yaml.dump(self.payload, indent=4)
+
+    def __str__(self):
+        try:
+            text = self.render()
+        except Exception as e:
+            text = '<payload not serializable: ' + str(e) + '>'
+        if self.max_length and len(text) > self.max_length:
+            text = text[:self.max_length] + '... (' + str(len(text) - self.max_length) + ' more characters)'
+        return text
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Filter that lets one out of every rate log records with a Payload
+    argument through, records without payload always pass. Add it to a
+    logger to thin out verbose diagnostics under load:
+
+        LOG.addFilter(PayloadSampler(10))
+
+    Filters of a logger only run for records of an enabled level, so
+    dropped payloads are not serialized either.
+    """
+
+    def __init__(self, rate=LOG_PAYLOAD_SAMPLE_RATE):
+        super(PayloadSampler, self).__init__()
+        self.rate = max(rate, 1)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate == 1 or not has_payload(record):
+            return True
+        with self._lock:
+            n = next(self._counter)
+        return n % self.rate == 0
+
+
+def has_payload(record):
+    args = record.args
+    if isinstance(args, dict):
+        args = args.values()
+    return any(isinstance(arg, Payload) for arg in args or ())
@@ -31,6 +31,7 @@ import logging
 import threading
 import uuid
 import os
+import time
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('pika').setLevel(logging.ERROR)
@@ -62,6 +63,12 @@ class ManoBrokerConnection(object):
         self.rabbitmq_exchange_type = "topic"
         # create additional members
         self._connection = None
+        # events that are set once a subscription consumes messages (queue name -> event)
+        self._subscriptions_ready = {}
+        # events that are set to cancel a subscription (queue name -> event)
+        self._subscriptions_cancelled = {}
+        # consumer threads of the active subscriptions (queue name -> thread)
+        self._subscription_threads = {}
         # trigger connection setup (without blocking)
         self.setup_connection()
 
@@ -167,23 +174,75 @@ class ManoBrokerConnection(object):
                 channel.basic.qos(100)
                 # setup consumer (use queue name as tag)
                 channel.basic.consume(_wrapper_cbf, subscription_queue, consumer_tag=subscription_queue, no_ack=False)
+                # the subscription is bound and ready to receive messages
+                ready.set()
                 try:
-                    # start consuming messages.
-                    channel.start_consuming(to_tuple=False)
+                    # consume messages until the subscription is cancelled
+                    # (channels must only be used by this thread)
+                    while not channel.is_closed and channel.consumer_tags and not cancelled.is_set():
+                        channel.process_data_events(to_tuple=False)
+                    if cancelled.is_set():
+                        # unacknowledged messages return to the broker when the channel is closed
+                        channel.stop_consuming()
+                        LOG.debug("CANCELLED subscription %r", subscription_queue)
                 except BaseException:
                     LOG.exception("Error in subscription thread:")
                     channel.close()
+                finally:
+                    self._subscriptions_cancelled.pop(subscription_queue, None)
+                    self._subscription_threads.pop(subscription_queue, None)
 
         # Attention: We crate an individual queue for each subscription to allow multiple subscriptions
         # to the same topic.
         subscription_queue = "%s.%s.%s" % ("q", topic, str(uuid.uuid1()))
+        ready = threading.Event()
+        cancelled = threading.Event()
+        self._subscriptions_ready[subscription_queue] = ready
+        self._subscriptions_cancelled[subscription_queue] = cancelled
         # each subscriber is an own thread
         t = threading.Thread(target=connection_thread, args=())
         t.daemon = True
+        self._subscription_threads[subscription_queue] = t
         t.start()
         LOG.debug("SUBSCRIBED to %r", topic)
         return subscription_queue
 
+    def cancel_subscriptions(self, subscription_queues, timeout=5):
+        """
+        Stop consuming messages of the given subscriptions. The consumer
+        threads stop consuming and close their channels themselves, messages
+        that were delivered but not yet acknowledged are returned to the broker.
+        :param subscription_queues: list of queue names returned by subscribe
+        :param timeout: max time in s to wait for the consumer threads
+        :return: True if all consumer threads stopped, False otherwise
+        """
+        threads = []
+        for q in subscription_queues:
+            cancelled = self._subscriptions_cancelled.get(q)
+            if cancelled is not None:
+                cancelled.set()
+                threads.append(self._subscription_threads.get(q))
+        # a callback may cancel the subscription it is called by
+        threads = [t for t in threads if t is not None and t is not threading.current_thread()]
+        deadline = time.time() + timeout
+        for t in threads:
+            t.join(max(0, deadline - time.time()))
+        return not any(t.is_alive() for t in threads)
+
+    def wait_for_subscriptions(self, subscription_queues, timeout=5):
+        """
+        Block until the given subscriptions are bound to their topics.
+        :param subscription_queues: list of queue names returned by subscribe
+        :param timeout: max time in s to wait for all subscriptions
+        :return: True if all subscriptions are ready, False otherwise
+        """
+        deadline = time.time() + timeout
+        for q in subscription_queues:
+            ready = self._subscriptions_ready.get(q)
+            if ready is None or not ready.wait(max(0, deadline - time.time())):
+                return False
+        return True
+
 
 class ManoBrokerRequestResponseConnection(ManoBrokerConnection):
     """
@@ -202,8 +261,16 @@ class ManoBrokerRequestResponseConnection(ManoBrokerConnection):
     def __init__(self, app_id):
         self._async_calls_pending = {}
         self._async_calls_response_topics = []
+        # calls are made from many threads, the subscriptions for their
+        # responses are set up once per topic
+        self._async_calls_lock = threading.Lock()
+        # subscriptions of endpoints registered with register_async_endpoint
+        self._endpoint_subscriptions = []
+        # threads of async. executions that are currently running
+        self._executions = set()
+        self._executions_lock = threading.Lock()
         # call superclass to setup the connection
-        super(self.__class__, self).__init__(app_id)
+        super(ManoBrokerRequestResponseConnection, self).__init__(app_id)
 
     def _execute_async(self, async_finish_cbf, func, ch, method, props, body):
         """
@@ -219,15 +286,30 @@ class ManoBrokerRequestResponseConnection(ManoBrokerConnection):
         """
 
         def run(cbf, func, ch, method, props, body):
-            result = func(ch, method, props, body)
-            if cbf is not None:
-                cbf(ch, method, props, result)
+            with self._executions_lock:
+                self._executions.add(threading.get_ident())
+            try:
+                result = func(ch, method, props, body)
+                if cbf is not None:
+                    cbf(ch, method, props, result)
+            finally:
+                with self._executions_lock:
+                    self._executions.discard(threading.get_ident())
 
         t = threading.Thread(target=run, args=(async_finish_cbf, func, ch, method, props, body))
         t.daemon = True
         t.start()
         LOG.debug("Async execution started: %r." % str(func))
 
+    def running_executions(self):
+        """
+        Number of async. executions (callbacks) that are still running,
+        not counting the calling thread.
+        :return: int
+        """
+        with self._executions_lock:
+            return len(self._executions - {threading.get_ident()})
+
     def _on_execute_async_finished(self, ch, method, props, result):
         """
         Event method that is called when an async. executed function
@@ -325,15 +407,12 @@ class ManoBrokerRequestResponseConnection(ManoBrokerConnection):
         if props.reply_to is not None:
             #LOG.debug("Non-response message dropped at response endpoint.")
             return
-        if props.correlation_id in self._async_calls_pending:
+        # remove from pending calls, only the first response is handled
+        cbf = self._async_calls_pending.pop(props.correlation_id, None)
+        if cbf is not None:
             LOG.debug("Async response received. Matches to corr_id: %r" % props.correlation_id)
             # call callback (in new thread)
-            self._execute_async(None,
-                                self._async_calls_pending[props.correlation_id],
-                                ch, method, props, body
-                                )
-            # remove from pending calls
-            del self._async_calls_pending[props.correlation_id]
+            self._execute_async(None, cbf, ch, method, props, body)
         else:
             LOG.debug("Received unmatched call response. Ignore it.")
 
@@ -364,11 +443,12 @@ class ManoBrokerRequestResponseConnection(ManoBrokerConnection):
         correlation_id = str(uuid.uuid4()) if correlation_id is None else correlation_id
 
         # initialize response subscription if a callback function was defined
-        if topic not in self._async_calls_response_topics:
-            self.subscribe(self._on_call_async_response_received, topic)
-            # keep track of request
-            self._async_calls_response_topics.append(topic)
-        self._async_calls_pending[correlation_id] = cbf
+        with self._async_calls_lock:
+            if topic not in self._async_calls_response_topics:
+                self.subscribe(self._on_call_async_response_received, topic)
+                # keep track of request
+                self._async_calls_response_topics.append(topic)
+            self._async_calls_pending[correlation_id] = cbf
 
         # build headers
         if headers is None:
@@ -398,8 +478,21 @@ class ManoBrokerRequestResponseConnection(ManoBrokerConnection):
         :param topic: topic for requests and responses
         :return: None
         """
-        self.subscribe(self._generate_cbf_call_async_rquest_received(cbf), topic)
+        q = self.subscribe(self._generate_cbf_call_async_rquest_received(cbf), topic)
+        self._endpoint_subscriptions.append(q)
         LOG.debug("Registered async endpoint: topic: %r cbf: %r" % (topic, cbf))
+        return q
+
+    def stop_endpoints(self):
+        """
+        Stop consuming requests on all endpoints registered with
+        register_async_endpoint. Responses to own calls and notifications
+        are still received.
+        :return: True if all endpoints stopped consuming, False otherwise
+        """
+        stopped = self.cancel_subscriptions(self._endpoint_subscriptions)
+        self._endpoint_subscriptions = []
+        return stopped
 
     def notify(self, topic, msg=None, key="default",
                content_type="application/json",
@@ -38,6 +38,61 @@ logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger("son-mano-base:plugin")
 LOG.setLevel(logging.DEBUG)
 
+# Heartbeats use a compact, fixed-format text payload instead of JSON:
+# "<format version>|<plugin uuid>|<state code>|<sequence number>"
+HEARTBEAT_FORMAT_VERSION = "h1"
+HEARTBEAT_STATE_CODES = {"READY": "R",
+                         "RUNNING": "U",
+                         "PAUSED": "P",
+                         "FAILED": "F",
+                         "DRAINING": "D",
+                         "None": "N"}
+HEARTBEAT_CODE_STATES = dict((v, k) for k, v in HEARTBEAT_STATE_CODES.items())
+
+# Registration requests are repeated with exponential backoff (in seconds)
+# until the plugin manager answers.
+REGISTRATION_RETRY_BASE = 1.0
+REGISTRATION_RETRY_MAX = 30.0
+
+# Max time (in seconds) a draining plugin waits for its in-flight work
+DRAIN_TIMEOUT = 30
+DRAIN_POLL_INTERVAL = 0.1
+
+
+def encode_heartbeat(plugin_uuid, state, seq):
+    """
+    Build a compact heartbeat payload.
+    :param plugin_uuid: uuid of the sending plugin
+    :param state: current state of the plugin
+    :param seq: sequence number of the heartbeat
+    :return: payload string
+    """
+    return "%s|%s|%s|%d" % (HEARTBEAT_FORMAT_VERSION,
+                            plugin_uuid,
+                            HEARTBEAT_STATE_CODES.get(str(state), "N"),
+                            seq)
+
+
+def decode_heartbeat(payload):
+    """
+    Parse a heartbeat payload. Understands the compact format as well as
+    the legacy JSON format ({"uuid": ..., "state": ...}).
+    :param payload: payload string
+    :return: dict with uuid, state and seq (None for legacy heartbeats)
+    """
+    payload = str(payload)
+    if payload.startswith("{"):
+        message = json.loads(payload)
+        return {"uuid": message.get("uuid"),
+                "state": message.get("state"),
+                "seq": None}
+    fields = payload.split("|")
+    if len(fields) != 4 or fields[0] != HEARTBEAT_FORMAT_VERSION:
+        raise ValueError("Malformed heartbeat: %r" % payload)
+    return {"uuid": fields[1],
+            "state": HEARTBEAT_CODE_STATES.get(fields[2], "None"),
+            "seq": int(fields[3])}
+
 
 class ManoBasePlugin(object):
     """
@@ -48,8 +103,9 @@ class ManoBasePlugin(object):
     - send/receive notifications
     - register / de-register plugin to plugin manager
 
-    It also implements a automatic heartbeat mechanism that periodically sends
-    heartbeat notifications.
+    It also implements a automatic heartbeat mechanism that sends a heartbeat
+    notification whenever the plugin state changes and a slow keepalive
+    heartbeat otherwise.
     """
 
     def __init__(self,
@@ -58,7 +114,7 @@ class ManoBasePlugin(object):
                  description=None,
                  auto_register=True,
                  wait_for_registration=True,
-                 auto_heartbeat_rate=0.5):
+                 auto_heartbeat_rate=0.1):
         """
         Performs plugin initialization steps, e.g., connection setup
         :param name: Plugin name prefix
@@ -66,14 +122,38 @@ class ManoBasePlugin(object):
         :param description: A description string
         :param auto_register: Automatically register on init
         :param wait_for_registration: Wait for registration before returning from init
-        :param auto_heartbeat_rate: rate of automatic heartbeat notifications 1/n seconds. 0=deactivated
+        :param auto_heartbeat_rate: rate of keepalive heartbeat notifications 1/n seconds. 0=deactivated
+        (state changes are always announced immediately)
         :return:
         """
+        self._started_at = time.time()
+        self._registered = threading.Event()
+        self._registration_lock = threading.Lock()
+        self._deregistered = threading.Event()
+        self.registration_state = "UNREGISTERED"  # UNREGISTERED/REGISTERING/REGISTERED/REREGISTERING
+        self.registration_attempts = 0
+        self.startup_duration = None  # time in s from plugin start to completed registration
+        self._heartbeat_trigger = threading.Event()
+        self._heartbeat_lock = threading.Lock()
+        self._heartbeat_seq = 0
+        self._heartbeat_state_sent = None
+        self._state = None
+        # lifecycle verb (last routing key segment) -> handler
+        self._lifecycle_handlers = {
+            "start": self.on_lifecycle_start,
+            "pause": self.on_lifecycle_pause,
+            "resume": self.on_lifecycle_resume,
+            "stop": self.on_lifecycle_stop,
+            "drain": self.on_lifecycle_drain,
+            "reload-config": self.on_lifecycle_reload_config,
+            "reregister": self.on_lifecycle_reregister}
         self.name = "%s.%s" % (name, self.__class__.__name__)
         self.version = version
         self.description = description
         self.uuid = None  # uuid given by plugin manager on registration
-        self.state = None  # the state of this plugin READY/RUNNING/PAUSED/FAILED
+        # keepalive interval announced to the plugin manager (0=no keepalive, never expired)
+        self.heartbeat_interval = 1.0 / auto_heartbeat_rate if auto_heartbeat_rate > 0 else 0
+        self.state = None  # the state of this plugin READY/RUNNING/PAUSED/DRAINING/FAILED
 
         LOG.info(
             "Starting MANO Plugin: %r ..." % self.name)
@@ -81,13 +161,11 @@ class ManoBasePlugin(object):
         self.manoconn = messaging.ManoBrokerRequestResponseConnection(self.name)
         # register subscriptions
         self.declare_subscriptions()
-        # register to plugin manager
+        # register to plugin manager (lifecycle endpoints are added once registered)
         if auto_register:
             self.register()
             if wait_for_registration:
                 self._wait_for_registration()
-        # add additional subscriptions
-        self._register_lifecycle_endpoints()
         # kick-off automatic heartbeat mechanism
         self._auto_heartbeat(auto_heartbeat_rate)
         # jump to run
@@ -103,11 +181,24 @@ class ManoBasePlugin(object):
         self.manoconn.stop_connection()
         del self.manoconn
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, value):
+        changed = value != self._state
+        self._state = value
+        if changed:
+            # wake up the heartbeat thread to announce the new state
+            self._heartbeat_trigger.set()
+
     def _auto_heartbeat(self, rate):
         """
-        A simple periodic heartbeat mechanism.
-        (much room for improvements here)
-        :param rate: rate of heartbeat notifications
+        Adaptive heartbeat mechanism: A heartbeat is sent as soon as the
+        state of the plugin changes. Without state changes, a keepalive
+        heartbeat is sent with the given rate.
+        :param rate: rate of keepalive heartbeat notifications
         :return:
         """
         if rate <= 0:
@@ -115,9 +206,14 @@ class ManoBasePlugin(object):
 
         def run():
             while True:
-                if self.uuid is not None:
-                    self._send_heartbeat()
-                time.sleep(1/rate)
+                changed = self._heartbeat_trigger.wait(1/rate)
+                self._heartbeat_trigger.clear()
+                if self.uuid is None:
+                    continue
+                if changed and self.state == self._heartbeat_state_sent:
+                    # state was already announced by someone else
+                    continue
+                self._send_heartbeat()
 
         # run heartbeats in separated thread
         t = threading.Thread(target=run)
@@ -125,10 +221,14 @@ class ManoBasePlugin(object):
         t.start()
 
     def _send_heartbeat(self):
+        with self._heartbeat_lock:
+            self._heartbeat_seq += 1
+            self._heartbeat_state_sent = self.state
+            payload = encode_heartbeat(self.uuid, self.state, self._heartbeat_seq)
         self.manoconn.notify(
             "platform.management.plugin.%s.heartbeat" % str(self.uuid),
-            json.dumps({"uuid": self.uuid,
-            "state": str(self.state)}))
+            payload,
+            content_type="text/plain")
 
     def declare_subscriptions(self):
         """
@@ -162,6 +262,19 @@ class ManoBasePlugin(object):
         LOG.debug("Received lifecycle.pause event.")
         self.state = "PAUSED"
 
+    def on_lifecycle_resume(self, ch, method, properties, message):
+        """
+        To be overwritten by subclass
+        """
+        LOG.debug("Received lifecycle.resume event.")
+        self.state = "RUNNING"
+
+    def on_lifecycle_reload_config(self, ch, method, properties, message):
+        """
+        To be overwritten by subclass
+        """
+        LOG.debug("Received lifecycle.reload-config event.")
+
     def on_lifecycle_stop(self, ch, method, properties, message):
         """
         To be overwritten by subclass
@@ -170,6 +283,112 @@ class ManoBasePlugin(object):
         self.deregister()
         os._exit(0)
 
+    def on_lifecycle_drain(self, ch, method, properties, message):
+        """
+        Graceful shutdown: drain the plugin and exit.
+        The message can contain the drain deadline: {"timeout": <seconds>}
+        """
+        LOG.debug("Received lifecycle.drain event.")
+        timeout = DRAIN_TIMEOUT
+        try:
+            timeout = float(json.loads(str(message)).get("timeout", DRAIN_TIMEOUT))
+        except (ValueError, TypeError, AttributeError):
+            pass
+        drained = self.drain(timeout=timeout)
+        os._exit(0 if drained else 1)
+
+    def on_lifecycle_reregister(self, ch, method, properties, message):
+        """
+        Sent by the plugin manager when it receives a heartbeat of this
+        plugin but does not know it (anymore), e.g., after it expired.
+        The plugin registers again with its uuid, and announces its state
+        with the next heartbeat.
+        """
+        LOG.debug("Received lifecycle.reregister event.")
+        if str(method.routing_key).split(".")[3] != str(self.uuid):
+            # sent to an uuid we had before
+            return
+        with self._registration_lock:
+            if self.registration_state not in ["REGISTERED", "REREGISTERING"]:
+                return
+            self.registration_state = "REREGISTERING"
+        LOG.info("Plugin manager does not know us. Re-registering with UUID %r ..." % self.uuid)
+        self.manoconn.call_async(self._on_reregister_response,
+                                 "platform.management.plugin.register",
+                                 json.dumps(self._register_message(uuid=self.uuid)))
+
+    def _on_reregister_response(self, ch, method, props, response):
+        """
+        Event triggered when the response to a re-registration is received.
+        :param props: response properties
+        :param response: response body
+        :return: None
+        """
+        response = json.loads(str(response))
+        with self._registration_lock:
+            if self.registration_state != "REREGISTERING":
+                return
+            self.registration_state = "REGISTERED"
+        if response.get("status") != "OK":
+            LOG.error("Plugin re-registration failed: %r" % response.get("error"))
+            return
+        if response.get("uuid") != self.uuid:
+            # the plugin manager does not take over uuids, drop the new registration
+            LOG.error("Plugin re-registration got a new UUID %r. Keeping %r." % (response.get("uuid"), self.uuid))
+            self.manoconn.call_async(lambda ch, method, props, response: None,
+                                     "platform.management.plugin.deregister",
+                                     json.dumps({"uuid": response.get("uuid")}))
+            return
+        LOG.info("Plugin re-registered with UUID: %r" % self.uuid)
+        self._send_heartbeat()
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """
+        Bring the plugin into the DRAINING state: Stop consuming new
+        requests, wait (max. timeout seconds) until all in-flight work
+        is finished, flush and finally de-register the plugin.
+        :param timeout: max time in s to wait for in-flight work
+        :return: True if the plugin was flushed and de-registered, False otherwise
+        """
+        LOG.info("Draining plugin (timeout=%.1fs) ..." % timeout)
+        self.state = "DRAINING"
+        # stop consuming new requests, responses to own calls are still received
+        if not self.manoconn.stop_endpoints():
+            LOG.warning("Endpoints did not stop consuming.")
+        # wait for in-flight work (which may span several callbacks)
+        deadline = time.time() + timeout
+        while self.in_flight_work() > 0 and time.time() < deadline:
+            time.sleep(DRAIN_POLL_INTERVAL)
+        remaining = self.in_flight_work()
+        if remaining > 0:
+            LOG.warning("Drain deadline reached with %d in-flight tasks." % remaining)
+        flushed = self.flush() is not False
+        if not flushed:
+            LOG.error("Flush failed while draining.")
+        self.deregister()
+        deregistered = self._deregistered.wait(5)
+        if not deregistered:
+            LOG.error("No de-registration response while draining.")
+        LOG.info("Plugin drained.")
+        return flushed and deregistered
+
+    def in_flight_work(self):
+        """
+        Can be overwritten by subclass.
+        Number of requests that are still being handled by this plugin.
+        Used to decide when a draining plugin can be de-registered.
+        """
+        return self.manoconn.running_executions()
+
+    def flush(self):
+        """
+        To be overwritten by subclass.
+        Called while draining, after the in-flight work is finished,
+        to flush buffered outgoing messages.
+        :return: False if not everything could be flushed
+        """
+        return True
+
     def on_registration_ok(self):
         """
         To be overwritten by subclass
@@ -188,13 +407,38 @@ class ManoBasePlugin(object):
     def register(self):
         """
         Send a register request to the plugin manager component to announce this plugin.
+        The request is repeated with exponential backoff until it is answered.
         """
+        self._registered.clear()
+        self.registration_state = "REGISTERING"
+        self.registration_attempts = 0
+        self._send_register_request()
+
+    def _register_message(self, **kwargs):
         message = {"name": self.name,
                    "version": self.version,
-                   "description": self.description}
+                   "description": self.description,
+                   "heartbeat_interval": self.heartbeat_interval}
+        message.update(kwargs)
+        return message
+
+    def _send_register_request(self):
+        self.registration_attempts += 1
         self.manoconn.call_async(self._on_register_response,
                                  "platform.management.plugin.register",
-                                 json.dumps(message))
+                                 json.dumps(self._register_message()))
+        # schedule a retry in case the plugin manager is not up yet
+        delay = min(REGISTRATION_RETRY_BASE * 2 ** (self.registration_attempts - 1),
+                    REGISTRATION_RETRY_MAX)
+        t = threading.Timer(delay, self._retry_register_request, args=(delay,))
+        t.daemon = True
+        t.start()
+
+    def _retry_register_request(self, delay):
+        if self.registration_state != "REGISTERING":
+            return
+        LOG.info("No registration response after %.1fs. Retrying ..." % delay)
+        self._send_register_request()
 
     def _on_register_response(self, ch, method, props, response):
         """
@@ -208,10 +452,24 @@ class ManoBasePlugin(object):
             LOG.debug("Response %r" % response)
             LOG.error("Plugin registration failed. Exit.")
             exit(1)
-        self.uuid = response.get("uuid")
+        with self._registration_lock:
+            if self.registration_state != "REGISTERING":
+                # answer to a retried request, drop the additional registration
+                LOG.debug("Dropping duplicated registration %r" % response.get("uuid"))
+                self.manoconn.call_async(lambda ch, method, props, response: None,
+                                         "platform.management.plugin.deregister",
+                                         json.dumps({"uuid": response.get("uuid")}))
+                return
+            self.uuid = response.get("uuid")
+            self.registration_state = "REGISTERED"
+        self.startup_duration = time.time() - self._started_at
+        LOG.info("Plugin registered with UUID: %r (attempts: %d, startup time: %.3fs)"
+                 % (response.get("uuid"), self.registration_attempts, self.startup_duration))
+        # we need our lifecycle endpoints before we announce that we are ready
+        self._register_lifecycle_endpoints()
+        self._registered.set()
         # mark this plugin to be ready to be started
         self.state = "READY"
-        LOG.info("Plugin registered with UUID: %r" % response.get("uuid"))
         # jump to on_registration_ok()
         self.on_registration_ok()
         self._send_heartbeat()
@@ -221,6 +479,7 @@ class ManoBasePlugin(object):
         Send a deregister event to the plugin manager component.
         """
         LOG.info("De-registering plugin...")
+        self._deregistered.clear()
         message = {"uuid": self.uuid}
         self.manoconn.call_async(self._on_deregister_response,
                                  "platform.management.plugin.deregister",
@@ -237,34 +496,53 @@ class ManoBasePlugin(object):
         if response.get("status") != "OK":
             LOG.error("Plugin de-registration failed. Exit.")
             exit(1)
+        self._registered.clear()
+        self.registration_state = "UNREGISTERED"
+        self._deregistered.set()
         LOG.info("Plugin de-registered.")
 
-    def _wait_for_registration(self, timeout=5, sleep_interval=0.1):
+    def _wait_for_registration(self, timeout=5):
         """
-        Method to do active waiting until the registration is completed.
-        (not nice, but ok for now)
+        Block until the registration is completed.
         :param timeout: max wait
-        :param sleep_interval: sleep interval
-        :return: None
+        :return: True if registered, False otherwise
         """
-        # FIXME: Use threading.Event() for this?
-        c = 0
         LOG.debug("Waiting for registration (timeout=%d) ..." % timeout)
-        while self.uuid is None and c < timeout:
-            time.sleep(sleep_interval)
-            c += sleep_interval
+        return self._registered.wait(timeout)
+
+    def register_lifecycle_handler(self, verb, cbf):
+        """
+        Add (or replace) the handler of a lifecycle verb. Handlers are
+        called for platform.management.plugin.<uuid>.lifecycle.<verb>
+        notifications and do not need any additional subscription.
+        :param verb: lifecycle verb, e.g., start/pause/stop
+        :param cbf: function cbf(ch, method, properties, message)
+        :return: None
+        """
+        self._lifecycle_handlers[verb] = cbf
 
-    def _register_lifecycle_endpoints(self):
+    def _on_lifecycle_event(self, ch, method, properties, message):
+        """
+        Dispatch a lifecycle notification to its handler using the
+        last segment of the routing key.
+        """
+        verb = str(method.routing_key).split(".")[-1]
+        cbf = self._lifecycle_handlers.get(verb)
+        if cbf is None:
+            LOG.warning("Unknown lifecycle event %r. Ignore it." % verb)
+            return
+        cbf(ch, method, properties, message)
+
+    def _register_lifecycle_endpoints(self, timeout=5):
+        """
+        Subscribe to all lifecycle topics of this plugin with a single
+        subscription and wait until it is bound.
+        :param timeout: max time to wait for the subscription
+        :return: None
+        """
         if self.uuid is not None:
-            # lifecycle.start
-            self.manoconn.register_notification_endpoint(
-                self.on_lifecycle_start,  # call back method
-                "platform.management.plugin.%s.lifecycle.start" % str(self.uuid))
-            # lifecycle.pause
-            self.manoconn.register_notification_endpoint(
-                self.on_lifecycle_pause,  # call back method
-                "platform.management.plugin.%s.lifecycle.pause" % str(self.uuid))
-            # lifecycle.stop
-            self.manoconn.register_notification_endpoint(
-                self.on_lifecycle_stop,  # call back method
-                "platform.management.plugin.%s.lifecycle.stop" % str(self.uuid))
+            q = self.manoconn.register_notification_endpoint(
+                self._on_lifecycle_event,  # call back method
+                "platform.management.plugin.%s.lifecycle.*" % str(self.uuid))
+            if not self.manoconn.wait_for_subscriptions([q], timeout=timeout):
+                LOG.warning("Lifecycle endpoint not ready after %ds." % timeout)
@@ -0,0 +1,68 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+
+import unittest
+import logging
+
+from sonmanobase.lazylog import Payload, PayloadSampler
+
+
+class TestLazyLog(unittest.TestCase):
+    """
+    Tests the lazily rendered payloads of log records.
+    """
+
+    def setUp(self):
+        self.log = logging.getLogger("son-mano-base:test_lazylog")
+        self.log.propagate = False
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: self.records.append(record.getMessage())
+        self.log.handlers = [handler]
+
+    def testNotRenderedWhenDiscarded(self):
+        payload = Payload({'nsr': 'big'}, fmt='json')
+        payload.render = lambda: self.fail('payload rendered')
+        self.log.setLevel(logging.INFO)
+        self.log.debug("nsr: %s", payload)
+        self.assertEqual(self.records, [])
+
+    def testRenderingAndTruncation(self):
+        self.log.setLevel(logging.DEBUG)
+        self.log.debug("nsr: %s", Payload({'id': 1}, fmt='json', max_length=0))
+        self.assertEqual(self.records, ['nsr: {\n    "id": 1\n}'])
+        self.assertEqual(str(Payload('x' * 20, fmt='json', max_length=10)), '"xxxxxxxxx... (12 more characters)')
+
+    def testSampling(self):
+        self.log.setLevel(logging.DEBUG)
+        self.log.filters = [PayloadSampler(3)]
+        for i in range(6):
+            self.log.debug("record %s: %s", i, Payload(i))
+        self.log.debug("no payload")
+        self.assertEqual(len(self.records), 3)
+        self.assertEqual(self.records[-1], 'no payload')
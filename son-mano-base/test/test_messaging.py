@@ -153,6 +153,21 @@ class TestManoBrokerConnection(BaseTestCase):
         self.assertEqual(self.wait_for_messages(buffer=0, n_messages=100)[99], "99")
         self.assertEqual(self.wait_for_messages(buffer=1, n_messages=100)[99], "99")
 
+    #@unittest.skip("disabled")
+    def test_broker_cancel_subscription(self):
+        """
+        Test that a cancelled subscription stops consuming messages.
+        """
+        q = self.m.subscribe(self._simple_subscribe_cbf1, "test.cancel")
+        self.m.subscribe(self._simple_subscribe_cbf2, "test.cancel")
+        self.assertTrue(self.m.wait_for_subscriptions([q]))
+        time.sleep(0.5)
+        self.assertTrue(self.m.cancel_subscriptions([q]))
+        self.m.publish("test.cancel", "testmsg")
+        self.assertEqual(self.wait_for_messages(buffer=1)[0], "testmsg")
+        time.sleep(0.5)
+        self.assertEqual(self._message_buffer[0], [])
+
 
 class TestManoBrokerRequestResponseConnection(BaseTestCase):
     """
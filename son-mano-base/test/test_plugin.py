@@ -0,0 +1,311 @@
+"""
+Copyright (c) 2015 SONATA-NFV
+ALL RIGHTS RESERVED.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Neither the name of the SONATA-NFV [, ANY ADDITIONAL AFFILIATION]
+nor the names of its contributors may be used to endorse or promote
+products derived from this software without specific prior written
+permission.
+
+This work has been performed in the framework of the SONATA project,
+funded by the European Commission under Grant number 671517 through
+the Horizon 2020 and 5G-PPP programmes. The authors would like to
+acknowledge the contributions of their colleagues of the SONATA
+partner consortium (www.sonata-nfv.eu).
+"""
+
+import unittest
+import json
+import threading
+import time
+from unittest import mock
+
+from sonmanobase import plugin
+from sonmanobase.plugin import ManoBasePlugin, encode_heartbeat, decode_heartbeat
+
+
+class TestHeartbeatFormat(unittest.TestCase):
+    """
+    Tests the heartbeat payload format used between plugins and plugin manager.
+    """
+
+    def testEncodeDecode(self):
+        payload = encode_heartbeat("1234", "RUNNING", 7)
+        hb = decode_heartbeat(payload)
+        self.assertEqual(hb.get("uuid"), "1234")
+        self.assertEqual(hb.get("state"), "RUNNING")
+        self.assertEqual(hb.get("seq"), 7)
+
+    def testUnknownState(self):
+        hb = decode_heartbeat(encode_heartbeat("1234", None, 1))
+        self.assertEqual(hb.get("state"), "None")
+
+    def testLegacyJsonHeartbeat(self):
+        hb = decode_heartbeat(json.dumps({"uuid": "1234", "state": "READY"}))
+        self.assertEqual(hb.get("uuid"), "1234")
+        self.assertEqual(hb.get("state"), "READY")
+        self.assertIsNone(hb.get("seq"))
+
+    def testMalformedHeartbeat(self):
+        self.assertRaises(ValueError, decode_heartbeat, "foo|bar")
+
+
+class FakeConnection(object):
+    """
+    Records what a plugin sends and subscribes to, instead of talking to
+    a broker.
+    """
+
+    def __init__(self, app_id):
+        self.calls = []
+        self.notifications = []
+        self.endpoints = []
+        self.executions = 0
+        self.endpoints_stopped = False
+        # topic -> response that is sent right away
+        self.replies = {}
+
+    def call_async(self, cbf, topic, msg=None, **kwargs):
+        self.calls.append((topic, json.loads(msg), cbf))
+        if topic in self.replies:
+            cbf(None, None, None, json.dumps(self.replies[topic]))
+
+    def notify(self, topic, msg=None, **kwargs):
+        self.notifications.append((topic, msg))
+
+    def register_notification_endpoint(self, cbf, topic, key="default"):
+        self.endpoints.append(topic)
+        return topic
+
+    def wait_for_subscriptions(self, subscription_queues, timeout=5):
+        return True
+
+    def stop_endpoints(self):
+        self.endpoints_stopped = True
+        return True
+
+    def running_executions(self):
+        return self.executions
+
+    def calls_to(self, topic):
+        return [c for c in self.calls if c[0] == topic]
+
+
+class DummyPlugin(ManoBasePlugin):
+
+    def run(self):
+        pass
+
+
+def routing_key(key):
+    return type('method', (object,), {"routing_key": key})
+
+
+class BasePluginTestCase(unittest.TestCase):
+    """
+    Runs a plugin on a FakeConnection.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(plugin.messaging, "ManoBrokerRequestResponseConnection", FakeConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.plugin = DummyPlugin(auto_register=False, auto_heartbeat_rate=0.1)
+        self.conn = self.plugin.manoconn
+
+    def respond(self, call, response):
+        call[2](None, None, None, json.dumps(response))
+
+    def register(self, uuid="1234"):
+        self.plugin.register()
+        self.respond(self.conn.calls_to("platform.management.plugin.register")[-1],
+                     {"status": "OK", "uuid": uuid})
+
+
+class TestRegistration(BasePluginTestCase):
+    """
+    Tests the registration of a plugin with retries.
+    """
+
+    def setUp(self):
+        super(TestRegistration, self).setUp()
+        # collect the retry timers instead of running them
+        self.timers = []
+        patcher = mock.patch.object(plugin.threading, "Timer", self.timer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def timer(self, delay, function, args=()):
+        self.timers.append((delay, function, args))
+        return mock.Mock()
+
+    def fire(self):
+        delay, function, args = self.timers.pop(0)
+        function(*args)
+        return delay
+
+    def testRetryBackoff(self):
+        self.plugin.register()
+        delays = [self.fire() for i in range(7)]
+
+        #CHECK: the delay doubles on each attempt up to the max.
+        self.assertEqual(delays, [1, 2, 4, 8, 16, 30, 30])
+        self.assertEqual(self.plugin.registration_attempts, 8)
+        self.assertEqual(len(self.conn.calls_to("platform.management.plugin.register")), 8)
+
+        #CHECK: no more retries once registered.
+        self.respond(self.conn.calls_to("platform.management.plugin.register")[0], {"status": "OK", "uuid": "1234"})
+        self.fire()
+        self.assertEqual(len(self.conn.calls_to("platform.management.plugin.register")), 8)
+        self.assertEqual(self.timers, [])
+
+    def testLateDuplicateResponse(self):
+        self.plugin.register()
+        self.fire()
+        first, second = self.conn.calls_to("platform.management.plugin.register")
+        self.respond(second, {"status": "OK", "uuid": "5678"})
+        self.respond(first, {"status": "OK", "uuid": "1234"})
+
+        #CHECK: the late registration is given back, the first one is kept.
+        self.assertEqual(self.plugin.uuid, "5678")
+        self.assertEqual([c[1] for c in self.conn.calls_to("platform.management.plugin.deregister")],
+                         [{"uuid": "1234"}])
+
+    def testLifecycleEndpoints(self):
+        self.plugin.register()
+        self.fire()
+        self.assertEqual(self.conn.endpoints, ["platform.management.plugin.status"])
+
+        #CHECK: a failed registration adds no endpoints.
+        call = self.conn.calls_to("platform.management.plugin.register")[0]
+        self.assertRaises(SystemExit, self.respond, call, {"status": "ERROR", "uuid": None})
+        self.assertEqual(self.conn.endpoints, ["platform.management.plugin.status"])
+        self.assertIsNone(self.plugin.uuid)
+
+        #CHECK: a successful one adds a single lifecycle endpoint before the plugin is READY.
+        states = []
+        self.plugin.manoconn.wait_for_subscriptions = lambda queues, timeout=5: states.append(self.plugin.state)
+        self.respond(call, {"status": "OK", "uuid": "1234"})
+        self.assertEqual(self.conn.endpoints, ["platform.management.plugin.status",
+                                               "platform.management.plugin.1234.lifecycle.*"])
+        self.assertEqual(states, [None])
+        self.assertEqual(self.plugin.state, "READY")
+
+
+class TestDrain(BasePluginTestCase):
+    """
+    Tests the DRAINING state of a plugin.
+    """
+
+    def setUp(self):
+        super(TestDrain, self).setUp()
+        self.register()
+        self.conn.replies["platform.management.plugin.deregister"] = {"status": "OK"}
+
+    def testDrain(self):
+        self.conn.executions = 1
+        states = []
+        self.plugin.flush = lambda: states.append((self.plugin.state, self.conn.executions))
+
+        def finish():
+            time.sleep(0.2)
+            self.conn.executions = 0
+
+        threading.Thread(target=finish).start()
+        start = time.time()
+        self.assertTrue(self.plugin.drain(timeout=5))
+
+        #CHECK: the endpoints are stopped, in-flight work is finished before the flush and de-registration.
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertTrue(self.conn.endpoints_stopped)
+        self.assertEqual(states, [("DRAINING", 0)])
+        self.assertEqual(self.conn.calls_to("platform.management.plugin.deregister")[-1][1], {"uuid": "1234"})
+        self.assertEqual(self.plugin.registration_state, "UNREGISTERED")
+
+    def testDrainDeadline(self):
+        self.conn.executions = 1
+        start = time.time()
+        self.assertTrue(self.plugin.drain(timeout=0.2))
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(len(self.conn.calls_to("platform.management.plugin.deregister")), 1)
+
+    def testDrainFailures(self):
+        #CHECK: a failed flush fails the drain.
+        self.plugin.flush = lambda: False
+        self.assertFalse(self.plugin.drain(timeout=0))
+
+        #CHECK: a missing de-registration response fails the drain.
+        self.plugin.flush = lambda: None
+        del self.conn.replies["platform.management.plugin.deregister"]
+        with mock.patch.object(self.plugin._deregistered, "wait", return_value=False):
+            self.assertFalse(self.plugin.drain(timeout=0))
+
+    def testExitCode(self):
+        with mock.patch.object(plugin.os, "_exit") as exit, \
+                mock.patch.object(self.plugin, "drain", side_effect=[True, False]) as drain:
+            self.plugin.on_lifecycle_drain(None, None, None, json.dumps({"timeout": 3}))
+            self.plugin.on_lifecycle_drain(None, None, None, "no json")
+        self.assertEqual(drain.call_args_list, [mock.call(timeout=3.0), mock.call(timeout=plugin.DRAIN_TIMEOUT)])
+        self.assertEqual(exit.call_args_list, [mock.call(0), mock.call(1)])
+
+
+class TestReregistration(BasePluginTestCase):
+    """
+    Tests the re-registration of a plugin the plugin manager does not know.
+    """
+
+    def testReregister(self):
+        self.register()
+        self.plugin.state = "RUNNING"
+        self.plugin.on_lifecycle_reregister(
+            None, routing_key("platform.management.plugin.1234.lifecycle.reregister"), None, "{}")
+
+        #CHECK: the plugin registers with its uuid and keepalive interval.
+        call = self.conn.calls_to("platform.management.plugin.register")[-1]
+        self.assertEqual(call[1].get("uuid"), "1234")
+        self.assertEqual(call[1].get("heartbeat_interval"), 10)
+
+        #CHECK: it keeps its uuid and state and announces them.
+        self.respond(call, {"status": "OK", "uuid": "1234"})
+        self.assertEqual(self.plugin.registration_state, "REGISTERED")
+        self.assertEqual((self.plugin.uuid, self.plugin.state), ("1234", "RUNNING"))
+        self.assertEqual(self.conn.notifications[-1][0], "platform.management.plugin.1234.heartbeat")
+        self.assertEqual(self.conn.endpoints.count("platform.management.plugin.1234.lifecycle.*"), 1)
+
+    def testReregisterNewUuid(self):
+        self.register()
+        self.plugin.on_lifecycle_reregister(
+            None, routing_key("platform.management.plugin.1234.lifecycle.reregister"), None, "{}")
+        self.respond(self.conn.calls_to("platform.management.plugin.register")[-1],
+                     {"status": "OK", "uuid": "5678"})
+
+        #CHECK: a new uuid is given back to the plugin manager.
+        self.assertEqual(self.plugin.uuid, "1234")
+        self.assertEqual(self.conn.calls_to("platform.management.plugin.deregister")[-1][1], {"uuid": "5678"})
+
+    def testIgnoredReregister(self):
+        self.register()
+        # reregister for an uuid the plugin had before
+        self.plugin.on_lifecycle_reregister(
+            None, routing_key("platform.management.plugin.0000.lifecycle.reregister"), None, "{}")
+        # reregister while the plugin de-registers
+        self.plugin.registration_state = "UNREGISTERED"
+        self.plugin.on_lifecycle_reregister(
+            None, routing_key("platform.management.plugin.1234.lifecycle.reregister"), None, "{}")
+        self.assertEqual(len(self.conn.calls_to("platform.management.plugin.register")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -33,23 +33,26 @@ import argparse
 import requests
 import json
 
+# all requests share one keep-alive connection to the plugin manager
+SESSION = requests.Session()
+
 
 def plugin_list(endpoint):
-    r = requests.get("%s/api/plugins" % endpoint)
+    r = SESSION.get("%s/api/plugins" % endpoint)
     if r.status_code != 200:
         _request_failed(r.status_code)
     print(r.json())
 
 
 def plugin_info(uuid, endpoint):
-    r = requests.get("%s/api/plugins/%s" % (endpoint, uuid))
+    r = SESSION.get("%s/api/plugins/%s" % (endpoint, uuid))
     if r.status_code != 200:
         _request_failed(r.status_code)
     print(r.json())
 
 
 def plugin_remove(uuid, endpoint):
-    r = requests.delete("%s/api/plugins/%s" % (endpoint, uuid))
+    r = SESSION.delete("%s/api/plugins/%s" % (endpoint, uuid))
     if r.status_code != 200:
         _request_failed(r.status_code)
     print(r.json())
@@ -57,8 +60,8 @@ def plugin_remove(uuid, endpoint):
 
 def plugin_lifecycle_start(uuid, endpoint):
     req = {"target_state": "start"}
-    r = requests.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
-                     json=json.dumps(req))
+    r = SESSION.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
+                    json=json.dumps(req))
     if r.status_code != 200:
         _request_failed(r.status_code)
     print(r.json())
@@ -66,8 +69,26 @@ def plugin_lifecycle_start(uuid, endpoint):
 
 def plugin_lifecycle_pause(uuid, endpoint):
     req = {"target_state": "pause"}
-    r = requests.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
-                     json=json.dumps(req))
+    r = SESSION.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
+                    json=json.dumps(req))
+    if r.status_code != 200:
+        _request_failed(r.status_code)
+    print(r.json())
+
+
+def plugin_lifecycle_resume(uuid, endpoint):
+    req = {"target_state": "resume"}
+    r = SESSION.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
+                    json=json.dumps(req))
+    if r.status_code != 200:
+        _request_failed(r.status_code)
+    print(r.json())
+
+
+def plugin_lifecycle_reload_config(uuid, endpoint):
+    req = {"target_state": "reload-config"}
+    r = SESSION.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
+                    json=json.dumps(req))
     if r.status_code != 200:
         _request_failed(r.status_code)
     print(r.json())
@@ -75,8 +96,17 @@ def plugin_lifecycle_pause(uuid, endpoint):
 
 def plugin_lifecycle_stop(uuid, endpoint):
     req = {"target_state": "stop"}
-    r = requests.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
-                     json=json.dumps(req))
+    r = SESSION.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
+                    json=json.dumps(req))
+    if r.status_code != 200:
+        _request_failed(r.status_code)
+    print(r.json())
+
+
+def plugin_lifecycle_drain(uuid, endpoint):
+    req = {"target_state": "drain"}
+    r = SESSION.put("%s/api/plugins/%s/lifecycle" % (endpoint, uuid),
+                    json=json.dumps(req))
     if r.status_code != 200:
         _request_failed(r.status_code)
     print(r.json())
@@ -98,7 +128,8 @@ def _request_failed(code):
 parser = argparse.ArgumentParser(description='son-pm-cli')
 parser.add_argument(
     "command",
-    choices=['list', 'info', 'remove', 'lifecycle-start', 'lifecycle-pause', 'lifecycle-stop'],
+    choices=['list', 'info', 'remove', 'lifecycle-start', 'lifecycle-pause', 'lifecycle-resume',
+             'lifecycle-reload-config', 'lifecycle-drain', 'lifecycle-stop'],
     help="Action to be executed.")
 parser.add_argument(
     "--uuid", "-u", dest="uuid",
@@ -125,6 +156,12 @@ def main():
         plugin_lifecycle_start(args.get("uuid"), args.get("endpoint"))
     elif args.get("command") == "lifecycle-pause":
         plugin_lifecycle_pause(args.get("uuid"), args.get("endpoint"))
+    elif args.get("command") == "lifecycle-resume":
+        plugin_lifecycle_resume(args.get("uuid"), args.get("endpoint"))
+    elif args.get("command") == "lifecycle-reload-config":
+        plugin_lifecycle_reload_config(args.get("uuid"), args.get("endpoint"))
+    elif args.get("command") == "lifecycle-drain":
+        plugin_lifecycle_drain(args.get("uuid"), args.get("endpoint"))
     elif args.get("command") == "lifecycle-stop":
         plugin_lifecycle_stop(args.get("uuid"), args.get("endpoint"))
 
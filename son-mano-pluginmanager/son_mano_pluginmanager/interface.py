@@ -65,8 +65,8 @@ class PluginEndpoint(fr.Resource):
         LOG.debug("DELETE plugin: %r" % plugin_uuid)
         try:
             p = model.Plugin.objects.get(uuid=plugin_uuid)
-            # send lifecycle stop event to plugin
-            PM.send_stop_notification(p)
+            # let the plugin finish its in-flight work before it stops
+            PM.send_drain_notification(p)
             # TODO ensure that record is deleted even if plugin does not deregister itself (use a timeout?)
             return {}, 200
         except DoesNotExist as e:
@@ -89,8 +89,14 @@ class PluginLifecycleEndpoint(fr.Resource):
                  PM.send_start_notification(p)
             elif ts == "pause":
                 PM.send_pause_notification(p)
+            elif ts == "resume":
+                PM.send_resume_notification(p)
+            elif ts == "reload-config":
+                PM.send_reload_config_notification(p)
             elif ts == "stop":
                 PM.send_stop_notification(p)
+            elif ts == "drain":
+                PM.send_drain_notification(p, timeout=json.loads(request.json).get("timeout"))
             else:
                 return {"message": "Malformed request"}, 500
             return {}, 200
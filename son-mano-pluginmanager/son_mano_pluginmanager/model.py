@@ -29,7 +29,7 @@ partner consortium (www.sonata-nfv.eu).
 import logging
 import os
 from datetime import datetime
-from mongoengine import Document, connect, StringField, DateTimeField, BooleanField, signals
+from mongoengine import Document, connect, StringField, DateTimeField, BooleanField, FloatField, signals
 
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger("son-mano-pluginmanger:model")
@@ -46,8 +46,10 @@ class Plugin(Document):
     version = StringField(required=True)
     description = StringField(required=False)
     state = StringField(required=True, max_length=16)
-    registered_at = DateTimeField(default=datetime.now())
+    registered_at = DateTimeField(default=datetime.now)
     last_heartbeat_at = DateTimeField()
+    # keepalive interval announced by the plugin, plugins without are not expired
+    heartbeat_interval = FloatField(default=0)
     #deregistered = BooleanField(default=False)
 
     def __repr__(self):
@@ -74,13 +76,20 @@ class Plugin(Document):
         res["state"] = self.state
         res["registered_at"] = str(self.registered_at)
         res["last_heartbeat_at"] = str(self.last_heartbeat_at)
+        res["heartbeat_interval"] = self.heartbeat_interval
         return res
 
 
 def initialize(db="sonata-plugin-manager",
                host=os.environ.get("mongo_host", "127.0.0.1"),
                port=int(os.environ.get("mongo_port", 27017)),
-               clear_db=True):
+               clear_db=os.environ.get("mongo_clear_db", "false").lower() == "true"):
+    """
+    Connect to the plugin DB. By default, the registry of a previous run is kept
+    so that already registered plugins do not have to register again.
+    :param clear_db: drop all old data from the DB
+    :return:
+    """
     db_conn = connect(db, host=host, port=port)
     LOG.info("Connected to MongoDB %r@%s:%d" % (db, host, port))
     if clear_db:
@@ -34,9 +34,12 @@ import json
 import datetime
 import uuid
 import os
+import time
+import threading
+from collections import OrderedDict
 from mongoengine import DoesNotExist
 
-from sonmanobase.plugin import ManoBasePlugin
+from sonmanobase.plugin import ManoBasePlugin, decode_heartbeat
 from son_mano_pluginmanager import model
 from son_mano_pluginmanager import interface
 
@@ -45,6 +48,13 @@ LOG = logging.getLogger("son-mano-pluginmanger")
 LOG.setLevel(logging.INFO)
 logging.getLogger("son-mano-base:messaging").setLevel(logging.INFO)
 
+# Heartbeats are buffered and processed in one batch per window (in seconds)
+HEARTBEAT_BATCH_WINDOW = float(os.environ.get("heartbeat_batch_window", 0.5))
+# Plugins that stay silent for longer than this (in seconds) are removed. 0=never
+HEARTBEAT_TIMEOUT = float(os.environ.get("heartbeat_timeout", 35))
+# Max. number of unknown plugins that are asked to re-register at the same time
+MAX_REREGISTRATIONS = 1000
+
 
 class SonPluginManager(ManoBasePlugin):
     """
@@ -54,9 +64,25 @@ class SonPluginManager(ManoBasePlugin):
     """
 
     def __init__(self):
-        # initialize plugin DB model
+        # latest heartbeat per plugin uuid received in the current window
+        self._heartbeat_buffer = {}
+        self._heartbeat_buffer_lock = threading.Lock()
+        # serializes heartbeat processing and expiry of plugins
+        self._registry_lock = threading.Lock()
+        # (ManoBasePlugin keeps its own _started_at as a timestamp)
+        self._pm_started_at = datetime.datetime.now()
+        # uuids of unknown plugins asked to re-register, they may keep them
+        self._reregister_uuids = OrderedDict()
+        self._reregister_uuids_lock = threading.Lock()
+
+        # initialize plugin DB model (keeps plugins registered before a restart)
         model.initialize()
 
+        # start batch processing of received heartbeats
+        self._start_heartbeat_processing(HEARTBEAT_BATCH_WINDOW)
+        # remove plugins that stay silent
+        self._start_plugin_expiry(HEARTBEAT_TIMEOUT)
+
         # start up management interface
         interface.start(self)
 
@@ -64,13 +90,61 @@ class SonPluginManager(ManoBasePlugin):
         super(self.__class__, self).__init__(auto_register=False,
                                              auto_heartbeat_rate=0)
 
+    def _start_plugin_expiry(self, timeout):
+        """
+        Periodically remove plugins without a heartbeat for timeout seconds.
+        :param timeout: heartbeat timeout in seconds
+        :return:
+        """
+        if timeout <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(timeout / 2)
+                try:
+                    self._expire_silent_plugins(timeout)
+                except BaseException:
+                    LOG.exception("Error while expiring plugins:")
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def _expire_silent_plugins(self, timeout):
+        """
+        Remove all plugins that did not send a heartbeat for timeout seconds
+        (or three of their keepalive intervals, if longer). Plugins without
+        keepalive heartbeats are never removed. Plugins reloaded from the DB
+        are given a full timeout after our start.
+        :param timeout: heartbeat timeout in seconds
+        :return: list of uuids of the removed plugins
+        """
+        now = datetime.datetime.now()
+        expired = []
+        with self._registry_lock:
+            for p in model.Plugin.objects:
+                if not p.heartbeat_interval:
+                    continue
+                limit = now - datetime.timedelta(seconds=max(timeout, 3 * p.heartbeat_interval))
+                last_seen = max(t for t in [p.last_heartbeat_at, p.registered_at, self._pm_started_at]
+                                if t is not None)
+                if last_seen < limit:
+                    p.delete()
+                    expired.append(p.uuid)
+        if len(expired) > 0:
+            LOG.info("EXPIRED (no heartbeat for %ds): %r" % (timeout, expired))
+            self.send_plugin_status_update()
+        return expired
+
     def declare_subscriptions(self):
         """
         Declare topics to which we want to listen and define callback methods.
         """
         self.manoconn.register_async_endpoint(self._on_register, "platform.management.plugin.register")
         self.manoconn.register_async_endpoint(self._on_deregister, "platform.management.plugin.deregister")
-        self.manoconn.register_notification_endpoint(self._on_heartbeat, "platform.management.plugin.*.heartbeat")
+        # heartbeats are only buffered by the consumer thread (no thread per message)
+        self.manoconn.subscribe(self._on_heartbeat, "platform.management.plugin.*.heartbeat")
 
     def _send_lifecycle_notification(self, plugin, operation):
         """
@@ -88,9 +162,39 @@ class SonPluginManager(ManoBasePlugin):
     def send_stop_notification(self, plugin):
         self._send_lifecycle_notification(plugin, "stop")
 
+    def send_drain_notification(self, plugin, timeout=None):
+        """
+        Ask a plugin to finish its in-flight work, de-register and exit.
+        :param plugin: plugin object
+        :param timeout: optional drain deadline in seconds
+        :return:
+        """
+        message = {} if timeout is None else {"timeout": timeout}
+        self.manoconn.notify(
+            "platform.management.plugin.%s.lifecycle.drain" % str(plugin.uuid), json.dumps(message))
+
+    def send_reregister_notification(self, plugin_uuid):
+        """
+        Ask a plugin we do not know (anymore) to register again with its uuid.
+        :param plugin_uuid: uuid of the plugin
+        :return:
+        """
+        with self._reregister_uuids_lock:
+            self._reregister_uuids[str(plugin_uuid)] = True
+            while len(self._reregister_uuids) > MAX_REREGISTRATIONS:
+                self._reregister_uuids.popitem(last=False)
+        self.manoconn.notify(
+            "platform.management.plugin.%s.lifecycle.reregister" % str(plugin_uuid))
+
     def send_pause_notification(self, plugin):
         self._send_lifecycle_notification(plugin, "pause")
 
+    def send_resume_notification(self, plugin):
+        self._send_lifecycle_notification(plugin, "resume")
+
+    def send_reload_config_notification(self, plugin):
+        self._send_lifecycle_notification(plugin, "reload-config")
+
     def send_plugin_status_update(self):
         """
         Broadcast a plugin status update message to all interested plugins.
@@ -114,22 +218,33 @@ class SonPluginManager(ManoBasePlugin):
         """
         Event method that is called when a registration request is received.
         Registers the new plugin in the internal data model and returns
-        a fresh UUID that is used to identify it.
+        a fresh UUID that is used to identify it. Plugins that re-register
+        after we asked them to (send_reregister_notification) keep their
+        UUID, their state is taken from their next heartbeat.
         :param properties: request properties
         :param message: request body
         :return: response message
         """
         message = json.loads(str(message))
         pid = str(uuid.uuid4())
+        with self._reregister_uuids_lock:
+            if self._reregister_uuids.pop(str(message.get("uuid")), False):
+                pid = str(message.get("uuid"))
+        try:
+            heartbeat_interval = float(message.get("heartbeat_interval") or 0)
+        except (TypeError, ValueError):
+            heartbeat_interval = 0
         # create a entry in our plugin database
         p = model.Plugin(
             uuid=pid,
             name=message.get("name"),
             version=message.get("version"),
             description=message.get("description"),
-            state="REGISTERED"
+            state="REGISTERED",
+            heartbeat_interval=heartbeat_interval
         )
-        p.save()
+        with self._registry_lock:
+            p.save()
         LOG.info("REGISTERED: %r" % p)
         # broadcast a plugin status update to the other plugin
         self.send_plugin_status_update()
@@ -155,10 +270,11 @@ class SonPluginManager(ManoBasePlugin):
         message = json.loads(str(message))
 
         try:
-            p = model.Plugin.objects.get(uuid=message.get("uuid"))
-            p.delete()
+            with self._registry_lock:
+                p = model.Plugin.objects.get(uuid=message.get("uuid"))
+                p.delete()
         except DoesNotExist:
-            LOG.debug("Couldn't find plugin with UUID %r in DB" % pid)
+            LOG.debug("Couldn't find plugin with UUID %r in DB" % message.get("uuid"))
 
         LOG.info("DE-REGISTERED: %r" % message.get("uuid"))
         # broadcast a plugin status update to the other plugin
@@ -170,33 +286,83 @@ class SonPluginManager(ManoBasePlugin):
         return json.dumps(response)
 
     def _on_heartbeat(self, ch, method, properties, message):
-        message = json.loads(str(message))
-        pid = message.get("uuid")
-
+        """
+        Event method that is called when a heartbeat is received.
+        Only keeps the latest heartbeat of each plugin, the actual
+        processing is done in batches by _process_heartbeats.
+        """
         try:
-            p = model.Plugin.objects.get(uuid=pid)
+            hb = decode_heartbeat(message)
+        except ValueError:
+            LOG.debug("Dropped malformed heartbeat %r" % message)
+            return
+        with self._heartbeat_buffer_lock:
+            last = self._heartbeat_buffer.get(hb.get("uuid"))
+            if (last is not None and last.get("seq") is not None
+                    and hb.get("seq") is not None and hb.get("seq") < last.get("seq")):
+                # outdated heartbeat (reordered delivery)
+                return
+            self._heartbeat_buffer[hb.get("uuid")] = hb
+
+    def _start_heartbeat_processing(self, window):
+        """
+        Process the buffered heartbeats once per window in a separate thread.
+        :param window: length of a processing window in seconds
+        :return:
+        """
+        def run():
+            while True:
+                time.sleep(window)
+                with self._heartbeat_buffer_lock:
+                    batch = self._heartbeat_buffer
+                    self._heartbeat_buffer = {}
+                if len(batch) > 0:
+                    try:
+                        with self._registry_lock:
+                            self._process_heartbeats(batch)
+                    except BaseException:
+                        LOG.exception("Error while processing heartbeats:")
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def _process_heartbeats(self, batch):
+        """
+        Update the plugin DB with a batch of heartbeats. A single plugin status
+        update is broadcasted for all state changes of the batch.
+        :param batch: dict mapping plugin uuids to decoded heartbeats
+        :return:
+        """
+        change = False
+        now = datetime.datetime.now()
+        for pid, hb in batch.items():
+            try:
+                p = model.Plugin.objects.get(uuid=pid)
+            except DoesNotExist:
+                # e.g. expired while it was unreachable, it keeps its uuid
+                LOG.info("Heartbeat of unknown plugin %r. Asking it to re-register." % pid)
+                if pid is not None:
+                    self.send_reregister_notification(pid)
+                continue
 
             # update heartbeat timestamp
-            p.last_heartbeat_at = datetime.datetime.now()
-
-            change = False
+            p.last_heartbeat_at = now
 
             # TODO ugly: state management of plugins should be hidden with plugin class
-            if message.get("state") == "READY" and p.state != "READY":
+            if hb.get("state") == "READY" and p.state != "READY":
                 # a plugin just announced that it is ready, lets start it
                 self.send_start_notification(p)
                 change = True
-            elif message.get("state") != p.state:
+            elif hb.get("state") != p.state:
                 # lets keep track of the reported state update
-                p.state = message.get("state")
+                p.state = hb.get("state")
                 change = True
 
             p.save()
-            if change:
-                # there was a state change lets schedule an plugin status update notification
-                self.send_plugin_status_update()
-        except DoesNotExist:
-            LOG.debug("Couldn't find plugin with UUID %r in DB" % pid)
+        if change:
+            # there were state changes lets send a single plugin status update notification
+            self.send_plugin_status_update()
 
 
 def main():
@@ -30,8 +30,13 @@ import unittest
 import time
 import json
 import threading
+import datetime
 import requests
+from collections import OrderedDict
 from multiprocessing import Process
+from unittest import mock
+from mongoengine import DoesNotExist
+from son_mano_pluginmanager import model
 from son_mano_pluginmanager.pluginmanager import SonPluginManager
 from sonmanobase.messaging import ManoBrokerRequestResponseConnection
 
@@ -199,6 +204,112 @@ class TestPluginManagerMessageInterface(TestPluginManagerBase):
         self.waitForMessage()
 
 
+class FakeRegistry(list):
+    """
+    Stands in for model.Plugin.objects. Iterates over a snapshot, like a
+    query set, so plugins can be deleted while iterating.
+    """
+
+    def __iter__(self):
+        return iter(list.copy(self))
+
+    def get(self, uuid=None):
+        for p in self:
+            if p.uuid == uuid:
+                return p
+        raise DoesNotExist()
+
+
+class FakePlugin(object):
+    """
+    Plugin record that is kept in a list instead of MongoDB.
+    """
+
+    def __init__(self, registry, **kwargs):
+        self.registry = registry
+        self.uuid = kwargs.get("uuid")
+        self.name = kwargs.get("name")
+        self.version = kwargs.get("version")
+        self.description = kwargs.get("description")
+        self.state = kwargs.get("state")
+        self.heartbeat_interval = kwargs.get("heartbeat_interval", 0)
+        self.registered_at = kwargs.get("registered_at", datetime.datetime.now())
+        self.last_heartbeat_at = kwargs.get("last_heartbeat_at")
+
+    def save(self):
+        self.registry[:] = [p for p in self.registry if p.uuid != self.uuid] + [self]
+
+    def delete(self):
+        self.registry.remove(self)
+
+    def to_dict(self):
+        return {"uuid": self.uuid, "state": self.state}
+
+
+class TestPluginManagerRegistry(unittest.TestCase):
+    """
+    Tests the plugin registry of the plugin manager without broker and MongoDB.
+    """
+
+    def setUp(self):
+        self.registry = FakeRegistry()
+        registry = self.registry
+
+        class Plugin(object):
+            objects = registry
+
+            def __new__(cls, **kwargs):
+                return FakePlugin(registry, **kwargs)
+
+        patcher = mock.patch.object(model, "Plugin", Plugin)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # the plugin manager is not started, so there is nothing to de-register
+        patcher = mock.patch.object(SonPluginManager, "__del__", lambda self: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pm = SonPluginManager.__new__(SonPluginManager)
+        self.addCleanup(delattr, self, "pm")
+        self.pm._registry_lock = threading.Lock()
+        self.pm._reregister_uuids = OrderedDict()
+        self.pm._reregister_uuids_lock = threading.Lock()
+        self.pm._pm_started_at = datetime.datetime.now() - datetime.timedelta(seconds=100)
+        self.pm._started_at = time.time()  # set by ManoBasePlugin
+        self.pm.manoconn = mock.Mock()
+
+    def register(self, **message):
+        return json.loads(self.pm._on_register(None, None, None, json.dumps(message)))
+
+    def testExpiry(self):
+        silent = datetime.datetime.now() - datetime.timedelta(seconds=60)
+        FakePlugin(self.registry, uuid="silent", heartbeat_interval=10, registered_at=silent).save()
+        FakePlugin(self.registry, uuid="alive", heartbeat_interval=10, registered_at=silent,
+                   last_heartbeat_at=datetime.datetime.now()).save()
+        FakePlugin(self.registry, uuid="slow", heartbeat_interval=30, registered_at=silent).save()
+        FakePlugin(self.registry, uuid="no-keepalive", heartbeat_interval=0, registered_at=silent).save()
+
+        #CHECK: only the silent plugin with keepalive is removed.
+        self.assertEqual(self.pm._expire_silent_plugins(35), ["silent"])
+        self.assertEqual(sorted(p.uuid for p in self.registry), ["alive", "no-keepalive", "slow"])
+
+    def testReregistration(self):
+        pid = self.register(name="p", heartbeat_interval=10).get("uuid")
+        self.registry[0].registered_at -= datetime.timedelta(seconds=60)
+        self.assertEqual(self.pm._expire_silent_plugins(35), [pid])
+
+        #CHECK: a heartbeat of the expired plugin asks it to re-register, it keeps its uuid.
+        self.pm._process_heartbeats({pid: {"uuid": pid, "state": "RUNNING", "seq": 5}})
+        self.pm.manoconn.notify.assert_called_with("platform.management.plugin.%s.lifecycle.reregister" % pid)
+        self.assertEqual(self.register(name="p", uuid=pid, state="PAUSED").get("uuid"), pid)
+        self.assertEqual(self.registry[0].state, "REGISTERED")
+
+        #CHECK: other uuids and a second registration with the same uuid get a new one.
+        self.assertNotEqual(self.register(name="p", uuid=pid).get("uuid"), pid)
+        self.assertNotEqual(self.register(name="q", uuid="other").get("uuid"), "other")
+
+
 class TestPluginManagerManagementInterface(TestPluginManagerBase):
     """
     Test the REST management interface of the plugin manager.
@@ -38,6 +38,9 @@ LOG = logging.getLogger("fsm-smart")
 LOG.setLevel(logging.DEBUG)
 logging.getLogger("son-mano-base:messaging").setLevel(logging.INFO)
 
+# keep-alive connections to the vFW controller are reused for all alerts
+SESSION = requests.Session()
+
 
 class SmartFSM(sonSMbase):
 
@@ -83,7 +86,7 @@ class SmartFSM(sonSMbase):
                 entry1 = ''
                 try:
                     self.timeout = time.time() + 60 * 5
-                    entry1 = requests.post(url='http://' + endpoint + ':8080/stats/flowentry/add',
+                    entry1 = SESSION.post(url='http://' + endpoint + ':8080/stats/flowentry/add',
                                    data=json.dumps({"dpid": 1, "cookie": 200, "priority": 1000,
                                                     "match": {"dl_type": 0x0800, "nw_proto": 17, "udp_dst": 5001}}))
                     if (entry1.status_code == 200):